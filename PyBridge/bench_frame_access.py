@@ -0,0 +1,90 @@
+"""Per-frame latency and allocation benchmark for ShmVideoReceiver frame access.
+
+Compares the old path (wrap BGRx buffer, slice to BGR, .copy()) against a
+zero-copy FrameHandle view and a FrameBufferPool copy, on a synthetic mapped
+buffer so it runs without a producer:
+
+    python bench_frame_access.py --width 1920 --height 1080 --frames 300
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from frame_buffers import FrameBufferPool, FrameHandle
+
+
+class FakeBuffer:
+    """Stands in for a mapped Gst.Buffer"""
+
+    def unmap(self, map_info):
+        pass
+
+
+def legacy_access(data, width, height, pool):
+    frame = np.ndarray(shape=(height, width, 4), dtype=np.uint8, buffer=data)
+    return frame[:, :, 0:3].copy()
+
+
+def handle_access(data, width, height, pool):
+    frame = np.ndarray(shape=(height, width, 4), dtype=np.uint8, buffer=data)
+    with FrameHandle(None, FakeBuffer(), None, frame) as handle:
+        return handle.bgr[0, 0, 0]
+
+
+def pool_access(data, width, height, pool):
+    frame = np.ndarray(shape=(height, width, 4), dtype=np.uint8, buffer=data)
+    with FrameHandle(None, FakeBuffer(), None, frame) as handle:
+        return pool.copy(handle.bgr)
+
+
+def measure(access, data, width, height, frames):
+    pool = FrameBufferPool(count=3)
+    access(data, width, height, pool)  # warm-up (pool allocation happens here)
+
+    latencies = []
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(frames):
+        start = time.perf_counter()
+        result = access(data, width, height, pool)
+        latencies.append(time.perf_counter() - start)
+        del result
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "peak_alloc_mb": peak / 1024 / 1024,
+        "pool_allocations_after_warmup": pool.allocations - (pool.count if access is pool_access else 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame access benchmark")
+    parser.add_argument("--width", type=int, default=1920, help="Frame width")
+    parser.add_argument("--height", type=int, default=1080, help="Frame height")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per method")
+    args = parser.parse_args()
+
+    # Read-only, like the memoryview handed out by Gst.Buffer.map
+    data = memoryview(bytes(np.random.randint(0, 256, args.width * args.height * 4, dtype=np.uint8)))
+
+    results = {}
+    for name, access in (("legacy_copy", legacy_access),
+                         ("handle_view", handle_access),
+                         ("pool_copy", pool_access)):
+        results[name] = measure(access, data, args.width, args.height, args.frames)
+
+    print(json.dumps({"width": args.width, "height": args.height, "frames": args.frames,
+                      "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""Headless loopback benchmark for UDPVideoReceiver and ShmVideoReceiver.
+
+For every transport and resolution it starts a videotestsrc sender
+(x264enc ! rtph264pay ! udpsink, or shmsink) in one process and the
+receiver in another, with no display, and prints one JSON report:
+
+    python bench_transports.py --transports udp shm --resolutions 640x480 1920x1080 --fps 30
+    python bench_transports.py --duration 20 --output bench.json
+
+The sender stamps each frame with its capture time and frame number as
+black/white blocks in the top-left corner, so latency is glass (sender
+capture) to receiver delivery, and drops are counted against what was sent.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from proc_stats import read_cpu_seconds, read_memory_mb
+from receiver_scripts import RECEIVER_SCRIPTS, load_script
+from video_formats import FrameLayout
+
+# Stamp: rows of 16x16 blocks, 24 bits per row. Rows 0-1 carry a 48-bit
+# microsecond wall-clock time, row 2 the sender's frame number.
+BLOCK = 16
+BITS_PER_ROW = 24
+STAMP_ROWS = 3
+TIME_MASK = (1 << 48) - 1
+MIN_WIDTH, MIN_HEIGHT = BLOCK * BITS_PER_ROW, BLOCK * STAMP_ROWS
+
+
+def write_stamp(luma, timestamp_us, frame_number):
+    """Draw the stamp into a Y plane (2-D uint8 array)"""
+    words = [timestamp_us >> BITS_PER_ROW, timestamp_us, frame_number]
+    for row, word in enumerate(words):
+        for bit in range(BITS_PER_ROW):
+            value = 255 if (word >> (BITS_PER_ROW - 1 - bit)) & 1 else 0
+            luma[row * BLOCK:(row + 1) * BLOCK, bit * BLOCK:(bit + 1) * BLOCK] = value
+
+
+def read_stamp(plane):
+    """Decode (timestamp_us, frame_number) from a Y plane or packed BGR(x) frame,
+    sampling the centre of each block so compression artefacts don't matter"""
+    centres = plane[BLOCK // 2:STAMP_ROWS * BLOCK:BLOCK, BLOCK // 2:BITS_PER_ROW * BLOCK:BLOCK]
+    if centres.ndim == 3:
+        centres = centres[..., :3].mean(axis=2)
+    words = []
+    for row in centres > 127:
+        word = 0
+        for bit in row:
+            word = (word << 1) | int(bit)
+        words.append(word)
+    return (words[0] << BITS_PER_ROW) | words[1], words[2]
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    n = len(values)
+    return {
+        "count": n,
+        "p50": values[min(n - 1, int(0.50 * n))],
+        "p95": values[min(n - 1, int(0.95 * n))],
+        "p99": values[min(n - 1, int(0.99 * n))],
+        "max": values[-1],
+    }
+
+
+# --- sender ---------------------------------------------------------------
+
+def sender_chain(args):
+    if args.transport == 'udp':
+        return (f"x264enc tune=zerolatency speed-preset=ultrafast key-int-max={args.fps} "
+                f"bitrate={args.bitrate} ! rtph264pay config-interval=1 pt=96 ! "
+                f"udpsink host=127.0.0.1 port={args.port} sync=false")
+    shm_size = args.width * args.height * 3 // 2 * 8
+    return (f"shmsink socket-path={args.socket_path} shm-size={shm_size} "
+            f"wait-for-connection=false sync=false")
+
+
+def run_sender(args):
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst, GLib
+
+    Gst.init(None)
+    caps = f"video/x-raw,format=I420,width={args.width},height={args.height},framerate={args.fps}/1"
+    source = Gst.parse_launch(
+        f"videotestsrc is-live=true pattern=ball ! {caps} ! "
+        f"appsink name=capture emit-signals=true sync=false max-buffers=1 drop=true"
+    )
+    output = Gst.parse_launch(f"appsrc name=out is-live=true format=time caps=\"{caps}\" ! {sender_chain(args)}")
+    appsrc = output.get_by_name('out')
+    layout = FrameLayout.default('I420', args.width, args.height)
+    frame_number = [0]
+
+    def on_sample(sink):
+        sample = sink.emit('pull-sample')
+        buf = sample.get_buffer()
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            return Gst.FlowReturn.OK
+        try:
+            data = bytearray(map_info.data)
+        finally:
+            buf.unmap(map_info)
+        # Stamped at capture, before encoding/transport
+        write_stamp(layout.plane_views(data)[0], time.time_ns() // 1000 & TIME_MASK, frame_number[0])
+        frame_number[0] = (frame_number[0] + 1) & ((1 << BITS_PER_ROW) - 1)
+        out = Gst.Buffer.new_wrapped(bytes(data))
+        out.pts = buf.pts
+        out.duration = buf.duration
+        appsrc.emit('push-buffer', out)
+        return Gst.FlowReturn.OK
+
+    source.get_by_name('capture').connect('new-sample', on_sample)
+    output.set_state(Gst.State.PLAYING)
+    source.set_state(Gst.State.PLAYING)
+    try:
+        GLib.MainLoop().run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.set_state(Gst.State.NULL)
+        output.set_state(Gst.State.NULL)
+
+
+# --- receiver -------------------------------------------------------------
+
+def create_receiver(args):
+    filename, class_name = RECEIVER_SCRIPTS[args.transport]
+    module = load_script(filename, class_name.lower())
+    # The scripts log every 100th frame at DEBUG; keep stderr readable
+    logging.getLogger(class_name).setLevel(logging.WARNING)
+    if args.transport == 'udp':
+        return module.UDPVideoReceiver(host='127.0.0.1', port=args.port, latency=args.latency)
+    return module.ShmVideoReceiver(socket_path=args.socket_path, width=args.width, height=args.height,
+                                   format='I420', validation='none', output=args.shm_output)
+
+
+def frame_plane(handle):
+    # Native I420 frames: the Y plane; BGR(x): the packed frame
+    return handle.planes[0] if handle.planes else handle.array
+
+
+def run_receiver(args):
+    receiver = create_receiver(args)
+    receiver.start()
+    pid = os.getpid()
+
+    latencies = []
+    sent = set()
+    received = 0
+    undecodable = 0
+    last_seq = 0
+    skipped = 0
+    measuring = False
+    warmup_end = time.monotonic() + args.warmup
+    end = warmup_end + args.duration
+
+    while time.monotonic() < end:
+        frame = receiver.wait_for_frame(last_seq, timeout=1.0)
+        if frame is None:
+            continue
+        with frame:
+            now_us = time.time_ns() // 1000
+            timestamp_us, frame_number = read_stamp(frame_plane(frame.frame))
+        if not measuring:
+            if time.monotonic() < warmup_end:
+                last_seq = frame.seq
+                continue
+            measuring = True
+            cpu_start = read_cpu_seconds(pid)
+            wall_start = time.monotonic()
+        else:
+            skipped += frame.seq - last_seq - 1
+        last_seq = frame.seq
+        received += 1
+        latency_ms = ((now_us - timestamp_us) & TIME_MASK) / 1000
+        if latency_ms > 10000:
+            # Garbled stamp (decoder artefacts right after a loss)
+            undecodable += 1
+            continue
+        latencies.append(latency_ms)
+        sent.add(frame_number)
+
+    result = {"transport": args.transport, "width": args.width, "height": args.height, "fps_target": args.fps}
+    if not measuring:
+        receiver.stop()
+        result["error"] = "no frames received"
+        return result
+
+    wall = time.monotonic() - wall_start
+    cpu_percent = (read_cpu_seconds(pid) - cpu_start) / wall * 100
+    rss, peak_rss = read_memory_mb(pid)
+    receiver_stats = receiver.get_stats()
+    receiver.stop()
+
+    expected = (max(sent) - min(sent) + 1) if sent else 0
+    result.update({
+        "duration_s": wall,
+        "frames": received,
+        "fps": received / wall,
+        "megapixels_per_s": received * args.width * args.height / wall / 1e6,
+        "latency_ms": percentiles(latencies),
+        "frames_sent": expected,
+        "drop_rate": (1 - len(sent) / expected) * 100 if expected else 0.0,
+        "skipped_by_consumer": skipped,
+        "undecodable_stamps": undecodable,
+        "cpu_percent": cpu_percent,
+        "rss_mb": rss,
+        "peak_rss_mb": peak_rss,
+        "receiver_stats": receiver_stats,
+    })
+    return result
+
+
+# --- orchestration --------------------------------------------------------
+
+def role_args(args, transport, width, height, role):
+    return [sys.executable, os.path.abspath(__file__), '--role', role,
+            '--transports', transport, '--width', str(width), '--height', str(height),
+            '--fps', str(args.fps), '--duration', str(args.duration), '--warmup', str(args.warmup),
+            '--port', str(args.port), '--socket-path', args.socket_path, '--latency', str(args.latency),
+            '--bitrate', str(args.bitrate), '--shm-output', args.shm_output]
+
+
+def run_case(args, transport, width, height):
+    sender = subprocess.Popen(role_args(args, transport, width, height, 'sender'),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(args.startup_delay)
+        proc = subprocess.run(role_args(args, transport, width, height, 'receiver'),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              timeout=args.warmup + args.duration + 30)
+        if proc.returncode != 0 or not proc.stdout.strip():
+            return {"transport": transport, "width": width, "height": height,
+                    "error": f"receiver exited with {proc.returncode}"}
+        return json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    except subprocess.TimeoutExpired:
+        return {"transport": transport, "width": width, "height": height, "error": "receiver timed out"}
+    finally:
+        sender.terminate()
+        sender.wait()
+        if transport == 'shm' and os.path.exists(args.socket_path):
+            os.unlink(args.socket_path)
+
+
+def parse_resolution(value):
+    width, height = (int(v) for v in value.lower().split('x'))
+    if width < MIN_WIDTH or height < MIN_HEIGHT:
+        raise argparse.ArgumentTypeError(f"resolution must be at least {MIN_WIDTH}x{MIN_HEIGHT}")
+    return width, height
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark for the UDP/RTP and SHM receivers")
+    parser.add_argument("--transports", nargs='+', choices=sorted(RECEIVER_SCRIPTS), default=['udp', 'shm'])
+    parser.add_argument("--resolutions", nargs='+', type=parse_resolution,
+                        default=[(640, 480), (1280, 720), (1920, 1080)], help="WIDTHxHEIGHT ...")
+    parser.add_argument("--fps", type=int, default=30, help="Sender frame rate")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per case")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds ignored after the first frame")
+    parser.add_argument("--startup-delay", type=float, default=1.0, help="Seconds between sender and receiver start")
+    parser.add_argument("--port", type=int, default=5600, help="UDP port for the RTP stream")
+    parser.add_argument("--socket-path", default="/tmp/bench-video-stream", help="shmsink socket path")
+    parser.add_argument("--latency", type=int, default=50, help="UDP receiver jitterbuffer latency in ms")
+    parser.add_argument("--bitrate", type=int, default=4000, help="x264enc bitrate in kbit/s")
+    parser.add_argument("--shm-output", choices=["bgr", "native"], default="bgr", help="ShmVideoReceiver output mode")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    # Internal: a single sender or receiver process of one case
+    parser.add_argument("--role", choices=["sender", "receiver"], help=argparse.SUPPRESS)
+    parser.add_argument("--width", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--height", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role:
+        args.transport = args.transports[0]
+        if args.role == 'sender':
+            run_sender(args)
+        else:
+            print(json.dumps(run_receiver(args)))
+        return
+
+    report = {
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "cases": [run_case(args, transport, width, height)
+                  for transport in args.transports
+                  for width, height in args.resolutions],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
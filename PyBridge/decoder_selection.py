@@ -0,0 +1,191 @@
+"""H.264 decoder selection: probe which hardware/software decoders work on
+this host once, rank them and build the decode chain for the best one.
+
+    chain = select_decoder().decode_chain()
+    # "vah264dec" / "avdec_h264 max-threads=0" / ...
+    pipeline = f"... ! h264parse ! {chain} ! videoconvert ! video/x-raw,format=BGR ! appsink"
+
+benchmark_decoders() times every working candidate on a short synthetic clip,
+for when the static ranking is not good enough.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+logger = logging.getLogger("DecoderSelection")
+
+
+class DecoderCandidate:
+    """A decoder element plus what it needs to hand system-memory raw video
+    to a plain videoconvert"""
+
+    def __init__(self, family, decoder, converter=None, decoder_props=None):
+        self.family = family
+        self.decoder = decoder
+        # NVMM buffers have to go through nvvideoconvert before system memory
+        self.converter = converter
+        self.decoder_props = decoder_props or {}
+
+    @property
+    def hardware(self):
+        return self.family != 'libav'
+
+    def elements(self):
+        return [self.decoder] + ([self.converter.split()[0]] if self.converter else [])
+
+    def decode_chain(self, threads=None):
+        """Launch-syntax fragment from encoded H.264 to raw video"""
+        props = dict(self.decoder_props)
+        if threads is not None and 'max-threads' in props:
+            props['max-threads'] = threads
+        chain = ' '.join([self.decoder] + [f"{k}={v}" for k, v in props.items()])
+        if self.converter:
+            chain += f" ! {self.converter}"
+        return chain
+
+    def __repr__(self):
+        return f"DecoderCandidate({self.family}: {self.decoder})"
+
+
+# Preferred order: NVIDIA, VA-API, V4L2 memory-to-memory, then libav threads
+DECODER_CANDIDATES = [
+    DecoderCandidate('nvidia', 'nvv4l2decoder', converter='nvvideoconvert ! video/x-raw,format=BGRx'),
+    DecoderCandidate('nvidia', 'nvh264dec'),
+    DecoderCandidate('vaapi', 'vah264dec'),
+    DecoderCandidate('vaapi', 'vaapih264dec'),
+    DecoderCandidate('v4l2m2m', 'v4l2h264dec'),
+    DecoderCandidate('libav', 'avdec_h264', decoder_props={'max-threads': 0}),
+]
+
+_probe_lock = threading.Lock()
+_probed = None
+_benchmarked = None
+
+
+def element_works(name):
+    """Registry lookup, then instantiate and take the element to READY, which
+    is where hardware decoders open (and fail on) their device"""
+    if Gst.ElementFactory.find(name) is None:
+        return False
+    element = Gst.ElementFactory.make(name, None)
+    if element is None:
+        return False
+    try:
+        return element.set_state(Gst.State.READY) != Gst.StateChangeReturn.FAILURE
+    finally:
+        element.set_state(Gst.State.NULL)
+
+
+def probe_decoders(refresh=False):
+    """Working candidates in preference order. Probed once per process."""
+    global _probed
+    with _probe_lock:
+        if _probed is None or refresh:
+            if not Gst.is_initialized():
+                Gst.init(None)
+            start = time.perf_counter()
+            _probed = [c for c in DECODER_CANDIDATES if all(element_works(e) for e in c.elements())]
+            logger.info(f"Usable H.264 decoders ({(time.perf_counter() - start) * 1000:.0f} ms): "
+                        f"{[c.decoder for c in _probed] or 'none'}")
+        return list(_probed)
+
+
+def _encode_clip(path, frames, width, height):
+    """Write the benchmark clip; False if it can't be made (e.g. no x264enc)"""
+    try:
+        pipeline = Gst.parse_launch(
+            f"videotestsrc num-buffers={frames} pattern=ball ! "
+            f"video/x-raw,format=I420,width={width},height={height},framerate=30/1 ! "
+            f"x264enc speed-preset=ultrafast tune=zerolatency key-int-max=30 ! "
+            f"video/x-h264,stream-format=byte-stream ! filesink location={path}"
+        )
+    except GLib.Error as e:
+        logger.warning(f"Cannot encode the benchmark clip: {e.message}")
+        return False
+    return _run_to_eos(pipeline) is not None
+
+
+def _run_to_eos(pipeline, timeout=60):
+    """Play until EOS; returns elapsed seconds or None on error/timeout"""
+    bus = pipeline.get_bus()
+    start = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        msg = bus.timed_pop_filtered(timeout * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg is None or msg.type == Gst.MessageType.ERROR:
+            if msg is not None:
+                err, _ = msg.parse_error()
+                logger.warning(f"Benchmark pipeline failed: {err.message}")
+            return None
+        return time.perf_counter() - start
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def benchmark_decoders(candidates=None, frames=300, width=1280, height=720):
+    """Decode the same synthetic clip with each candidate, fastest first.
+    Returns [{"decoder", "family", "fps"}] (fps None if it failed)."""
+    global _benchmarked
+    if candidates is None:
+        candidates = probe_decoders()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = os.path.join(tmp, 'clip.h264')
+        if not _encode_clip(clip, frames, width, height):
+            logger.warning("Skipping the decoder benchmark; ranking stays static")
+            return results
+        for candidate in candidates:
+            pipeline = Gst.parse_launch(
+                f"filesrc location={clip} ! h264parse ! {candidate.decode_chain()} ! "
+                f"videoconvert ! video/x-raw,format=BGR ! fakesink sync=false"
+            )
+            elapsed = _run_to_eos(pipeline)
+            fps = frames / elapsed if elapsed else None
+            results.append({"decoder": candidate.decoder, "family": candidate.family, "fps": fps})
+            logger.info(f"Decoder benchmark: {candidate.decoder} "
+                        f"{f'{fps:.0f} fps' if fps else 'failed'} at {width}x{height}")
+    results.sort(key=lambda r: r["fps"] or 0, reverse=True)
+    by_name = {c.decoder: c for c in candidates}
+    with _probe_lock:
+        _benchmarked = [by_name[r["decoder"]] for r in results if r["fps"]]
+    return results
+
+
+def select_decoder(benchmark=False):
+    """The fastest working decoder: by measured fps when benchmarked (now
+    or earlier in this process), otherwise by the static ranking"""
+    if benchmark and _benchmarked is None:
+        benchmark_decoders()
+    ranked = _benchmarked or probe_decoders()
+    if not ranked:
+        raise RuntimeError("No usable H.264 decoder found (tried "
+                           f"{', '.join(c.decoder for c in DECODER_CANDIDATES)})")
+    logger.info(f"Selected H.264 decoder: {ranked[0].decoder} ({ranked[0].family})")
+    return ranked[0]
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Probe and benchmark the available H.264 decoders")
+    parser.add_argument("--benchmark", action="store_true", help="Time each decoder on a synthetic clip")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    args = parser.parse_args()
+
+    Gst.init(None)
+    report = {"available": [c.decoder for c in probe_decoders()]}
+    if args.benchmark:
+        report["benchmark"] = benchmark_decoders(frames=args.frames, width=args.width, height=args.height)
+    report["selected"] = select_decoder().decoder
+    print(json.dumps(report, indent=2))
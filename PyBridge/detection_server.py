@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Detection metadata over WebSocket for the frontend overlay.
+
+Takes frames from a UDPVideoReceiver or ShmVideoReceiver, runs a CPU
+detector on the newest one and sends every connected client
+
+    {"frame_number":123,"pts":4100000000,"timestamp":1760000000.123456,
+     "objects":[{"object_id":1,"class_id":0,"label":"person","confidence":0.9,
+                 "polygon":[{"x":0.1,"y":0.2},...]}]}
+
+on ws://<host>:9001/, the address websocketService.js connects to.
+
+"pts" is the sender's RTP time (UDP) and matches frames exactly in a
+PyBridge FrameSync. It is not comparable with the video server's X-PTS,
+which is that server's own pipeline clock. "timestamp" is the wall-clock
+time the receiver got the frame; /video_feed clients join on it against
+X-Timestamp, which is accurate to the receiver's transport latency. Each
+result is encoded once and shared. Every client has a latest-only slot,
+so a slow client skips stale results instead of queueing them. Detection
+only runs while at least one client is connected.
+
+    python detection_server.py --transport udp --port 5000 --detector stub
+    python detection_server.py --transport shm --socket-path /tmp/video-stream --detector motion
+
+A plain HTTP GET on the same address returns the server stats as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from aiohttp import WSMsgType, web
+
+from detectors import DETECTORS, load_detector
+from receiver_scripts import RECEIVER_SCRIPTS, load_receiver_class
+from rtp_stats import PercentileWindow
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('DetectionServer')
+
+
+def encode_detections(frame_number, detections, pts=None, timestamp=None):
+    """Compact JSON for one frame's results. `pts` (ns) lets a FrameSync on
+    the display side match them to the exact frame; `timestamp` (unix
+    seconds) is for consumers on another clock, such as /video_feed."""
+    message = {"frame_number": frame_number, "objects": [d.to_dict() for d in detections]}
+    if pts is not None:
+        message["pts"] = pts
+    if timestamp is not None:
+        message["timestamp"] = round(timestamp, 6)
+    return json.dumps(message, separators=(',', ':'))
+
+
+class ClientSlot:
+    """Latest-only mailbox of one WebSocket client. Owned by the event loop."""
+
+    def __init__(self, remote):
+        self.remote = remote
+        self.payload = None
+        self.event = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+
+    def put(self, payload):
+        if self.payload is not None:
+            # The client hasn't taken the previous result yet: replace it
+            self.coalesced += 1
+        self.payload = payload
+        self.event.set()
+
+    async def take(self):
+        await self.event.wait()
+        self.event.clear()
+        payload, self.payload = self.payload, None
+        return payload
+
+
+class DetectionServer:
+    def __init__(self, receiver, detector, max_fps=None):
+        self.receiver = receiver
+        self.detector = detector
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.clients = set()
+        self.latest = None
+        self.loop = None
+        self.running = False
+        self.thread = None
+        self._demand = threading.Event()
+
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.messages_sent = 0
+        self.messages_coalesced = 0
+        self.detect_ms = PercentileWindow()
+
+        self.app = web.Application()
+        self.app.router.add_get('/', self.handle)
+        self.app.on_startup.append(self._on_startup)
+        self.app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_startup(self, app):
+        self.loop = asyncio.get_running_loop()
+        self.running = True
+        self.thread = threading.Thread(target=self._detect_loop, daemon=True)
+        self.thread.start()
+
+    async def _on_cleanup(self, app):
+        self.running = False
+        self._demand.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+
+    # --- detection thread ---------------------------------------------------
+
+    def _detect_loop(self):
+        last_seq = 0
+        while self.running:
+            if not self._demand.is_set():
+                # Frames nobody asked for don't count as skipped
+                last_seq = 0
+                self._demand.wait(timeout=0.5)
+                continue
+            received = self.receiver.wait_for_frame(last_seq, timeout=0.5)
+            if received is None:
+                continue
+            with received:
+                frame = self.receiver.copy_bgr(received.frame)
+            if last_seq:
+                # Frames that arrived while the detector was busy
+                self.frames_skipped += received.seq - last_seq - 1
+            last_seq = received.seq
+
+            started = time.perf_counter()
+            try:
+                detections = self.detector.detect(frame, received.seq)
+            except Exception as e:
+                logger.error(f"Detector {self.detector.name} failed on frame {received.seq}: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            self.detect_ms.add(elapsed * 1000)
+            self.frames_processed += 1
+
+            # arrival is monotonic; express it on the wall clock
+            timestamp = time.time() - (time.monotonic() - received.arrival)
+            payload = encode_detections(received.seq, detections, received.pts, timestamp)
+            self.loop.call_soon_threadsafe(self._broadcast, payload)
+            if self.min_interval > elapsed:
+                time.sleep(self.min_interval - elapsed)
+
+    # --- event loop -----------------------------------------------------------
+
+    def _broadcast(self, payload):
+        self.latest = payload
+        for client in self.clients:
+            client.put(payload)
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        if not ws.can_prepare(request).ok:
+            return web.json_response(self.get_stats())
+        await ws.prepare(request)
+
+        client = ClientSlot(request.remote)
+        self.clients.add(client)
+        self._demand.set()
+        logger.info(f"Client {client.remote} connected ({len(self.clients)} active)")
+        if self.latest is not None:
+            client.put(self.latest)
+        sender = asyncio.create_task(self._send(ws, client))
+        try:
+            async for msg in ws:
+                # Nothing is expected from clients; just notice the close
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            sender.cancel()
+            self.clients.discard(client)
+            if not self.clients:
+                self._demand.clear()
+            self.messages_coalesced += client.coalesced
+            logger.info(f"Client {client.remote} disconnected (sent={client.sent}, "
+                        f"coalesced={client.coalesced}, {len(self.clients)} active)")
+        return ws
+
+    async def _send(self, ws, client):
+        try:
+            while not ws.closed:
+                payload = await client.take()
+                await ws.send_str(payload)
+                client.sent += 1
+                self.messages_sent += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+
+    def get_stats(self):
+        return {
+            "detector": self.detector.name,
+            "clients": len(self.clients),
+            "frames_processed": self.frames_processed,
+            "frames_skipped": self.frames_skipped,
+            "messages_sent": self.messages_sent,
+            "messages_coalesced": self.messages_coalesced + sum(c.coalesced for c in self.clients),
+            "detect_ms": self.detect_ms.get_stats(),
+            "receiver": self.receiver.get_stats(),
+        }
+
+    def run(self, host='0.0.0.0', port=9001):
+        logger.info(f"Serving detections from {self.detector.name} on ws://{host}:{port}/")
+        web.run_app(self.app, host=host, port=port, print=None)
+
+
+def create_receiver(args):
+    receiver_class = load_receiver_class(args.transport)
+    if args.transport == 'udp':
+        return receiver_class(host=args.host, port=args.port, latency=args.latency)
+    return receiver_class(socket_path=args.socket_path, width=args.width, height=args.height,
+                          format=args.format)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detection metadata WebSocket server")
+    parser.add_argument("--transport", choices=sorted(RECEIVER_SCRIPTS), default="udp")
+    parser.add_argument("--host", default="0.0.0.0", help="UDP: address to receive on")
+    parser.add_argument("--port", type=int, default=5000, help="UDP: port to receive on")
+    parser.add_argument("--latency", type=int, default=50, help="UDP: jitterbuffer latency in ms")
+    parser.add_argument("--socket-path", default="/tmp/video-stream", help="SHM: socket path")
+    parser.add_argument("--width", type=int, default=1920, help="SHM: video width")
+    parser.add_argument("--height", type=int, default=1080, help="SHM: video height")
+    parser.add_argument("--format", default="I420", help="SHM: video format")
+    parser.add_argument("--detector", default="stub",
+                        help=f"One of {', '.join(sorted(DETECTORS))} or module:Class")
+    parser.add_argument("--max-fps", type=float, help="Cap the detection rate")
+    parser.add_argument("--ws-host", default="0.0.0.0", help="WebSocket bind address")
+    parser.add_argument("--ws-port", type=int, default=9001, help="WebSocket port")
+    args = parser.parse_args()
+
+    receiver = create_receiver(args)
+    detector = load_detector(args.detector)
+    receiver.start()
+    try:
+        DetectionServer(receiver, detector, max_fps=args.max_fps).run(host=args.ws_host, port=args.ws_port)
+    finally:
+        detector.close()
+        receiver.stop()
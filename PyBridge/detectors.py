@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Pluggable CPU object detectors for the detection metadata server.
+
+A detector turns one BGR frame into a list of Detection objects with
+polygons in normalized (0-1) coordinates, the format the frontend overlay
+expects. `load_detector()` accepts a built-in name or `module:Class`.
+"""
+
+import importlib
+import math
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # only MotionDetector needs it
+    cv2 = None
+
+
+class Detection:
+    __slots__ = ('object_id', 'class_id', 'label', 'confidence', 'polygon')
+
+    def __init__(self, object_id, class_id, label, confidence, polygon):
+        self.object_id = object_id
+        self.class_id = class_id
+        self.label = label
+        self.confidence = confidence
+        self.polygon = polygon  # [(x, y), ...] normalized to 0-1
+
+    def to_dict(self, precision=4):
+        return {
+            "object_id": self.object_id,
+            "class_id": self.class_id,
+            "label": self.label,
+            "confidence": round(self.confidence, 3),
+            "polygon": [{"x": round(x, precision), "y": round(y, precision)} for x, y in self.polygon],
+        }
+
+
+class Detector:
+    name = 'base'
+
+    def detect(self, frame, frame_number):
+        """List of Detection for one BGR frame (numpy array, HxWx3)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StubDetector(Detector):
+    """Deterministic moving boxes that ignore the pixels: exercises the
+    whole metadata path without a model or a GPU"""
+    name = 'stub'
+    LABELS = ((0, 'person'), (1, 'face'), (2, 'hand'))
+
+    def __init__(self, objects=3):
+        self.objects = objects
+
+    def detect(self, frame, frame_number):
+        detections = []
+        for i in range(self.objects):
+            class_id, label = self.LABELS[i % len(self.LABELS)]
+            phase = frame_number / 60.0 + i * 2 * math.pi / self.objects
+            cx, cy = 0.5 + 0.3 * math.cos(phase), 0.5 + 0.3 * math.sin(phase)
+            half = 0.05 + 0.02 * i
+            detections.append(Detection(i + 1, class_id, label, 0.9 - 0.1 * i, [
+                (cx - half, cy - half), (cx + half, cy - half),
+                (cx + half, cy + half), (cx - half, cy + half),
+            ]))
+        return detections
+
+
+class MotionDetector(Detector):
+    """Frame differencing on a downscaled grey image; each moving region is
+    reported as a generic object with its convex hull"""
+    name = 'motion'
+
+    def __init__(self, width=320, threshold=25, min_area=0.002, max_objects=20):
+        if cv2 is None:
+            raise RuntimeError("MotionDetector needs OpenCV (cv2)")
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_objects = max_objects
+        self._previous = None
+
+    def detect(self, frame, frame_number):
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        grey = cv2.cvtColor(cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        grey = cv2.GaussianBlur(grey, (5, 5), 0)
+        previous, self._previous = self._previous, grey
+        if previous is None or previous.shape != grey.shape:
+            return []
+
+        _, mask = cv2.threshold(cv2.absdiff(previous, grey), self.threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_pixels = self.min_area * self.width * height
+        contours = sorted((c for c in contours if cv2.contourArea(c) >= min_pixels),
+                          key=cv2.contourArea, reverse=True)[:self.max_objects]
+
+        scale = np.array([1.0 / self.width, 1.0 / height])
+        detections = []
+        for i, contour in enumerate(contours):
+            hull = cv2.convexHull(contour).reshape(-1, 2) * scale
+            confidence = min(1.0, cv2.contourArea(contour) / (min_pixels * 10))
+            detections.append(Detection(i + 1, 3, 'motion', confidence, [tuple(p) for p in hull.tolist()]))
+        return detections
+
+
+DETECTORS = {cls.name: cls for cls in (StubDetector, MotionDetector)}
+
+
+def load_detector(spec, **kwargs):
+    """'stub', 'motion' or 'package.module:ClassName'"""
+    if spec in DETECTORS:
+        return DETECTORS[spec](**kwargs)
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f"Unknown detector {spec!r}, expected one of {sorted(DETECTORS)} or module:Class")
+    return getattr(importlib.import_module(module_name), class_name)(**kwargs)
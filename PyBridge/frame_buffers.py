@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+
+from video_formats import to_bgr
+
+
+class FrameHandle:
+    """Read-only view of a received frame that keeps the Gst.Sample and its
+    buffer mapping alive until every holder has released it.
+
+        with receiver.acquire_frame() as frame:
+            analyse(frame.array)
+
+    Arrays taken from the handle (including slices of them) must not be used
+    after release: they point straight into the GStreamer buffer.
+    """
+
+    def __init__(self, sample, buffer, map_info, array, layout=None, planes=None):
+        self._sample = sample
+        self._buffer = buffer
+        self._map_info = map_info
+        self._refs = 1
+        self._lock = threading.Lock()
+        self._convert_lock = threading.Lock()
+        self._bgr = None
+        self.array = array
+        # Native-format frames: FrameLayout plus one view per plane (Y, U, V...)
+        self.layout = layout
+        self.planes = planes
+
+    @property
+    def bgr(self):
+        """BGR view of a BGRx frame (non-contiguous, no copy)"""
+        return self.array[:, :, :3]
+
+    def to_bgr(self):
+        """Owned BGR copy of the frame. Native YUV frames are converted on the
+        first call only; later calls (from any thread) reuse the result."""
+        # Our own reference, taken under _lock, keeps a concurrent release()
+        # from unmapping the buffer mid-conversion. The separate lock means a
+        # slow conversion never blocks acquire/release.
+        self.acquire()
+        try:
+            with self._convert_lock:
+                if self._bgr is None:
+                    if self.layout is None:
+                        self._bgr = self.bgr.copy()
+                    else:
+                        self._bgr = to_bgr(self.layout, self.planes, self._map_info.data)
+                return self._bgr
+        finally:
+            self.release()
+
+    @property
+    def released(self):
+        return self._refs == 0
+
+    def acquire(self):
+        with self._lock:
+            if self._refs == 0:
+                raise RuntimeError("Frame has already been released")
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            if self._refs == 0:
+                return
+            self._refs -= 1
+            if self._refs:
+                return
+        self.array = None
+        self.planes = None
+        self._buffer.unmap(self._map_info)
+        self._sample = self._buffer = self._map_info = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class FrameBufferPool:
+    """Preallocated round-robin buffers for a consumer that wants writable
+    copies of frames without allocating. A buffer is handed out again after
+    `count` further copies, so hold on to at most count-1 of them at a time."""
+
+    def __init__(self, count=3):
+        self.count = count
+        self._buffers = []
+        self._index = 0
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def copy(self, src):
+        with self._lock:
+            if not self._buffers or self._buffers[0].shape != src.shape or self._buffers[0].dtype != src.dtype:
+                # First frame or resolution change: (re)allocate the whole pool
+                self._buffers = [np.empty(src.shape, dtype=src.dtype) for _ in range(self.count)]
+                self._index = 0
+                self.allocations += self.count
+            dst = self._buffers[self._index]
+            self._index = (self._index + 1) % self.count
+            # Under the lock, so concurrent callers can't interleave writes
+            # into a buffer the index has already wrapped around to
+            np.copyto(dst, src)
+        return dst
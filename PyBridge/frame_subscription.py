@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger("FrameSubscription")
+
+
+class ReceivedFrame:
+    """A delivered frame with its sequence number, capture PTS (ns, or None
+    when unknown) and arrival time (time.monotonic()).
+
+    If the frame is a FrameHandle, the subscriber holds its own reference:
+    use the ReceivedFrame as a context manager or call release().
+    """
+    __slots__ = ('seq', 'pts', 'arrival', 'frame')
+
+    def __init__(self, seq, pts, arrival, frame):
+        self.seq = seq
+        self.pts = pts
+        self.arrival = arrival
+        self.frame = frame
+
+    def claim(self):
+        """A new ReceivedFrame holding its own reference to the frame"""
+        if hasattr(self.frame, 'acquire'):
+            self.frame.acquire()
+        return ReceivedFrame(self.seq, self.pts, self.arrival, self.frame)
+
+    def release(self):
+        if hasattr(self.frame, 'release'):
+            self.frame.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class FrameNotifier:
+    """Latest-frame slot with sequence numbers that consumers can block on,
+    iterate asynchronously or register callbacks with, instead of polling.
+
+    A consumer that sees seq jump from N to N+k missed exactly k-1 frames.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._latest = None
+        self._seq = 0
+        self._closed = False
+        self._async_waiters = []
+        self._callbacks = ()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def publish(self, frame, pts=None):
+        """Called by the receiver thread for every new frame"""
+        with self._cond:
+            self._seq += 1
+            previous = self._latest
+            current = self._latest = ReceivedFrame(self._seq, pts, time.monotonic(), frame)
+            waiters, self._async_waiters = self._async_waiters, []
+            self._cond.notify_all()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+        for callback in self._callbacks:
+            try:
+                callback(current)
+            except Exception as e:
+                logger.error(f"Frame callback {callback} failed: {e}")
+        # Drop the slot's reference only after swapping, so a subscriber that
+        # claimed the previous frame under the lock still holds a valid one
+        if previous is not None:
+            previous.release()
+
+    def get_latest(self):
+        """The newest frame (claimed for the caller) or None"""
+        with self._cond:
+            return self._latest.claim() if self._latest is not None else None
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """Sleep until a frame newer than after_seq exists and return it
+        (claimed for the caller). Returns None on timeout or close."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq or self._closed, timeout):
+                return None
+            if self._seq <= after_seq or self._latest is None:
+                return None
+            return self._latest.claim()
+
+    async def frames_async(self, after_seq=0):
+        """Async iterator over new frames. Each frame is released when the
+        loop moves on to the next one."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._closed or (self._seq > after_seq and self._latest is None):
+                    return
+                if self._seq > after_seq:
+                    received = self._latest.claim()
+                    waiter = None
+                else:
+                    received = None
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+            if waiter is not None:
+                await waiter
+                continue
+            after_seq = received.seq
+            try:
+                yield received
+            finally:
+                received.release()
+
+    def add_callback(self, callback):
+        """callback(ReceivedFrame) runs on the receiver thread for every frame
+        and must return quickly; claim the frame to keep it afterwards."""
+        with self._cond:
+            self._callbacks = self._callbacks + (callback,)
+
+    def remove_callback(self, callback):
+        with self._cond:
+            self._callbacks = tuple(c for c in self._callbacks if c is not callback)
+
+    def close(self):
+        """Wake every waiter and drop the last frame"""
+        with self._cond:
+            self._closed = True
+            latest, self._latest = self._latest, None
+            waiters, self._async_waiters = self._async_waiters, []
+            self._cond.notify_all()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+        if latest is not None:
+            latest.release()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Join detection results to the exact video frames they were computed on.
+
+Detections arrive separately from (and usually later than) the frames. The
+display side pushes every frame into FrameSync, keyed by its PTS; a frame is
+released together with the detection whose PTS is within `tolerance_ns`,
+or without one once `lookahead` newer frames are waiting, so matching never
+delays the picture by more than that many frames.
+
+UDPVideoReceiver frames carry the sender's RTP time as pts, which the
+detection server forwards in its messages, so the two sides agree even in
+different processes.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import threading
+
+try:
+    import cv2
+except ImportError:  # only draw_detections needs it
+    cv2 = None
+
+logger = logging.getLogger('FrameSync')
+
+
+class FrameSync:
+    def __init__(self, tolerance_ns=20_000_000, lookahead=1, history=64):
+        self.tolerance_ns = tolerance_ns
+        self.lookahead = lookahead
+        self._lock = threading.Lock()
+        self._pending = collections.deque()  # (pts, frame) in arrival order
+        self._detections = collections.deque(maxlen=history)  # (pts, detection)
+        self.matched = 0
+        self.unmatched = 0
+
+    def add_detection(self, pts, detection):
+        """Called from any thread, e.g. a WebSocket listener"""
+        if pts is None:
+            return
+        with self._lock:
+            self._detections.append((pts, detection))
+
+    def push_frame(self, pts, frame):
+        """Queue a frame; returns the (frame, detection or None) pairs that
+        are ready, oldest first"""
+        with self._lock:
+            self._pending.append((pts, frame))
+            return self._release()
+
+    def poll(self):
+        """Pairs whose detection arrived since the last call"""
+        with self._lock:
+            return self._release()
+
+    def _match(self, pts):
+        if pts is None:
+            return None
+        best, best_delta = None, self.tolerance_ns + 1
+        for detection_pts, detection in self._detections:
+            delta = abs(detection_pts - pts)
+            if delta < best_delta:
+                best, best_delta = detection, delta
+        return best
+
+    def _release(self):
+        ready = []
+        while self._pending:
+            pts, frame = self._pending[0]
+            detection = self._match(pts)
+            if detection is None and len(self._pending) <= self.lookahead:
+                # Still within the lookahead: give the detection a chance
+                break
+            self._pending.popleft()
+            if detection is None:
+                self.unmatched += 1
+            else:
+                self.matched += 1
+            ready.append((frame, detection))
+        return ready
+
+    def get_stats(self):
+        total = self.matched + self.unmatched
+        return {
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "match_rate": self.matched / total if total else None,
+            "pending": len(self._pending),
+        }
+
+
+class DetectionListener:
+    """Feeds a FrameSync from the detection WebSocket server in a background
+    thread. Messages without a pts can't be matched and are ignored."""
+
+    def __init__(self, sync, url='ws://127.0.0.1:9001/', reconnect_delay=2.0):
+        self.sync = sync
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._run()), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    async def _run(self):
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            while self.running:
+                try:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        logger.info(f"Receiving detections from {self.url}")
+                        async for msg in ws:
+                            if not self.running:
+                                break
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                message = json.loads(msg.data)
+                                self.sync.add_detection(message.get('pts'), message)
+                except (aiohttp.ClientError, ValueError) as e:
+                    logger.warning(f"Detection feed {self.url}: {e}")
+                if self.running:
+                    await asyncio.sleep(self.reconnect_delay)
+
+
+def draw_detections(frame, message, color=(0, 255, 136)):
+    """Draw a detection server message's polygons onto a BGR frame"""
+    height, width = frame.shape[:2]
+    for obj in message.get('objects', ()):
+        points = [(int(p['x'] * width), int(p['y'] * height)) for p in obj.get('polygon', ())]
+        if len(points) < 2:
+            continue
+        for start, end in zip(points, points[1:] + points[:1]):
+            cv2.line(frame, start, end, color, 2)
+        cv2.putText(frame, f"{obj.get('label', '')} {obj.get('confidence', 0):.2f}", points[0],
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
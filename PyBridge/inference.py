@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Batched CPU inference on receiver frames, off the display thread.
+
+InferenceStage takes the newest frames from a UDPVideoReceiver or
+ShmVideoReceiver and resizes and normalizes each one once, straight into a
+slot of a preallocated NCHW float32 batch tensor. Batches go to a worker
+pool when full or when the oldest frame has waited `max_wait_ms`. There are
+only workers + 1 batch tensors: when the model falls behind, the collector
+waits for one to come back and the frames that arrived meanwhile are
+skipped, not queued. Frames older than `max_age_ms` are skipped too.
+
+    python inference.py --transport udp --port 5000 --model model.onnx --batch-size 8 --workers 2
+    python inference.py --transport shm --model stub --stub-ms 30
+
+The model is an ONNX file run by onnxruntime (optional dependency) or the
+"stub" model, which only sleeps. Threads suit onnxruntime, which releases
+the GIL; --executor process runs one model per process instead.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import queue
+import signal
+import threading
+import time
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # nearest-neighbour NumPy resize below
+    cv2 = None
+
+from rtp_stats import PercentileWindow
+
+logger = logging.getLogger('InferenceStage')
+
+# ImageNet statistics, the usual default for ONNX vision models
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class Preprocessor:
+    """BGR(x) uint8 frame -> normalized RGB float32 CHW slot, in place"""
+
+    def __init__(self, width=640, height=640, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.width = width
+        self.height = height
+        std = np.asarray(std, dtype=np.float32)
+        # (x / 255 - mean) / std == x * scale + offset, per channel
+        self._scale = (1.0 / (255.0 * std)).reshape(3, 1, 1)
+        self._offset = (-np.asarray(mean, dtype=np.float32) / std).reshape(3, 1, 1)
+        self._resized = {}  # per channel count: BGR or BGRx
+        self._index = {}
+
+    def _resize(self, frame):
+        if frame.shape[:2] == (self.height, self.width):
+            return frame
+        channels = frame.shape[2]
+        resized = self._resized.get(channels)
+        if resized is None:
+            resized = self._resized[channels] = np.empty((self.height, self.width, channels), np.uint8)
+        if cv2 is not None:
+            return cv2.resize(frame, (self.width, self.height), dst=resized, interpolation=cv2.INTER_LINEAR)
+        rows, cols = self._index.get(frame.shape[:2]) or self._index.setdefault(frame.shape[:2], (
+            (np.arange(self.height) * frame.shape[0] // self.height)[:, None],
+            np.arange(self.width) * frame.shape[1] // self.width))
+        np.copyto(resized, frame[rows, cols])
+        return resized
+
+    def fill(self, slot, frame):
+        # BGR(x) -> RGB and HWC -> CHW are views; the two ufuncs write the slot
+        chw = self._resize(frame).transpose(2, 0, 1)[2::-1]
+        np.multiply(chw, self._scale, out=slot)
+        np.add(slot, self._offset, out=slot)
+
+
+class StubModel:
+    """Stands in for a real model: sleeps `ms` per batch plus `per_frame_ms`
+    per frame and returns each frame's mean"""
+    name = 'stub'
+    input_size = None
+
+    def __init__(self, ms=20.0, per_frame_ms=2.0):
+        self.ms = ms
+        self.per_frame_ms = per_frame_ms
+
+    def run(self, batch, count):
+        time.sleep((self.ms + self.per_frame_ms * count) / 1000)
+        return [batch[:count].mean(axis=(1, 2, 3))]
+
+
+class OnnxModel:
+    """An ONNX model with one NCHW image input, run on the CPU"""
+
+    def __init__(self, path, threads=0):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        # Symbolic dimensions come back as strings
+        self.fixed_batch = batch if isinstance(batch, int) else None
+        self.input_size = (width, height) if isinstance(width, int) and isinstance(height, int) else None
+        self.name = path
+
+    def run(self, batch, count):
+        if self.fixed_batch:
+            # Pad with whatever the unused slots hold and drop those outputs
+            outputs = self.session.run(None, {self.input_name: batch[:self.fixed_batch]})
+            return [output[:count] for output in outputs]
+        return self.session.run(None, {self.input_name: batch[:count]})
+
+
+def load_model(spec, threads=0, stub_ms=20.0):
+    if spec == 'stub':
+        return StubModel(ms=stub_ms)
+    return OnnxModel(spec, threads=threads)
+
+
+def _run_timed(model, batch, count):
+    started = time.monotonic()
+    outputs = model.run(batch, count)
+    return outputs, started, time.monotonic()
+
+
+# Process pool workers each load their own model
+_worker_model = None
+
+
+def _init_worker(spec, threads, stub_ms):
+    global _worker_model
+    # Ctrl-C reaches the whole process group; the parent's stop() shuts
+    # the pool down, so workers mustn't die mid-batch first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_model = load_model(spec, threads=threads, stub_ms=stub_ms)
+
+
+def _run_in_worker(batch, count):
+    return _run_timed(_worker_model, batch, count)
+
+
+class InferenceStage:
+    def __init__(self, receiver, model='stub', batch_size=4, max_wait_ms=10, max_age_ms=200,
+                 workers=1, executor='thread', input_size=None, model_threads=0, stub_ms=20.0,
+                 on_result=None):
+        self.receiver = receiver
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_age = max_age_ms / 1000
+        self.on_result = on_result
+        self.running = False
+        self.thread = None
+
+        if executor == 'process':
+            # Probe the input size here; each worker loads its own copy
+            probe = load_model(model, threads=model_threads, stub_ms=stub_ms)
+            self.model = None
+            self.model_name = probe.name
+            model_size = probe.input_size
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(model, model_threads, stub_ms))
+            self._run = lambda batch, count: self.pool.submit(_run_in_worker, batch, count)
+        else:
+            self.model = load_model(model, threads=model_threads, stub_ms=stub_ms)
+            self.model_name = self.model.name
+            model_size = self.model.input_size
+            self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='inference')
+            self._run = lambda batch, count: self.pool.submit(_run_timed, self.model, batch, count)
+
+        width, height = input_size or model_size or (640, 640)
+        self.preprocessor = Preprocessor(width, height)
+        # One batch being filled plus one per worker; nothing else can queue up
+        self._free = queue.Queue()
+        for _ in range(workers + 1):
+            self._free.put(np.empty((batch_size, 3, height, width), dtype=np.float32))
+
+        self.frames_in = 0
+        self.frames_skipped = 0
+        self.frames_stale = 0
+        self.frames_done = 0
+        self.batches = 0
+        self.latest = None
+        self._started_at = None
+        self.preprocess_ms = PercentileWindow()
+        self.batch_fill_ms = PercentileWindow()
+        self.queue_ms = PercentileWindow()
+        self.inference_ms = PercentileWindow()
+        self.end_to_end_ms = PercentileWindow()
+
+    def start(self):
+        self.running = True
+        self._started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def _collect(self):
+        last_seq = 0
+        while self.running:
+            try:
+                batch = self._free.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            frames = []  # (seq, pts, arrival) per filled slot
+            deadline = None
+            while self.running and len(frames) < self.batch_size:
+                timeout = 0.5 if deadline is None else deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                received = self.receiver.wait_for_frame(last_seq, timeout=timeout)
+                if received is None:
+                    continue
+                with received:
+                    if last_seq:
+                        # Arrived while we were busy or waiting for a free batch
+                        self.frames_skipped += received.seq - last_seq - 1
+                    last_seq = received.seq
+                    self.frames_in += 1
+                    if time.monotonic() - received.arrival > self.max_age:
+                        self.frames_stale += 1
+                        continue
+                    started = time.perf_counter()
+                    self.preprocessor.fill(batch[len(frames)], self._bgr(received.frame))
+                    self.preprocess_ms.add((time.perf_counter() - started) * 1000)
+                if not frames:
+                    deadline = time.monotonic() + self.max_wait
+                frames.append((received.seq, received.pts, received.arrival))
+
+            if not frames:
+                self._free.put(batch)
+                continue
+            submitted = time.monotonic()
+            self.batch_fill_ms.add((submitted - frames[0][2]) * 1000)
+            future = self._run(batch, len(frames))
+            future.add_done_callback(lambda f, b=batch, fr=frames, s=submitted: self._done(f, b, fr, s))
+
+    def _bgr(self, frame):
+        """Packed BGR(x) pixels of a FrameHandle, without a copy unless the
+        frame is in a native YUV format"""
+        if not hasattr(frame, 'array'):
+            return frame
+        if frame.layout is None or frame.layout.format in ('BGR', 'BGRx', 'BGRA'):
+            return frame.array
+        return frame.to_bgr()
+
+    def _done(self, future, batch, frames, submitted):
+        self._free.put(batch)
+        try:
+            outputs, started, finished = future.result()
+        except concurrent.futures.CancelledError:
+            return
+        except Exception as e:
+            logger.error(f"Inference failed on a batch of {len(frames)}: {e}")
+            return
+        now = time.monotonic()
+        self.queue_ms.add((started - submitted) * 1000)
+        self.inference_ms.add((finished - started) * 1000)
+        self.batches += 1
+        self.frames_done += len(frames)
+        results = []
+        for i, (seq, pts, arrival) in enumerate(frames):
+            self.end_to_end_ms.add((now - arrival) * 1000)
+            results.append((seq, pts, [output[i] for output in outputs]))
+        self.latest = results[-1]
+        if self.on_result:
+            self.on_result(results)
+
+    def get_stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            "model": self.model_name,
+            "frames_in": self.frames_in,
+            "frames_done": self.frames_done,
+            "frames_skipped": self.frames_skipped,
+            "frames_stale": self.frames_stale,
+            "throughput_fps": self.frames_done / elapsed if elapsed else 0.0,
+            "batches": self.batches,
+            "mean_batch_size": self.frames_done / self.batches if self.batches else 0.0,
+            "stages_ms": {
+                "preprocess": self.preprocess_ms.get_stats(),
+                "batch_fill": self.batch_fill_ms.get_stats(),
+                "queue": self.queue_ms.get_stats(),
+                "inference": self.inference_ms.get_stats(),
+                "end_to_end": self.end_to_end_ms.get_stats(),
+            },
+        }
+
+
+if __name__ == "__main__":
+    from receiver_scripts import RECEIVER_SCRIPTS, load_receiver_class
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Batched CPU inference on receiver frames")
+    parser.add_argument("--transport", choices=sorted(RECEIVER_SCRIPTS), default="udp")
+    parser.add_argument("--host", default="0.0.0.0", help="UDP: address to receive on")
+    parser.add_argument("--port", type=int, default=5000, help="UDP: port to receive on")
+    parser.add_argument("--socket-path", default="/tmp/video-stream", help="SHM: socket path")
+    parser.add_argument("--width", type=int, default=1920, help="SHM: video width")
+    parser.add_argument("--height", type=int, default=1080, help="SHM: video height")
+    parser.add_argument("--model", default="stub", help="Path to an .onnx model, or 'stub'")
+    parser.add_argument("--stub-ms", type=float, default=20.0, help="Stub model time per batch")
+    parser.add_argument("--input-size", help="Model input as WxH when the model doesn't fix it")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="Longest wait to fill a batch")
+    parser.add_argument("--max-age-ms", type=float, default=200, help="Skip frames older than this")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--model-threads", type=int, default=0, help="onnxruntime intra-op threads")
+    args = parser.parse_args()
+
+    receiver_class = load_receiver_class(args.transport)
+    if args.transport == 'udp':
+        receiver = receiver_class(host=args.host, port=args.port)
+    else:
+        receiver = receiver_class(socket_path=args.socket_path, width=args.width, height=args.height)
+    input_size = tuple(int(v) for v in args.input_size.split('x')) if args.input_size else None
+    stage = InferenceStage(receiver, model=args.model, batch_size=args.batch_size,
+                           max_wait_ms=args.max_wait_ms, max_age_ms=args.max_age_ms,
+                           workers=args.workers, executor=args.executor, input_size=input_size,
+                           model_threads=args.model_threads, stub_ms=args.stub_ms)
+    try:
+        receiver.start()
+        stage.start()
+        while True:
+            time.sleep(5)
+            print(json.dumps(stage.get_stats(), indent=2), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stage.stop()
+        receiver.stop()
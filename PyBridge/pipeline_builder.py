@@ -0,0 +1,245 @@
+"""Build the DeepStream script pipelines on hosts without NVIDIA elements.
+
+PipelineBuilder creates and links elements by factory name like the
+scripts always did, but an NV element that is missing (or fails to open
+its device) is replaced by its fastest CPU equivalent, and display sinks
+become a headless sink when there is no display:
+
+    nvv4l2decoder / nvh264dec   avdec_h264 max-threads=0
+    nvvideoconvert              videoconvert n-threads=0
+    nveglglessink, autovideosink, ... (headless)  fakesink / appsink
+
+The topology stays the same, so FpsReport on the sink gives an achieved
+fps that can be compared across GPU and CPU-only hosts.
+
+    builder = PipelineBuilder(cpu_only=args.cpu)
+    builder.make("filesrc", "file-source", {"location": path})
+    ...
+    sink = builder.make("nveglglessink", "renderer")
+    builder.link()
+    report = FpsReport(sink)
+
+enable_tracers() and TracerLog collect GstTracer proctime/latency records
+per element for benchmarks.
+"""
+
+import collections
+import logging
+import os
+import re
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from decoder_selection import element_works
+
+logger = logging.getLogger("PipelineBuilder")
+
+# 0 threads = one per core for both libav and videoconvert
+CPU_EQUIVALENTS = {
+    'nvv4l2decoder': ('avdec_h264', {'max-threads': 0}),
+    'nvh264dec': ('avdec_h264', {'max-threads': 0}),
+    'nvvideoconvert': ('videoconvert', {'n-threads': 0}),
+}
+
+DISPLAY_SINKS = {'nveglglessink', 'nv3dsink', 'eglglessink', 'glimagesink', 'xvimagesink',
+                 'ximagesink', 'waylandsink', 'autovideosink'}
+
+# Headless sinks keep the display sink's clock sync, so a file still plays
+# in real time; appsink drops rather than blocks, since nothing pulls from it
+HEADLESS_SINKS = {
+    'fakesink': {'sync': True},
+    'appsink': {'sync': True, 'drop': True, 'max-buffers': 1},
+}
+
+
+def display_available():
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+class PipelineBuilder:
+    def __init__(self, pipeline=None, cpu_only=False, headless=None, headless_sink='fakesink'):
+        if not Gst.is_initialized():
+            Gst.init(None)
+        self.pipeline = pipeline or Gst.Pipeline()
+        self.cpu_only = cpu_only
+        self.headless = not display_available() if headless is None else headless
+        self.headless_sink = headless_sink
+        self.elements = []
+        self.substitutions = {}  # element name -> (requested factory, used factory)
+
+    def _replacement(self, factory):
+        """(factory, properties) to use instead of `factory`, or None"""
+        if factory in DISPLAY_SINKS:
+            if self.headless or (self.cpu_only and factory.startswith('nv')) or not element_works(factory):
+                return self.headless_sink, HEADLESS_SINKS[self.headless_sink]
+            return None
+        if factory in CPU_EQUIVALENTS and (self.cpu_only or not element_works(factory)):
+            return CPU_EQUIVALENTS[factory]
+        return None
+
+    def make(self, factory, name, properties=None):
+        """Create, configure and add an element, linked after the previous
+        one by link(). Raises RuntimeError if neither the element nor a
+        replacement can be created."""
+        replacement = self._replacement(factory)
+        if replacement:
+            used, defaults = replacement
+            logger.info(f"{name}: {factory} -> {used}")
+            self.substitutions[name] = (factory, used)
+            # The requested element's properties may not apply; set the ones that do
+            properties = dict(properties or {}, **defaults)
+        else:
+            used = factory
+        element = Gst.ElementFactory.make(used, name)
+        if element is None:
+            raise RuntimeError(f"Unable to create {used} ({name})")
+        for key, value in (properties or {}).items():
+            if element.find_property(key) is None:
+                logger.debug(f"{name}: {used} has no property {key}, skipped")
+                continue
+            element.set_property(key, value)
+        self.pipeline.add(element)
+        self.elements.append(element)
+        return element
+
+    def link(self):
+        """Link the elements in the order they were made"""
+        for upstream, downstream in zip(self.elements, self.elements[1:]):
+            if not upstream.link(downstream):
+                raise RuntimeError(f"Unable to link {upstream.get_name()} to {downstream.get_name()}")
+        return self.pipeline
+
+    def describe(self):
+        """The chain as built, in launch-line form"""
+        return ' ! '.join(e.get_factory().get_name() for e in self.elements)
+
+
+class FpsReport:
+    """Counts buffers reaching an element's sink pad and logs the achieved
+    fps every `interval` seconds while a GLib main loop runs"""
+
+    def __init__(self, element, interval=5.0):
+        self.frames = 0
+        self.first = None
+        self.last = None
+        self._logged_frames = 0
+        self._logged_at = None
+        element.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
+        self._timer = GLib.timeout_add(int(interval * 1000), self._log) if interval else None
+
+    def _on_buffer(self, pad, info):
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = self._logged_at = now
+        self.last = now
+        self.frames += 1
+        return Gst.PadProbeReturn.OK
+
+    @property
+    def fps(self):
+        """Average over the whole run, first to last buffer"""
+        if self.frames < 2 or self.last == self.first:
+            return None
+        return (self.frames - 1) / (self.last - self.first)
+
+    def _log(self):
+        if self.first is not None:
+            now = time.perf_counter()
+            elapsed = now - self._logged_at
+            fps = (self.frames - self._logged_frames) / elapsed if elapsed else 0.0
+            logger.info(f"{fps:.1f} fps ({self.frames} frames)")
+            self._logged_frames, self._logged_at = self.frames, now
+        return True
+
+    def stop(self):
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+    def summary(self):
+        return {
+            "frames": self.frames,
+            "seconds": self.last - self.first if self.frames else 0.0,
+            "fps": self.fps,
+        }
+
+
+TRACER_RECORD = re.compile(r'\b(proctime|element-latency|latency), (.*);\s*$')
+TRACER_FIELD = re.compile(r'([\w-]+)=\((\w+)\)("(?:[^"\\]|\\.)*"|[^,;]*)')
+
+
+def enable_tracers(log_path, tracers='proctime;latency(flags=pipeline+element)'):
+    """Send GstTracer records to `log_path`. Tracers are set up by
+    Gst.init(), so this must run before it. Any other GST_DEBUG output
+    goes to the same file."""
+    if Gst.is_initialized():
+        raise RuntimeError("enable_tracers() must be called before Gst.init()")
+    os.environ['GST_TRACERS'] = tracers
+    debug = os.environ.get('GST_DEBUG')
+    os.environ['GST_DEBUG'] = f"{debug},GST_TRACER:7" if debug else "GST_TRACER:7"
+    os.environ['GST_DEBUG_FILE'] = log_path
+    os.environ['GST_DEBUG_NO_COLOR'] = '1'
+
+
+def _tracer_ns(kind, value):
+    if kind == 'string':
+        # GST_TIME_FORMAT, h:mm:ss.nnnnnnnnn
+        hours, minutes, seconds = value.strip('"').split(':')
+        return round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1e9)
+    return int(value)
+
+
+def _summary_ms(samples):
+    samples.sort()
+    n = len(samples)
+    return {
+        "count": n,
+        "mean": sum(samples) / n,
+        "p50": samples[min(n - 1, int(0.50 * n))],
+        "p95": samples[min(n - 1, int(0.95 * n))],
+        "max": samples[-1],
+    }
+
+
+class TracerLog:
+    """Reads the records enable_tracers() sends to its file. Each read()
+    covers what was logged since the previous one."""
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+
+    def read(self):
+        """{"proctime_ms": {element: stats}, "latency_ms": {element or
+        "src->sink": stats}}"""
+        samples = {"proctime_ms": collections.defaultdict(list),
+                   "latency_ms": collections.defaultdict(list)}
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        # Leave a partly written last line for the next read
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+        for line in data.decode(errors='replace').splitlines():
+            record = TRACER_RECORD.search(line)
+            if not record:
+                continue
+            fields = {key: (kind, value) for key, kind, value in TRACER_FIELD.findall(record.group(2))}
+            try:
+                if record.group(1) == 'latency':
+                    name = f"{fields['src-element'][1]}->{fields['sink-element'][1]}"
+                    kind = "latency_ms"
+                else:
+                    name = fields['element'][1]
+                    kind = "proctime_ms" if record.group(1) == 'proctime' else "latency_ms"
+                samples[kind][name.strip('"')].append(_tracer_ns(*fields['time']) / 1e6)
+            except (KeyError, ValueError):
+                logger.debug(f"Unparsed tracer record: {line}")
+        return {kind: {name: _summary_ms(values) for name, values in by_name.items()}
+                for kind, by_name in samples.items()}
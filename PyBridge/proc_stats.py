@@ -0,0 +1,23 @@
+"""Per-process CPU and memory readings from /proc (Linux only), shared by
+the benchmarks."""
+
+import os
+
+
+def read_cpu_seconds(pid):
+    """utime + stime of a process, from /proc (Linux only)"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def read_memory_mb(pid):
+    """(current RSS, peak RSS) in MB"""
+    rss = peak = 0.0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith('VmHWM:'):
+                peak = int(line.split()[1]) / 1024
+    return rss, peak
@@ -0,0 +1,28 @@
+"""Import the hyphenated receiver scripts (udp-receiver-debug.py,
+shm-receiver-debug.py) as modules, for tools built on their receivers.
+
+Importing only defines the receivers: the scripts' display environment,
+log file and SIGINT handler are set up under their __main__ guards."""
+
+import importlib.util
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECEIVER_SCRIPTS = {
+    'udp': ('udp-receiver-debug.py', 'UDPVideoReceiver'),
+    'shm': ('shm-receiver-debug.py', 'ShmVideoReceiver'),
+}
+
+
+def load_script(filename, module_name):
+    """Import one of the hyphenated receiver scripts as a module"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_receiver_class(transport):
+    """UDPVideoReceiver or ShmVideoReceiver for 'udp' / 'shm'"""
+    filename, class_name = RECEIVER_SCRIPTS[transport]
+    return getattr(load_script(filename, class_name.lower()), class_name)
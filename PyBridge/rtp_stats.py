@@ -0,0 +1,104 @@
+import collections
+
+
+class RtpSequenceTracker:
+    """Loss / reordering / duplicate accounting from RTP sequence numbers
+    (16-bit, wrapping), in packet arrival order.
+
+    A gap counts its missing packets as lost; if one of them turns up later
+    it is reclassified from lost to reordered.
+    """
+
+    def __init__(self, history=256):
+        self.expected = None
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self._recent = collections.deque(maxlen=history)
+        self._recent_set = set()
+
+    def _remember(self, seq):
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_set.discard(self._recent[0])
+        self._recent.append(seq)
+        self._recent_set.add(seq)
+
+    def update(self, seq):
+        self.received += 1
+        if self.expected is None:
+            self.expected = (seq + 1) & 0xFFFF
+            self._remember(seq)
+            return
+
+        delta = (seq - self.expected) & 0xFFFF
+        if delta == 0:
+            self.expected = (seq + 1) & 0xFFFF
+        elif delta < 0x8000:
+            # Jumped ahead: everything in between is missing (for now)
+            self.lost += delta
+            self.expected = (seq + 1) & 0xFFFF
+        elif seq in self._recent_set:
+            self.duplicates += 1
+            return
+        else:
+            # Arrived after a later packet: late, not lost after all
+            self.reordered += 1
+            self.lost = max(0, self.lost - 1)
+        self._remember(seq)
+
+    def get_stats(self):
+        expected = self.received - self.duplicates + self.lost
+        return {
+            "packets_received": self.received,
+            "packets_lost": self.lost,
+            "packets_reordered": self.reordered,
+            "packets_duplicated": self.duplicates,
+            "loss_rate": (self.lost / expected * 100) if expected else 0.0,
+        }
+
+
+class RtpTimestampUnwrapper:
+    """Extends 32-bit RTP timestamps to a monotonically growing counter"""
+
+    def __init__(self):
+        self._last = None
+        self._cycles = 0
+
+    def extend(self, ts):
+        if self._last is not None:
+            delta = (ts - self._last) & 0xFFFFFFFF
+            if delta < 0x80000000 and ts < self._last:
+                self._cycles += 1
+            elif delta >= 0x80000000 and ts > self._last:
+                # Late packet from before the last wrap
+                return ((self._cycles - 1) << 32) + ts
+        if self._last is None or (ts - self._last) & 0xFFFFFFFF < 0x80000000:
+            self._last = ts
+        return (self._cycles << 32) + ts
+
+
+class PercentileWindow:
+    """The last `size` samples of a measurement, reported as percentiles"""
+
+    def __init__(self, size=1000):
+        self._values = collections.deque(maxlen=size)
+
+    def add(self, value):
+        self._values.append(value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get_stats(self):
+        values = sorted(self._values)
+        if not values:
+            return {"count": 0}
+        n = len(values)
+        return {
+            "count": n,
+            "p50": values[min(n - 1, int(0.50 * n))],
+            "p95": values[min(n - 1, int(0.95 * n))],
+            "p99": values[min(n - 1, int(0.99 * n))],
+            "max": values[-1],
+        }
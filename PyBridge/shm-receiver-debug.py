@@ -1,18 +1,9 @@
-import os
-os.environ['XDG_RUNTIME_DIR'] = '/tmp/runtime-dir'
-os.environ['DISPLAY'] = ':0'
-os.environ['PYTHONTHREADED'] = '1'
-
-# Must be before other imports
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst, GLib
-
-# Fix X11 threading
-os.environ['GST_GL_XINITTHREADS'] = '1'
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GLib, GstVideo
 
 import cv2
-import numpy as np
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
@@ -25,15 +16,12 @@ import psutil
 import signal
 import sys
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("shm_receiver_debug.log")
-    ]
-)
+from frame_buffers import FrameBufferPool, FrameHandle
+from frame_validation import VALIDATION_POLICIES, FrameValidator
+from video_formats import layout_from_caps
+from frame_subscription import FrameNotifier
+from concurrent.futures import ThreadPoolExecutor
+
 logger = logging.getLogger("ShmVideoReceiver")
 
 Gst.init(None)
@@ -41,7 +29,8 @@ Gst.init(None)
 # Global receiver variable for signal handler
 receiver = None
 
-# Signal handler for clean exit
+# Signal handler for clean exit; only the script installs it, since it
+# exits the whole process
 def handle_sigint(sig, frame):
     logger.info("Caught SIGINT, cleaning up...")
     if receiver:
@@ -50,17 +39,26 @@ def handle_sigint(sig, frame):
     logger.info("Forced exit")
     os._exit(0)  # Force exit
 
-# Register signal handler
-signal.signal(signal.SIGINT, handle_sigint)
-
 class ShmVideoReceiver:
-    def __init__(self, socket_path='/tmp/video-stream', width=1920, height=1080, format='I420'):
-        logger.info(f"Initializing ShmVideoReceiver: path={socket_path}, resolution={width}x{height}, format={format}")
+    def __init__(self, socket_path='/tmp/video-stream', width=1920, height=1080, format='I420',
+                 validation='header', output='bgr', reject_uniform=False):
+        logger.info(f"Initializing ShmVideoReceiver: path={socket_path}, resolution={width}x{height}, "
+                    f"format={format}, validation={validation}, output={output}")
+        self.output = output
         self.width = width
         self.height = height
         self.format = format
         self.socket_path = socket_path
-        self.latest_frame = None
+        # Latest frame + sequence numbers; consumers wait on it instead of polling
+        self.frames = FrameNotifier()
+        self._pool = FrameBufferPool(count=3)
+        # Frame layout derived from the negotiated caps, rebuilt only when they change
+        self._caps = None
+        self._layout = None
+        self._meta_key = self._meta_layout = None
+        self.caps_changes = 0
+        # Native mode: YUV->BGR only happens on request, on this worker
+        self._converter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bgr-convert')
         self.running = False
         self.last_frame_time = None
         self.frame_count = 0
@@ -74,17 +72,21 @@ class ShmVideoReceiver:
         self.mapping_errors = 0
         self.last_error_time = 0
         self.error_threshold = 5.0  # Seconds between similar error messages
+        self.validator = FrameValidator(policy=validation, reject_uniform=reject_uniform)
+        self.process = psutil.Process(os.getpid())
         
         try:
             # Check if socket exists
             if not os.path.exists(socket_path):
                 logger.warning(f"Socket {socket_path} doesn't exist yet, waiting...")
             
-            # Create GStreamer pipeline - use BGRx for better compatibility
+            # Create GStreamer pipeline - use BGRx for better compatibility,
+            # or hand over the producer's format untouched in native mode
+            convert = "" if output == 'native' else "videoconvert ! video/x-raw,format=BGRx ! "
             pipeline_str = (
                 f"shmsrc socket-path={socket_path} ! "
-                f"video/x-raw,format={format},width={width},height={height},framerate=30/1 ! "
-                f"videoconvert ! video/x-raw,format=BGRx ! "
+                f"capsfilter name=srccaps caps=\"{self._source_caps(width, height, format)}\" ! "
+                f"{convert}"
                 f"appsink name=sink emit-signals=True sync=false max-buffers=2 drop=true"
             )
             logger.debug(f"GStreamer pipeline: {pipeline_str}")
@@ -141,33 +143,38 @@ class ShmVideoReceiver:
                     self.last_error_time = time.time()
                 return Gst.FlowReturn.OK
             
-            # Create numpy array from buffer data
+            # Wrap the mapped buffer in a FrameHandle
             try:
-                # Get the actual frame size 
-                # BGRx format has 4 bytes per pixel
-                expected_size = self.width * self.height * 4  
+                # Frame geometry comes from the negotiated caps, not the constructor
+                layout = self._layout_for_sample(caps, buf)
+                expected_size = layout.size
                 actual_size = map_info.size
                 
-                if actual_size < expected_size:
+                # O(1) checks from buffer size and flags, whatever the policy
+                reason = self.validator.check_buffer(
+                    actual_size, expected_size,
+                    corrupted=buf.has_flags(Gst.BufferFlags.CORRUPTED),
+                    gap=buf.has_flags(Gst.BufferFlags.GAP)
+                )
+                if reason:
                     if time.time() - self.last_error_time > self.error_threshold:
-                        logger.warning(f"Buffer size mismatch: expected {expected_size}, got {actual_size}")
+                        logger.warning(f"Dropping frame ({reason}): expected {expected_size} bytes, got {actual_size}")
                         self.last_error_time = time.time()
                     self.dropped_frames += 1
                     return Gst.FlowReturn.OK
                 
-                # BGRx format (4 channels)
-                frame = np.ndarray(
-                    shape=(self.height, self.width, 4),
-                    dtype=np.uint8,
-                    buffer=map_info.data
-                )
-                
-                # Convert to BGR by slicing off the 'x' channel
-                frame = frame[:, :, 0:3]
+                # Plane views in place in the mapped buffer, honouring stride
+                # padding: a single BGRx plane, or Y/U/V (Y/UV) in native mode
+                planes = layout.plane_views(map_info.data)
+                frame = planes[0]
                 
-                # Check for corrupt frame
-                if frame.size > 0 and np.isfinite(frame).all():
-                    self.latest_frame = frame.copy()  # Make a copy to be safe
+                # Content checks; cost depends on the validation policy
+                reason = self.validator.check_frame(frame)
+                if reason is None:
+                    # The handle now owns the mapping; no per-frame copy
+                    handle = FrameHandle(sample, buf, map_info, frame, layout=layout, planes=planes)
+                    map_info = None
+                    self.frames.publish(handle, pts=None if buf.pts == Gst.CLOCK_TIME_NONE else buf.pts)
                     self.successful_frames += 1
                     
                     # Calculate FPS
@@ -188,15 +195,10 @@ class ShmVideoReceiver:
                     
                     # Log occasional frame info
                     if self.frame_count % 100 == 0:
-                        logger.debug(f"Frame {self.frame_count}: shape={frame.shape}, " +
-                                    f"min={frame.min()}, max={frame.max()}, fps={self.current_fps:.2f}")
-                        
-                        # Memory tracking
-                        process = psutil.Process(os.getpid())
-                        logger.debug(f"Memory usage: {process.memory_info().rss / 1024 / 1024:.2f} MB")
+                        logger.debug(f"Frame {self.frame_count}: shape={frame.shape}, fps={self.current_fps:.2f}")
                 else:
                     self.dropped_frames += 1
-                    logger.warning(f"Corrupt frame detected (count: {self.dropped_frames})")
+                    logger.warning(f"Corrupt frame detected ({reason}, count: {self.dropped_frames})")
             
             except Exception as e:
                 self.dropped_frames += 1
@@ -206,7 +208,8 @@ class ShmVideoReceiver:
                     self.last_error_time = time.time()
             
             finally:
-                buf.unmap(map_info)
+                if map_info is not None:
+                    buf.unmap(map_info)
                 
         except Exception as e:
             if time.time() - self.last_error_time > self.error_threshold:
@@ -216,6 +219,44 @@ class ShmVideoReceiver:
                 
         return Gst.FlowReturn.OK
     
+    @staticmethod
+    def _source_caps(width=None, height=None, format=None):
+        # shmsrc carries no caps of its own; omitted fields are left to negotiation
+        caps = "video/x-raw"
+        if format:
+            caps += f",format={format}"
+        if width:
+            caps += f",width={width}"
+        if height:
+            caps += f",height={height}"
+        return caps + ",framerate=30/1"
+    
+    def set_source_caps(self, width=None, height=None, format=None):
+        """Follow a producer that changed resolution/format, without a restart"""
+        caps = self._source_caps(width, height, format)
+        logger.info(f"Updating source caps to {caps}")
+        self.pipeline.get_by_name('srccaps').set_property('caps', Gst.Caps.from_string(caps))
+    
+    def _layout_for_sample(self, caps, buf):
+        if self._caps is None or not caps.is_equal(self._caps):
+            self._layout = layout_from_caps(caps)
+            self._caps = caps
+            self._meta_key = self._meta_layout = None
+            self.caps_changes += 1
+            self.width, self.height = self._layout.width, self._layout.height
+            self.format = self._layout.format
+            logger.info(f"Negotiated caps changed: {self.format} {self.width}x{self.height}, "
+                        f"strides={[p.stride for p in self._layout.planes]}")
+        # Producers that pad planes attach a VideoMeta with the real strides
+        meta = GstVideo.buffer_get_video_meta(buf)
+        if meta is None:
+            return self._layout
+        key = (tuple(meta.offset[:meta.n_planes]), tuple(meta.stride[:meta.n_planes]))
+        if key != self._meta_key:
+            self._meta_key = key
+            self._meta_layout = self._layout.with_strides(*key)
+        return self._meta_layout
+    
     def _on_error(self, bus, msg):
         err, debug = msg.parse_error()
         logger.error(f"GStreamer error: {err.message}")
@@ -250,6 +291,10 @@ class ShmVideoReceiver:
             f"FPS={self.current_fps:.2f}, Drops={self.dropped_frames} ({drop_rate:.1f}%)"
         )
         
+        # Memory tracking
+        logger.debug(f"Memory usage: {self.process.memory_info().rss / 1024 / 1024:.2f} MB, "
+                     f"validation: {self.validator.get_stats()}")
+        
         # Check socket file existence periodically
         if not os.path.exists(self.socket_path):
             logger.warning(f"Shared memory socket {self.socket_path} does not exist!")
@@ -305,8 +350,57 @@ class ShmVideoReceiver:
         except Exception as e:
             logger.error(f"Error in stats loop: {str(e)}")
     
+    def acquire_frame(self):
+        """Zero-copy access to the latest frame. Returns a FrameHandle (or None)
+        that must be released, ideally with a `with` block."""
+        received = self.frames.get_latest()
+        return received.frame if received is not None else None
+    
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """Sleep until a frame newer than after_seq arrives. Returns a
+        ReceivedFrame (seq, pts, arrival, frame=FrameHandle) to use in a
+        `with` block, or None on timeout."""
+        return self.frames.wait_for_frame(after_seq, timeout)
+    
+    def frames_async(self, after_seq=0):
+        """`async for received in receiver.frames_async():` over new frames"""
+        return self.frames.frames_async(after_seq)
+    
+    def add_frame_callback(self, callback):
+        """callback(ReceivedFrame) on the GStreamer streaming thread"""
+        self.frames.add_callback(callback)
+    
+    def copy_bgr(self, handle):
+        """Writable BGR copy of a handle in a triple-buffer pool array, for a
+        single consumer loop that wants no per-frame allocation. The array
+        is overwritten three copies later: use it before then."""
+        if handle.layout.format == 'BGRx':
+            return self._pool.copy(handle.bgr)
+        return self._pool.copy(handle.to_bgr())
+    
     def get_frame(self):
-        return self.latest_frame
+        """Owned, writable BGR copy of the latest frame, never reused"""
+        handle = self.acquire_frame()
+        if handle is None:
+            return None
+        with handle:
+            if handle.layout.format == 'BGRx':
+                return handle.bgr.copy()
+            # to_bgr() is cached on the handle and shared with its other holders
+            return handle.to_bgr().copy()
+    
+    def get_pooled_frame(self):
+        """Like get_frame(), but into a pool array (see copy_bgr)"""
+        handle = self.acquire_frame()
+        if handle is None:
+            return None
+        with handle:
+            return self.copy_bgr(handle)
+    
+    def get_frame_async(self):
+        """Like get_frame(), but the colour conversion runs on the converter
+        thread. Returns a concurrent.futures.Future."""
+        return self._converter.submit(self.get_frame)
     
     def get_stats(self):
         """Return current performance statistics"""
@@ -316,7 +410,11 @@ class ShmVideoReceiver:
             "frames_received": self.successful_frames,
             "frames_dropped": self.dropped_frames,
             "null_buffers": self.null_buffers,
-            "mapping_errors": self.mapping_errors
+            "mapping_errors": self.mapping_errors,
+            "sequence": self.frames.seq,
+            "caps_changes": self.caps_changes,
+            "resolution": f"{self.width}x{self.height}",
+            "validation": self.validator.get_stats()
         }
     
     def stop(self):
@@ -351,6 +449,12 @@ class ShmVideoReceiver:
         except Exception as e:
             logger.error(f"Error joining threads: {str(e)}")
         
+        self._converter.shutdown(wait=False)
+        
+        # Wake any waiting consumers and drop our reference to the last
+        # frame so its buffer can be unmapped
+        self.frames.close()
+        
         # Final stats
         try:
             self._log_stats()
@@ -363,11 +467,39 @@ class ShmVideoReceiver:
 if __name__ == "__main__":
     import argparse
     
+    # Display setup, logging and the SIGINT handler are the script's, not
+    # the module's: tools import ShmVideoReceiver from here
+    os.environ['XDG_RUNTIME_DIR'] = '/tmp/runtime-dir'
+    os.environ['DISPLAY'] = ':0'
+    os.environ['PYTHONTHREADED'] = '1'
+    # Fix X11 threading
+    os.environ['GST_GL_XINITTHREADS'] = '1'
+    
+    # Configure logging
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler("shm_receiver_debug.log")
+        ]
+    )
+    
+    # Register signal handler
+    signal.signal(signal.SIGINT, handle_sigint)
+    
     parser = argparse.ArgumentParser(description="Shared Memory Video Receiver")
     parser.add_argument("--socket-path", default="/tmp/video-stream", help="Socket path")
     parser.add_argument("--width", type=int, default=1920, help="Video width")
     parser.add_argument("--height", type=int, default=1080, help="Video height")
     parser.add_argument("--format", default="I420", help="Video format (I420, BGR, RGB, etc)")
+    parser.add_argument("--validation", choices=VALIDATION_POLICIES, default="header",
+                        help="Per-frame corruption checks: none, header (O(1)), sampled or full")
+    parser.add_argument("--reject-uniform", action="store_true",
+                        help="sampled/full: drop single-colour frames instead of only counting them")
+    parser.add_argument("--output", choices=["bgr", "native"], default="bgr",
+                        help="bgr: convert to BGRx in GStreamer; native: deliver the producer's "
+                             "planes and convert only when asked")
     args = parser.parse_args()
     
     logger.info(f"Starting SHM receiver on {args.socket_path}, {args.width}x{args.height}, format={args.format}")
@@ -377,18 +509,30 @@ if __name__ == "__main__":
             socket_path=args.socket_path,
             width=args.width,
             height=args.height,
-            format=args.format
+            format=args.format,
+            validation=args.validation,
+            output=args.output,
+            reject_uniform=args.reject_uniform
         )
         receiver.start()
         
+        last_seq = 0
+        skipped = 0
         while True:
-            frame = receiver.get_frame()
-            if frame is not None:
+            # Sleeps until a new frame arrives instead of re-drawing the same one
+            received = receiver.wait_for_frame(last_seq, timeout=0.1)
+            if received is not None:
+                with received:
+                    frame = receiver.copy_bgr(received.frame)
+                if last_seq:
+                    skipped += received.seq - last_seq - 1
+                last_seq = received.seq
+                
                 # Add stats overlay
                 stats = receiver.get_stats()
                 cv2.putText(
                     frame, 
-                    f"FPS: {stats['fps']:.1f} Frames: {stats['frames_received']}", 
+                    f"FPS: {stats['fps']:.1f} Frames: {stats['frames_received']} Skipped: {skipped}", 
                     (10, 30), 
                     cv2.FONT_HERSHEY_SIMPLEX, 
                     1, 
@@ -416,8 +560,8 @@ if __name__ == "__main__":
                     # Print detailed debug info
                     logger.info(f"Detailed stats: {receiver.get_stats()}")
             else:
-                # If no frame yet, still handle key events
-                key = cv2.waitKey(100) & 0xFF
+                # If no new frame, still handle key events
+                key = cv2.waitKey(1) & 0xFF
                 if key == ord('q'):
                     break
                 
@@ -427,7 +571,7 @@ if __name__ == "__main__":
         logger.error(f"Exception in main loop: {str(e)}")
         logger.error(traceback.format_exc())
     finally:
-        if 'receiver' in locals():
+        if receiver is not None:
             receiver.stop()
         cv2.destroyAllWindows()
         logger.info("Application shutdown complete")
\ No newline at end of file
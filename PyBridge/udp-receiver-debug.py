@@ -1,132 +1,435 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
 import cv2
+import collections
 import numpy as np
-import socket
-import struct
 import time
 import logging
-from threading import Thread
+import threading
 import os
 import traceback
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("udp_receiver_debug.log")
-    ]
-)
+from frame_buffers import FrameBufferPool, FrameHandle
+from decoder_selection import DECODER_CANDIDATES, select_decoder
+from frame_subscription import FrameNotifier
+from frame_sync import DetectionListener, FrameSync, draw_detections
+from rtp_stats import PercentileWindow, RtpSequenceTracker, RtpTimestampUnwrapper
+from video_formats import layout_from_caps
+
 logger = logging.getLogger("UDPVideoReceiver")
 
+Gst.init(None)
+
+RMEM_MAX_PATH = '/proc/sys/net/core/rmem_max'
+JITTER_MODES = ('none', 'slave', 'buffer', 'synced')
+RTP_CLOCK_RATE = 90000
+# Sender capture time from RTCP sender reports, attached by the jitterbuffer
+NTP_CAPS = Gst.Caps.from_string('timestamp/x-ntp')
+NTP_UNIX_OFFSET_NS = 2208988800 * 10**9
+# Bounded lookup tables between the RTP, depayloader and appsink stages
+MAX_TRACKED_TIMESTAMPS = 512
+
+RTP_CAPS = "application/x-rtp, media=video, clock-rate=90000, encoding-name=H264, payload=96"
+DECODE_CHAIN = (
+    "rtph264depay name=depay ! h264parse name=parse ! {decoder} ! "
+    "videoconvert ! video/x-raw,format=BGR ! "
+    "appsink name=sink emit-signals=true sync=false max-buffers=2 drop=true"
+)
+
 class UDPVideoReceiver:
-    def __init__(self, host='0.0.0.0', port=5000, buffer_size=65536):
-        logger.info(f"Initializing UDPVideoReceiver on {host}:{port}")
+    def __init__(self, host='0.0.0.0', port=5000, buffer_size=4 * 1024 * 1024,
+                 latency=50, decoder_threads=0, jitter_mode='slave', drop_on_latency=True,
+                 rtcp_port=None, rtcp_send=None, decoder=None, benchmark_decoders=False):
+        """buffer_size is the kernel receive buffer (SO_RCVBUF) of udpsrc,
+        latency the jitterbuffer latency target in ms, decoder_threads the
+        libav decoder thread count (0 = one per core).
+
+        decoder names a decoder element to force; by default the fastest one
+        that works on this host is picked (see decoder_selection).
+
+        With rtcp_port (and rtcp_send=(host, port) of the sender) the stream
+        goes through rtpbin: keyframe requests reach the sender as RTCP PLI
+        and sender reports give absolute end-to-end latency."""
+        if jitter_mode not in JITTER_MODES:
+            raise ValueError(f"Unknown jitterbuffer mode '{jitter_mode}', expected one of {JITTER_MODES}")
+        logger.info(f"Initializing UDPVideoReceiver on {host}:{port}, buffer_size={buffer_size}, "
+                    f"latency={latency}ms ({jitter_mode}), decoder_threads={decoder_threads}, "
+                    f"rtcp_port={rtcp_port}")
         self.host = host
         self.port = port
         self.buffer_size = buffer_size
+        self.latency = latency
+        self.decoder_threads = decoder_threads
+        self.jitter_mode = jitter_mode
+        self.drop_on_latency = drop_on_latency
+        self.rtcp_port = rtcp_port
+        self.rtcp_send = rtcp_send
+        self.decoder = self._choose_decoder(decoder, benchmark_decoders)
         self.running = False
-        self.latest_frame = None
+        # Latest frame + sequence numbers; consumers wait on it instead of polling
+        self.frames = FrameNotifier()
+        self._pool = FrameBufferPool(count=3)
+        self._caps = None
+        self._layout = None
         self.frame_count = 0
         self.start_time = None
         self.last_frame_time = None
         self.fps_update_interval = 5.0  # seconds
         self.current_fps = 0
+        self.jitterbuffer = None
         
         # Stats
         self.dropped_frames = 0
         self.successful_frames = 0
+        self.mapping_errors = 0
+        self.last_error_time = 0
+        self.error_threshold = 5.0  # Seconds between similar error messages
+        # Loss/reordering as seen on the wire, before the jitterbuffer
+        self.rtp = RtpSequenceTracker()
+        
+        # Latency: RTP timestamp -> first packet arrival, PTS -> RTP timestamp.
+        # Written from the udpsrc and jitterbuffer threads, read from the
+        # appsink thread, so every access holds _timestamps_lock.
+        self._arrivals = collections.OrderedDict()
+        self._pts_to_rtp = collections.OrderedDict()
+        self._timestamps_lock = threading.Lock()
+        self._unwrap = RtpTimestampUnwrapper()
+        self._min_transit = None
+        self.frame_interval = PercentileWindow()
+        self.pipeline_latency = PercentileWindow()
+        self.network_jitter = PercentileWindow()
+        self.e2e_latency = PercentileWindow()
+        self.e2e_reference = 'relative'
+        
+        # Loss concealment / keyframe recovery
+        self.lost_events = 0
+        self.keyframe_requests = 0
+        self.keyframes = 0
+        self._loss_time = None
+        self.recovery_time = PercentileWindow(size=100)
         
         try:
-            # Setup socket
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.sock.bind((self.host, self.port))
-            logger.info(f"Socket bound successfully to {host}:{port}")
-            
-            # Set socket timeout to prevent blocking indefinitely
-            self.sock.settimeout(1.0)
+            self._check_rmem_max()
             
-            # Setup GStreamer pipeline
-            pipeline_str = (
-                f"udpsrc port={port} caps=\"application/x-rtp, media=video, "
-                f"encoding-name=H264, payload=96\" ! rtph264depay ! h264parse ! "
-                f"avdec_h264 ! videoconvert ! appsink"
-            )
+            # udpsrc owns the socket; nothing else may bind the port
+            pipeline_str = self._build_pipeline()
             logger.debug(f"GStreamer pipeline: {pipeline_str}")
             
             # Check if we're running with hardware acceleration
             if os.path.exists("/dev/dri") or os.path.exists("/dev/nvidia0"):
                 logger.info("Hardware acceleration may be available")
             
-            self.pipeline = cv2.VideoCapture(pipeline_str, cv2.CAP_GSTREAMER)
+            self.pipeline = Gst.parse_launch(pipeline_str)
+            if not self.pipeline:
+                raise RuntimeError("Failed to create pipeline")
             
-            if not self.pipeline.isOpened():
-                logger.error("Failed to open GStreamer pipeline")
-                raise RuntimeError("Failed to open GStreamer pipeline")
+            if rtcp_port:
+                self.pipeline.get_by_name('rtpbin').connect("new-jitterbuffer", self._on_new_jitterbuffer)
             else:
-                logger.info("GStreamer pipeline opened successfully")
+                self.jitterbuffer = self.pipeline.get_by_name('jitter')
+            self.appsink = self.pipeline.get_by_name('sink')
+            self.appsink.connect("new-sample", self._on_new_sample)
+            
+            # Drop the broken frames after a loss and ask for a keyframe,
+            # instead of decoding garbage until the next periodic IDR
+            depay = self.pipeline.get_by_name('depay')
+            for prop in ('request-keyframe', 'wait-for-keyframe'):
+                if depay.find_property(prop) is not None:
+                    depay.set_property(prop, True)
+            
+            # Every RTP packet passes this probe in arrival order
+            src_pad = self.pipeline.get_by_name('src').get_static_pad('src')
+            src_pad.add_probe(Gst.PadProbeType.BUFFER, self._on_rtp_packet)
+            # Packets leaving the jitterbuffer, lost-packet events going down
+            # and keyframe requests going up all cross the depayloader sink
+            depay_pad = depay.get_static_pad('sink')
+            depay_pad.add_probe(Gst.PadProbeType.BUFFER, self._on_jitterbuffer_output)
+            depay_pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM | Gst.PadProbeType.EVENT_UPSTREAM,
+                                self._on_depay_event)
+            parse_pad = self.pipeline.get_by_name('parse').get_static_pad('src')
+            parse_pad.add_probe(Gst.PadProbeType.BUFFER, self._on_parsed_frame)
+            
+            self.loop = GLib.MainLoop()
+            
+            self.bus = self.pipeline.get_bus()
+            self.bus.add_signal_watch()
+            self.bus.connect("message::error", self._on_error)
+            self.bus.connect("message::warning", self._on_warning)
+            self.bus.connect("message::eos", self._on_eos)
+            
+            logger.info("UDPVideoReceiver initialized successfully")
                 
         except Exception as e:
             logger.error(f"Initialization error: {str(e)}")
             logger.error(traceback.format_exc())
             raise
+    
+    def _build_pipeline(self):
+        udpsrc = (f"udpsrc name=src address={self.host} port={self.port} "
+                  f"buffer-size={self.buffer_size} caps=\"{RTP_CAPS}\"")
+        decode = DECODE_CHAIN.format(decoder=self.decoder.decode_chain(threads=self.decoder_threads))
+        drop = str(self.drop_on_latency).lower()
+        if not self.rtcp_port:
+            return (f"{udpsrc} ! rtpjitterbuffer name=jitter latency={self.latency} mode={self.jitter_mode} "
+                    f"do-lost=true drop-on-latency={drop} ! {decode}")
+        
+        pipeline_str = (
+            f"rtpbin name=rtpbin latency={self.latency} buffer-mode={self.jitter_mode} "
+            f"do-lost=true drop-on-latency={drop} "
+            f"{udpsrc} ! rtpbin.recv_rtp_sink_0 "
+            f"udpsrc address={self.host} port={self.rtcp_port} ! rtpbin.recv_rtcp_sink_0 "
+            f"rtpbin. ! {decode}"
+        )
+        if self.rtcp_send:
+            host, port = self.rtcp_send
+            pipeline_str += f" rtpbin.send_rtcp_src_0 ! udpsink host={host} port={port} sync=false async=false"
+        return pipeline_str
+    
+    @staticmethod
+    def _choose_decoder(name, benchmark):
+        if name is None:
+            return select_decoder(benchmark=benchmark)
+        for candidate in DECODER_CANDIDATES:
+            if candidate.decoder == name:
+                return candidate
+        raise ValueError(f"Unknown decoder '{name}', expected one of "
+                         f"{[c.decoder for c in DECODER_CANDIDATES]}")
+    
+    def _on_new_jitterbuffer(self, rtpbin, jitterbuffer, session, ssrc):
+        logger.info(f"Jitterbuffer created for session {session}, SSRC {ssrc:#010x}")
+        # Sender reports map RTP time to the sender's wall clock
+        if jitterbuffer.find_property('add-reference-timestamp-meta') is not None:
+            jitterbuffer.set_property('add-reference-timestamp-meta', True)
+        self.jitterbuffer = jitterbuffer
+    
+    def _check_rmem_max(self):
+        # The kernel silently caps SO_RCVBUF at net.core.rmem_max
+        try:
+            with open(RMEM_MAX_PATH) as f:
+                rmem_max = int(f.read())
+        except (OSError, ValueError):
+            return
+        if self.buffer_size > rmem_max:
+            logger.warning(f"Receive buffer {self.buffer_size} exceeds net.core.rmem_max={rmem_max}; "
+                           f"the kernel will cap it (sysctl -w net.core.rmem_max={self.buffer_size})")
+    
+    def _on_rtp_packet(self, pad, info):
+        buf = info.get_buffer()
+        if buf is not None and buf.get_size() >= 8:
+            header = buf.extract_dup(0, 8)
+            self.rtp.update((header[2] << 8) | header[3])
+            # First packet of each frame marks when the frame started arriving
+            ts = int.from_bytes(header[4:8], 'big')
+            with self._timestamps_lock:
+                if ts not in self._arrivals:
+                    self._arrivals[ts] = time.monotonic()
+                    if len(self._arrivals) > MAX_TRACKED_TIMESTAMPS:
+                        self._arrivals.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+    
+    def _on_jitterbuffer_output(self, pad, info):
+        # Depayloaded and decoded frames keep the PTS the jitterbuffer gave
+        # the packet, which is how a decoded frame finds its RTP timestamp
+        buf = info.get_buffer()
+        if buf is not None and buf.pts != Gst.CLOCK_TIME_NONE and buf.get_size() >= 8:
+            with self._timestamps_lock:
+                if buf.pts not in self._pts_to_rtp:
+                    self._pts_to_rtp[buf.pts] = int.from_bytes(buf.extract_dup(4, 4), 'big')
+                    if len(self._pts_to_rtp) > MAX_TRACKED_TIMESTAMPS:
+                        self._pts_to_rtp.popitem(last=False)
+        return Gst.PadProbeReturn.OK
+    
+    def _on_depay_event(self, pad, info):
+        event = info.get_event()
+        structure = event.get_structure() if event is not None else None
+        if structure is None:
+            return Gst.PadProbeReturn.OK
+        name = structure.get_name()
+        if name == 'GstRTPPacketLost':
+            self.lost_events += 1
+            if self._loss_time is None:
+                self._loss_time = time.monotonic()
+        elif name == 'GstForceKeyUnit':
+            self.keyframe_requests += 1
+            if self.keyframe_requests == 1 and not self.rtcp_send:
+                logger.warning("Keyframe requested after packet loss, but without RTCP (rtcp_port/rtcp_send) "
+                               "it cannot reach the sender; waiting for the next periodic keyframe")
+        return Gst.PadProbeReturn.OK
+    
+    def _on_parsed_frame(self, pad, info):
+        buf = info.get_buffer()
+        if buf is not None and not buf.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            self.keyframes += 1
+            if self._loss_time is not None:
+                recovery_ms = (time.monotonic() - self._loss_time) * 1000
+                self.recovery_time.add(recovery_ms)
+                logger.info(f"Recovered from packet loss at keyframe after {recovery_ms:.0f} ms")
+                self._loss_time = None
+        return Gst.PadProbeReturn.OK
+    
+    def _media_pts(self, buf):
+        """The frame's capture time on the sender's RTP clock, in ns. Unlike
+        the local buffer PTS it is the same in every process receiving the
+        stream, so results computed elsewhere can be matched to the frame."""
+        if buf.pts == Gst.CLOCK_TIME_NONE:
+            return None
+        with self._timestamps_lock:
+            rtp_ts = self._pts_to_rtp.get(buf.pts)
+        if rtp_ts is None:
+            return None
+        return self._unwrap.extend(rtp_ts) * Gst.SECOND // RTP_CLOCK_RATE
+    
+    def _record_latency(self, buf, now):
+        """Per-frame latency from the frame's RTP timestamp: time spent in the
+        receiver since its first packet arrived, the network delay variation
+        relative to the fastest frame seen, and their sum as end-to-end
+        latency. With RTCP sender reports the end-to-end figure is absolute
+        (sender capture to here, assuming synchronised clocks)."""
+        with self._timestamps_lock:
+            rtp_ts = self._pts_to_rtp.get(buf.pts)
+            arrival = self._arrivals.get(rtp_ts) if rtp_ts is not None else None
+        if arrival is None:
+            return
+        pipeline_ms = (now - arrival) * 1000
+        self.pipeline_latency.add(pipeline_ms)
+        
+        transit = arrival - self._unwrap.extend(rtp_ts) / RTP_CLOCK_RATE
+        if self._min_transit is None or transit < self._min_transit:
+            self._min_transit = transit
+        network_ms = (transit - self._min_transit) * 1000
+        self.network_jitter.add(network_ms)
+        
+        meta = buf.get_reference_timestamp_meta(NTP_CAPS) if self.rtcp_port else None
+        if meta is not None:
+            self.e2e_reference = 'rtcp-ntp'
+            self.e2e_latency.add((time.time_ns() - (meta.timestamp - NTP_UNIX_OFFSET_NS)) / 1e6)
+        else:
+            self.e2e_latency.add(pipeline_ms + network_ms)
+    
+    def _on_new_sample(self, sink):
+        sample = sink.emit("pull-sample")
+        if not sample:
+            return Gst.FlowReturn.OK
+        
+        buf = sample.get_buffer()
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            self.mapping_errors += 1
+            if time.time() - self.last_error_time > self.error_threshold:
+                logger.error(f"Failed to map buffer (count: {self.mapping_errors})")
+                self.last_error_time = time.time()
+            return Gst.FlowReturn.OK
+        
+        try:
+            caps = sample.get_caps()
+            if self._caps is None or not caps.is_equal(self._caps):
+                self._caps = caps
+                self._layout = layout_from_caps(caps)
+                logger.info(f"Decoded stream: {self._layout.width}x{self._layout.height}")
+            layout = self._layout
+            
+            if map_info.size < layout.size or buf.has_flags(Gst.BufferFlags.CORRUPTED):
+                self.dropped_frames += 1
+                if time.time() - self.last_error_time > self.error_threshold:
+                    logger.warning(f"Dropping frame: expected {layout.size} bytes, got {map_info.size} "
+                                   f"(total drops: {self.dropped_frames})")
+                    self.last_error_time = time.time()
+                return Gst.FlowReturn.OK
+            
+            # The BGR frame is a view of the decoded buffer; the handle owns the mapping
+            planes = layout.plane_views(map_info.data)
+            handle = FrameHandle(sample, buf, map_info, planes[0], layout=layout, planes=planes)
+            map_info = None
+            self.frames.publish(handle, pts=self._media_pts(buf))
+            self.successful_frames += 1
+            self.frame_count += 1
+            
+            now = time.monotonic()
+            if buf.pts != Gst.CLOCK_TIME_NONE:
+                self._record_latency(buf, now)
+            if self.last_frame_time is not None:
+                self.frame_interval.add((now - self.last_frame_time) * 1000)
+            self.last_frame_time = now
+            # FPS from the median frame interval, so a few stalls don't hide in an average
+            if self.frame_count % 30 == 0:
+                median_interval = self.frame_interval.get_stats().get('p50')
+                if median_interval:
+                    self.current_fps = 1000.0 / median_interval
+            
+            # Log every 100th frame for debug purposes
+            if self.frame_count % 100 == 0:
+                logger.debug(f"Received frame {self.frame_count}, size: {handle.array.shape}, FPS: {self.current_fps:.2f}")
+        
+        except Exception as e:
+            self.dropped_frames += 1
+            if time.time() - self.last_error_time > self.error_threshold:
+                logger.error(f"Error processing frame: {str(e)}")
+                logger.error(traceback.format_exc())
+                self.last_error_time = time.time()
+        
+        finally:
+            if map_info is not None:
+                buf.unmap(map_info)
+        
+        return Gst.FlowReturn.OK
+    
+    def _on_error(self, bus, msg):
+        err, debug = msg.parse_error()
+        logger.error(f"GStreamer error: {err.message}")
+        logger.debug(f"GStreamer error debug info: {debug}")
+        
+    def _on_warning(self, bus, msg):
+        warn, debug = msg.parse_warning()
+        logger.warning(f"GStreamer warning: {warn.message}")
+        logger.debug(f"GStreamer warning debug info: {debug}")
+    
+    def _on_eos(self, bus, msg):
+        logger.info("End of stream received")
+        self.loop.quit()
         
     def start(self):
-        logger.info("Starting receiver thread")
+        logger.info("Starting receiver")
         self.running = True
         self.start_time = time.time()
-        self.last_frame_time = self.start_time
-        self.thread = Thread(target=self._receive_loop)
+        self.last_frame_time = None
+        
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            logger.error("Failed to start pipeline")
+            raise RuntimeError("Failed to start pipeline")
+        
+        # GLib MainLoop for bus messages; frames arrive on the streaming thread
+        self.thread = threading.Thread(target=self.loop.run)
         self.thread.daemon = True
         self.thread.start()
         
-    def _receive_loop(self):
-        last_stats_time = time.time()
-        
-        try:
-            while self.running:
-                ret, frame = self.pipeline.read()
-                
-                current_time = time.time()
-                if current_time - last_stats_time >= self.fps_update_interval:
-                    self._log_stats()
-                    last_stats_time = current_time
-                
-                if ret:
-                    self.successful_frames += 1
-                    self.latest_frame = frame
-                    self.frame_count += 1
-                    
-                    # Calculate FPS over short interval
-                    now = time.time()
-                    time_diff = now - self.last_frame_time
-                    if time_diff > 0:
-                        instantaneous_fps = 1.0 / time_diff
-                        # Smooth FPS using exponential moving average
-                        alpha = 0.2  # Smoothing factor
-                        if self.current_fps == 0:
-                            self.current_fps = instantaneous_fps
-                        else:
-                            self.current_fps = (alpha * instantaneous_fps) + ((1-alpha) * self.current_fps)
-                    
-                    self.last_frame_time = now
-                    
-                    # Log every 100th frame for debug purposes
-                    if self.frame_count % 100 == 0:
-                        logger.debug(f"Received frame {self.frame_count}, size: {frame.shape}, FPS: {self.current_fps:.2f}")
-                else:
-                    self.dropped_frames += 1
-                    logger.warning(f"Failed to receive frame. Total drops: {self.dropped_frames}")
+        self.stats_thread = threading.Thread(target=self._stats_loop)
+        self.stats_thread.daemon = True
+        self.stats_thread.start()
+    
+    def _stats_loop(self):
+        while self.running:
+            time.sleep(self.fps_update_interval)
+            if self.running:
+                self._log_stats()
                 
-        except Exception as e:
-            logger.error(f"Error in receive loop: {str(e)}")
-            logger.error(traceback.format_exc())
-            self.running = False
+    def _jitterbuffer_stats(self):
+        if self.jitterbuffer is None:
+            return {}
+        stats = self.jitterbuffer.get_property('stats')
+        return {
+            field: stats.get_value(field)
+            for field in ('num-pushed', 'num-lost', 'num-late', 'num-duplicates', 'avg-jitter')
+            if stats.has_field(field)
+        }
                 
     def _log_stats(self):
         uptime = time.time() - self.start_time
         total_frames = self.successful_frames + self.dropped_frames
         drop_rate = (self.dropped_frames / max(total_frames, 1)) * 100
+        rtp = self.rtp.get_stats()
         
         # Check for potential network issues
         if self.current_fps < 10 and uptime > 10:
@@ -134,72 +437,199 @@ class UDPVideoReceiver:
             
         logger.info(
             f"Stats: Uptime={uptime:.1f}s, Frames={self.frame_count}, "
-            f"FPS={self.current_fps:.2f}, Drops={self.dropped_frames} ({drop_rate:.1f}%)"
+            f"FPS={self.current_fps:.2f}, Drops={self.dropped_frames} ({drop_rate:.1f}%), "
+            f"Packets={rtp['packets_received']}, Lost={rtp['packets_lost']} ({rtp['loss_rate']:.2f}%), "
+            f"Reordered={rtp['packets_reordered']}, "
+            f"Latency p50/p99={self._fmt_percentiles(self.e2e_latency)} ms ({self.e2e_reference}), "
+            f"Keyframe requests={self.keyframe_requests}"
         )
         
         # Memory usage (Linux only)
         try:
             import resource
             mem_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # MB
-            logger.debug(f"Memory usage: {mem_usage:.2f} MB")
+            logger.debug(f"Memory usage: {mem_usage:.2f} MB, jitterbuffer: {self._jitterbuffer_stats()}")
         except:
             pass
+    
+    @staticmethod
+    def _fmt_percentiles(window):
+        stats = window.get_stats()
+        return f"{stats['p50']:.1f}/{stats['p99']:.1f}" if stats['count'] else "-"
+    
+    def acquire_frame(self):
+        """Zero-copy access to the latest frame. Returns a FrameHandle (or None)
+        that must be released, ideally with a `with` block."""
+        received = self.frames.get_latest()
+        return received.frame if received is not None else None
+    
+    def copy_bgr(self, handle):
+        """Writable BGR copy of a handle in a triple-buffer pool array, for a
+        single consumer loop that wants no per-frame allocation. The array
+        is overwritten three copies later: use it before then."""
+        return self._pool.copy(handle.array)
         
     def get_frame(self):
-        return self.latest_frame
+        """Owned, writable BGR copy of the latest frame, never reused"""
+        handle = self.acquire_frame()
+        if handle is None:
+            return None
+        with handle:
+            return handle.array.copy()
+    
+    def get_pooled_frame(self):
+        """Like get_frame(), but into a pool array (see copy_bgr)"""
+        handle = self.acquire_frame()
+        if handle is None:
+            return None
+        with handle:
+            return self.copy_bgr(handle)
+    
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """Sleep until a frame newer than after_seq arrives. Returns a
+        ReceivedFrame (seq, pts, arrival, frame=FrameHandle) to use in a
+        `with` block, or None on timeout. pts is the sender's RTP time."""
+        return self.frames.wait_for_frame(after_seq, timeout)
+    
+    def frames_async(self, after_seq=0):
+        """`async for received in receiver.frames_async():` over new frames"""
+        return self.frames.frames_async(after_seq)
+    
+    def add_frame_callback(self, callback):
+        """callback(ReceivedFrame) on the GStreamer streaming thread"""
+        self.frames.add_callback(callback)
         
     def get_stats(self):
         """Return current performance statistics"""
-        return {
+        stats = {
             "fps": self.current_fps,
             "uptime": time.time() - self.start_time if self.start_time else 0,
             "frames_received": self.successful_frames,
             "frames_dropped": self.dropped_frames,
-            "drop_rate": (self.dropped_frames / max(self.successful_frames + self.dropped_frames, 1)) * 100
+            "mapping_errors": self.mapping_errors,
+            "sequence": self.frames.seq,
+            "decoder": self.decoder.decoder,
+            "drop_rate": (self.dropped_frames / max(self.successful_frames + self.dropped_frames, 1)) * 100,
+            "jitterbuffer": self._jitterbuffer_stats(),
+            "frame_interval_ms": self.frame_interval.get_stats(),
+            "pipeline_latency_ms": self.pipeline_latency.get_stats(),
+            "network_jitter_ms": self.network_jitter.get_stats(),
+            "e2e_latency_ms": self.e2e_latency.get_stats(),
+            "e2e_reference": self.e2e_reference,
+            "lost_events": self.lost_events,
+            "keyframe_requests": self.keyframe_requests,
+            "keyframes": self.keyframes,
+            "keyframe_recovery_ms": self.recovery_time.get_stats()
         }
+        stats.update(self.rtp.get_stats())
+        return stats
         
     def stop(self):
         logger.info("Stopping receiver")
         self.running = False
+        
+        if hasattr(self, 'loop') and self.loop.is_running():
+            self.loop.quit()
+        
+        if hasattr(self, 'pipeline'):
+            self.pipeline.set_state(Gst.State.NULL)
+            logger.debug("Pipeline set to NULL state")
+        
         if hasattr(self, 'thread') and self.thread.is_alive():
             self.thread.join(timeout=1.0)
-            logger.debug("Receiver thread joined")
+            logger.debug("MainLoop thread joined")
         
-        if hasattr(self, 'pipeline'):
-            self.pipeline.release()
-            logger.debug("Pipeline released")
-            
-        if hasattr(self, 'sock'):
-            self.sock.close()
-            logger.debug("Socket closed")
+        # Wake any waiting consumers and drop the last frame's buffer mapping
+        self.frames.close()
             
         # Final stats
-        self._log_stats()
+        if self.start_time:
+            self._log_stats()
 
 # Example usage
 if __name__ == "__main__":
     import argparse
     
+    # Configure logging here, not on import: tools import UDPVideoReceiver
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler("udp_receiver_debug.log")
+        ]
+    )
+    
     parser = argparse.ArgumentParser(description="UDP Video Receiver")
     parser.add_argument("--host", default="0.0.0.0", help="Host to bind to")
     parser.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    parser.add_argument("--buffer-size", type=int, default=4 * 1024 * 1024,
+                        help="Kernel receive buffer size in bytes")
+    parser.add_argument("--latency", type=int, default=50, help="Jitterbuffer latency target in ms")
+    parser.add_argument("--jitter-mode", choices=JITTER_MODES, default="slave",
+                        help="Jitterbuffer timestamping mode")
+    parser.add_argument("--no-drop-on-latency", action="store_true",
+                        help="Keep late packets instead of dropping them at the latency target")
+    parser.add_argument("--rtcp-port", type=int, help="Local RTCP port; enables rtpbin, PLI and absolute latency")
+    parser.add_argument("--rtcp-send", help="Sender RTCP address as HOST:PORT for receiver reports and PLI")
+    parser.add_argument("--decoder-threads", type=int, default=0,
+                        help="libav H.264 decoder threads (0 = one per core)")
+    parser.add_argument("--decoder", choices=[c.decoder for c in DECODER_CANDIDATES],
+                        help="Force a decoder instead of the fastest available one")
+    parser.add_argument("--benchmark-decoders", action="store_true",
+                        help="Pick the decoder by timing each candidate on a synthetic clip")
+    parser.add_argument("--detections", nargs='?', const='ws://127.0.0.1:9001/',
+                        help="Overlay results from the detection server (default ws://127.0.0.1:9001/), "
+                             "matched to frames by PTS")
+    parser.add_argument("--sync-tolerance-ms", type=float, default=20,
+                        help="Largest PTS difference between a frame and its detections")
     args = parser.parse_args()
     
     logger.info(f"Starting UDP receiver on {args.host}:{args.port}")
     
+    rtcp_send = None
+    if args.rtcp_send:
+        send_host, send_port = args.rtcp_send.rsplit(':', 1)
+        rtcp_send = (send_host, int(send_port))
+    
     try:
-        receiver = UDPVideoReceiver(host=args.host, port=args.port)
+        receiver = UDPVideoReceiver(host=args.host, port=args.port, buffer_size=args.buffer_size,
+                                    latency=args.latency, decoder_threads=args.decoder_threads,
+                                    jitter_mode=args.jitter_mode,
+                                    drop_on_latency=not args.no_drop_on_latency,
+                                    rtcp_port=args.rtcp_port, rtcp_send=rtcp_send,
+                                    decoder=args.decoder, benchmark_decoders=args.benchmark_decoders)
         receiver.start()
         
+        sync = None
+        if args.detections:
+            # Holds at most one frame back; the copy pool keeps three, so that's safe
+            sync = FrameSync(tolerance_ns=int(args.sync_tolerance_ms * 1e6), lookahead=1)
+            listener = DetectionListener(sync, args.detections)
+            listener.start()
+        
+        last_seq = 0
+        key = None
         while True:
-            frame = receiver.get_frame()
-            if frame is not None:
+            # Sleeps until a new frame arrives instead of re-processing the same one
+            received = receiver.wait_for_frame(last_seq, timeout=0.1)
+            if received is not None:
+                last_seq = received.seq
+                with received:
+                    frame = receiver.copy_bgr(received.frame)
+                ready = sync.push_frame(received.pts, frame) if sync else [(frame, None)]
+            else:
+                ready = sync.poll() if sync else []
+            for frame, detection in ready:
                 # Process frame here (AI analysis, etc.)
+                if detection is not None:
+                    draw_detections(frame, detection)
                 # Add frame number and FPS as overlay
                 stats = receiver.get_stats()
                 cv2.putText(
                     frame, 
-                    f"FPS: {stats['fps']:.1f} Drops: {stats['frames_dropped']}", 
+                    f"FPS: {stats['fps']:.1f} Drops: {stats['frames_dropped']} "
+                    f"Lost pkts: {stats['packets_lost']}", 
                     (10, 30), 
                     cv2.FONT_HERSHEY_SIMPLEX, 
                     1, 
@@ -209,18 +639,26 @@ if __name__ == "__main__":
                 
                 cv2.imshow('Remote Video', frame)
                 key = cv2.waitKey(1) & 0xFF
-                if key == ord('q'):
-                    logger.info("User requested quit")
-                    break
-                elif key == ord('d'):
+                if key == ord('d'):
                     # Print detailed debug info on demand
-                    logger.info(f"Detailed stats: {receiver.get_stats()}")
+                    logger.info(f"Detailed stats: {receiver.get_stats()}"
+                                + (f", sync: {sync.get_stats()}" if sync else ""))
+                elif key == ord('q'):
+                    break
+            if not ready:
+                # If no new frame, still handle key events
+                key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                logger.info("User requested quit")
+                break
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received")
     except Exception as e:
         logger.error(f"Exception in main loop: {str(e)}")
         logger.error(traceback.format_exc())
     finally:
+        if 'listener' in locals():
+            listener.stop()
         if 'receiver' in locals():
             receiver.stop()
         cv2.destroyAllWindows()
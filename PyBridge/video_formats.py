@@ -0,0 +1,187 @@
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # NumPy fallback below
+    cv2 = None
+
+# Per-plane (horizontal subsampling, vertical subsampling, bytes per pixel)
+PLANE_SPECS = {
+    'I420': [(1, 1, 1), (2, 2, 1), (2, 2, 1)],
+    'YV12': [(1, 1, 1), (2, 2, 1), (2, 2, 1)],
+    'NV12': [(1, 1, 1), (2, 2, 2)],
+    'NV21': [(1, 1, 1), (2, 2, 2)],
+    'GRAY8': [(1, 1, 1)],
+    'BGR': [(1, 1, 3)],
+    'RGB': [(1, 1, 3)],
+    'BGRx': [(1, 1, 4)],
+    'BGRA': [(1, 1, 4)],
+    'RGBx': [(1, 1, 4)],
+    'RGBA': [(1, 1, 4)],
+}
+
+PACKED_FORMATS = ('BGR', 'RGB', 'BGRx', 'BGRA', 'RGBx', 'RGBA')
+
+
+def _round_up(value, multiple):
+    return (value + multiple - 1) // multiple * multiple
+
+
+def _ceil_div(value, divisor):
+    return (value + divisor - 1) // divisor
+
+
+class Plane:
+    __slots__ = ('offset', 'stride', 'width', 'height', 'channels')
+
+    def __init__(self, offset, stride, width, height, channels):
+        self.offset = offset
+        self.stride = stride
+        self.width = width
+        self.height = height
+        self.channels = channels
+
+    @property
+    def end(self):
+        return self.offset + self.stride * (self.height - 1) + self.width * self.channels
+
+
+class FrameLayout:
+    """Plane geometry (offsets, strides, sizes) of one raw video frame"""
+
+    def __init__(self, format, width, height, offsets, strides):
+        if format not in PLANE_SPECS:
+            raise ValueError(f"Unsupported raw video format: {format}")
+        self.format = format
+        self.width = width
+        self.height = height
+        self.planes = [
+            Plane(offset, stride, _ceil_div(width, wdiv), _ceil_div(height, hdiv), channels)
+            for (wdiv, hdiv, channels), offset, stride in zip(PLANE_SPECS[format], offsets, strides)
+        ]
+        self.size = max(plane.end for plane in self.planes)
+
+    @classmethod
+    def default(cls, format, width, height):
+        """The layout GStreamer uses when no VideoMeta overrides it"""
+        if format in ('I420', 'YV12'):
+            y_stride = _round_up(width, 4)
+            c_stride = _round_up(_round_up(width, 2) // 2, 4)
+            y_size = y_stride * _round_up(height, 2)
+            c_size = c_stride * (_round_up(height, 2) // 2)
+            return cls(format, width, height, [0, y_size, y_size + c_size], [y_stride, c_stride, c_stride])
+        if format in ('NV12', 'NV21'):
+            stride = _round_up(width, 4)
+            return cls(format, width, height, [0, stride * _round_up(height, 2)], [stride, stride])
+        channels = PLANE_SPECS[format][0][2]
+        return cls(format, width, height, [0], [_round_up(width * channels, 4)])
+
+    def with_strides(self, offsets, strides):
+        """Same format and size with offsets/strides from a Gst VideoMeta"""
+        return FrameLayout(self.format, self.width, self.height, list(offsets), list(strides))
+
+    def plane_views(self, data):
+        """Zero-copy ndarray views of every plane in `data`"""
+        views = []
+        for plane in self.planes:
+            if plane.channels == 1:
+                shape, strides = (plane.height, plane.width), (plane.stride, 1)
+            else:
+                shape = (plane.height, plane.width, plane.channels)
+                strides = (plane.stride, plane.channels, 1)
+            views.append(np.ndarray(shape=shape, dtype=np.uint8, buffer=data,
+                                    offset=plane.offset, strides=strides))
+        return views
+
+    @property
+    def is_packed_yuv(self):
+        """True if the planes sit back-to-back without padding, which is the
+        layout cv2's single-call YUV converters expect"""
+        if self.format in PACKED_FORMATS or self.format == 'GRAY8':
+            return False
+        offset = 0
+        for plane in self.planes:
+            if plane.offset != offset or plane.stride != plane.width * plane.channels:
+                return False
+            offset += plane.stride * plane.height
+        return True
+
+
+CV2_YUV_CODES = {
+    'I420': 'COLOR_YUV2BGR_I420',
+    'YV12': 'COLOR_YUV2BGR_YV12',
+    'NV12': 'COLOR_YUV2BGR_NV12',
+    'NV21': 'COLOR_YUV2BGR_NV21',
+}
+
+
+def _pack_yuv(layout, planes):
+    """Copy (possibly padded) planes into the contiguous layout cv2 expects"""
+    packed = np.empty((layout.height * 3 // 2, layout.width), dtype=np.uint8)
+    flat = packed.reshape(-1)
+    offset = 0
+    for plane, view in zip(layout.planes, planes):
+        size = plane.width * plane.height * plane.channels
+        flat[offset:offset + size].reshape(view.shape)[...] = view
+        offset += size
+    return packed
+
+
+def _yuv_to_bgr_numpy(layout, planes):
+    """Vectorized BT.601 limited-range conversion for when cv2 is unavailable"""
+    y = planes[0].astype(np.float32)
+    if layout.format in ('NV12', 'NV21'):
+        u, v = planes[1][..., 0], planes[1][..., 1]
+        if layout.format == 'NV21':
+            u, v = v, u
+    else:
+        u, v = planes[1], planes[2]
+        if layout.format == 'YV12':
+            u, v = v, u
+    h, w = layout.height, layout.width
+    u = u.repeat(2, axis=0).repeat(2, axis=1)[:h, :w].astype(np.float32) - 128.0
+    v = v.repeat(2, axis=0).repeat(2, axis=1)[:h, :w].astype(np.float32) - 128.0
+    y = (y - 16.0) * 1.164
+    bgr = np.empty((h, w, 3), dtype=np.float32)
+    bgr[..., 0] = y + 2.018 * u
+    bgr[..., 1] = y - 0.391 * u - 0.813 * v
+    bgr[..., 2] = y + 1.596 * v
+    return np.clip(bgr, 0, 255).astype(np.uint8)
+
+
+def to_bgr(layout, planes, data=None):
+    """Convert plane views to an owned BGR ndarray. `data` (the whole mapped
+    buffer) lets packed I420/NV12 frames go to cv2 without any repacking."""
+    fmt = layout.format
+    if fmt in ('BGR', 'BGRx', 'BGRA'):
+        return np.ascontiguousarray(planes[0][..., :3])
+    if fmt in ('RGB', 'RGBx', 'RGBA'):
+        return np.ascontiguousarray(planes[0][..., 2::-1])
+    if fmt == 'GRAY8':
+        return np.repeat(planes[0][..., None], 3, axis=2)
+    if cv2 is None:
+        return _yuv_to_bgr_numpy(layout, planes)
+    if data is not None and layout.is_packed_yuv:
+        yuv = np.ndarray((layout.height * 3 // 2, layout.width), dtype=np.uint8, buffer=data)
+    else:
+        yuv = _pack_yuv(layout, planes)
+    return cv2.cvtColor(yuv, getattr(cv2, CV2_YUV_CODES[fmt]))
+
+
+def layout_from_caps(caps):
+    """FrameLayout for negotiated raw video caps, using GstVideo.VideoInfo
+    so strides/offsets match what upstream actually allocated"""
+    from gi.repository import GstVideo
+
+    structure = caps.get_structure(0)
+    format = structure.get_value('format')
+    width = structure.get_value('width')
+    height = structure.get_value('height')
+    try:
+        info = GstVideo.VideoInfo.new_from_caps(caps)
+        n_planes = info.finfo.n_planes
+        return FrameLayout(format, width, height,
+                           list(info.offset)[:n_planes], list(info.stride)[:n_planes])
+    except (AttributeError, TypeError):
+        # Older GstVideo bindings without new_from_caps or array fields
+        return FrameLayout.default(format, width, height)
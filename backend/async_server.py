@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import time
+
+from aiohttp import web
+
+from detection_store import query_category, query_polygons, submit_feedback
+from h264_stream import Fmp4Session
+from renditions import AdaptiveClient, client_options
+
+logger = logging.getLogger('AsyncVideoServer')
+
+MJPEG_CONTENT_TYPE = 'multipart/x-mixed-replace; boundary=frame'
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS':
+        # Preflight for JSON POSTs such as polygon feedback
+        response = web.Response()
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = request.headers.get(
+            'Access-Control-Request-Headers', 'Content-Type')
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+async def pump_glib(context=None, interval=0.02):
+    """Run the GLib main context (bus watches etc.) from the asyncio loop
+    instead of a dedicated GLib.MainLoop thread."""
+    from gi.repository import GLib
+    context = context or GLib.MainContext.default()
+    while True:
+        while context.pending():
+            context.iteration(False)
+        await asyncio.sleep(interval)
+
+
+class AsyncVideoServer:
+    """Serves /video_feed and / from one event loop. Each client gets a
+    bounded drop-oldest queue from the FrameHub and is only sent the next
+    frame once the previous write has drained, so slow clients skip frames
+    instead of buffering them."""
+
+    def __init__(self, frame_hub, status_page, send_timeout=10.0, frame_timeout=10.0, drive_glib=True,
+                 renditions=None, h264=None, snapshot=None, detections=None):
+        self.frame_hub = frame_hub
+        self.detections = detections
+        self.snapshot = snapshot
+        self.renditions = renditions
+        self.h264 = h264
+        self.drive_glib = drive_glib
+        self.status_page = status_page
+        self.send_timeout = send_timeout
+        self.frame_timeout = frame_timeout
+        self.app = web.Application(middlewares=[cors_middleware])
+        self.app.router.add_get('/', self.index)
+        self.app.router.add_get('/video_feed', self.video_feed)
+        if h264:
+            self.app.router.add_get('/video.mp4', self.video_mp4)
+        if snapshot:
+            self.app.router.add_get('/snapshot.jpg', self.snapshot_jpg)
+        if detections is not None:
+            self.app.router.add_get('/api/polygons', self.api_polygons)
+            self.app.router.add_get('/api/polygons/category/{category}', self.api_polygons_category)
+            self.app.router.add_post('/api/polygons/{polygon_id}/feedback', self.api_polygon_feedback)
+        self.app.on_startup.append(self._on_startup)
+        self.app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_startup(self, app):
+        if self.drive_glib:
+            app['glib_pump'] = asyncio.create_task(pump_glib())
+
+    async def _on_cleanup(self, app):
+        if 'glib_pump' in app:
+            app['glib_pump'].cancel()
+        self.frame_hub.close()
+        if self.renditions:
+            self.renditions.close()
+        if self.h264:
+            self.h264.hub.close()
+
+    async def index(self, request):
+        logger.info("Received request for index page")
+        return web.Response(text=self.status_page(), content_type='text/html')
+
+    async def video_feed(self, request):
+        logger.info(f"Received request for /video_feed from {request.remote}")
+        response = web.StreamResponse(headers={
+            'Content-Type': MJPEG_CONTENT_TYPE,
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        if self.renditions:
+            # Query parameters cap width/quality/fps; throughput picks the rendition
+            subscription = AdaptiveClient(self.renditions, loop=loop,
+                                          **client_options(self.renditions, request.query))
+        else:
+            subscription = self.frame_hub.subscribe_async(loop)
+        try:
+            await response.write(b'--frame\r\nContent-Type: text/plain\r\n\r\n'
+                                 b'Connection established, waiting for first frame...\r\n')
+            while True:
+                frame = await subscription.get_async(timeout=self.frame_timeout)
+                if frame is None:
+                    if not subscription.closed:
+                        logger.warning("Timeout waiting for video frames")
+                        await response.write(b'--frame\r\nContent-Type: text/plain\r\n\r\n'
+                                             b'Timeout waiting for video frames\r\n')
+                    break
+                # write() awaits the transport draining, which is our backpressure
+                sent_at = time.monotonic()
+                await asyncio.wait_for(response.write(frame.part), self.send_timeout)
+                if self.renditions:
+                    subscription.record_send(len(frame.part), time.monotonic() - sent_at)
+        except asyncio.TimeoutError:
+            logger.warning(f"Client {request.remote} stalled for {self.send_timeout}s, disconnecting")
+        except ConnectionResetError:
+            logger.info(f"Client {request.remote} disconnected")
+        finally:
+            subscription.close()
+        return response
+
+    async def snapshot_jpg(self, request):
+        # May wait for a frame or make a thumbnail, so keep it off the loop
+        status, headers, body = await asyncio.get_running_loop().run_in_executor(
+            None, self.snapshot.respond, request.query, request.headers.get('If-None-Match'))
+        return web.Response(body=body, status=status, headers=headers)
+
+    async def api_polygons(self, request):
+        return web.Response(text=query_polygons(self.detections, request.query),
+                            content_type='application/json')
+
+    async def api_polygons_category(self, request):
+        return web.Response(text=query_category(self.detections, request.match_info['category'],
+                                                request.query),
+                            content_type='application/json')
+
+    async def api_polygon_feedback(self, request):
+        try:
+            feedback = await request.json()
+        except ValueError:
+            feedback = None
+        status, body = submit_feedback(self.detections, request.match_info['polygon_id'], feedback)
+        return web.json_response(body, status=status)
+
+    async def video_mp4(self, request):
+        logger.info(f"Received request for /video.mp4 from {request.remote}")
+        response = web.StreamResponse(headers={
+            'Content-Type': 'video/mp4',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+
+        subscription = self.h264.hub.subscribe_async(asyncio.get_running_loop())
+        session = Fmp4Session(self.h264)
+        try:
+            while True:
+                frame = await subscription.get_async(timeout=self.frame_timeout)
+                if frame is None:
+                    if not subscription.closed:
+                        logger.warning("Timeout waiting for H.264 frames")
+                    break
+                for chunk in session.packetize(frame):
+                    await asyncio.wait_for(response.write(chunk), self.send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Client {request.remote} stalled for {self.send_timeout}s, disconnecting")
+        except ConnectionResetError:
+            logger.info(f"Client {request.remote} disconnected")
+        finally:
+            logger.info(f"H.264 client done (resyncs={session.resyncs})")
+            subscription.close()
+        return response
+
+    def run(self, host='0.0.0.0', port=8080):
+        logger.info(f"Starting asyncio server on {host}:{port}")
+        web.run_app(self.app, host=host, port=port, print=None)
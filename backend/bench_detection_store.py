@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: DetectionStore insert and query latency at full retention.
+
+Fills the store with `--seconds` of results at `--fps` frames per second and
+`--objects` detections per frame, then times each /api/polygons query.
+
+    python bench_detection_store.py --fps 30 --objects 100 --seconds 60
+"""
+
+import argparse
+import json
+import random
+import time
+
+from detection_store import DetectionStore, query_category, query_polygons
+
+LABELS = ('person', 'face', 'hand', 'object')
+
+
+def make_objects(count):
+    objects = []
+    for i in range(count):
+        # Rounded like the detection server's output
+        x, y = round(random.random() * 0.9, 4), round(random.random() * 0.9, 4)
+        objects.append({
+            "object_id": i + 1, "class_id": i % len(LABELS), "label": LABELS[i % len(LABELS)],
+            "confidence": round(random.random(), 3),
+            "polygon": [{"x": x, "y": y}, {"x": round(x + 0.1, 4), "y": y},
+                        {"x": round(x + 0.1, 4), "y": round(y + 0.1, 4)}, {"x": x, "y": round(y + 0.1, 4)}],
+        })
+    return objects
+
+
+def timed(fn, repeats):
+    """(p50, p99, max) latency in microseconds"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {"p50_us": samples[len(samples) // 2], "p99_us": samples[int(len(samples) * 0.99)],
+            "max_us": samples[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection store query benchmark")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--objects", type=int, default=100, help="Detections per frame")
+    parser.add_argument("--seconds", type=int, default=60, help="Retention")
+    parser.add_argument("--repeats", type=int, default=1000, help="Runs per query")
+    parser.add_argument("--json", action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    frames = args.fps * args.seconds
+    store = DetectionStore(max_frames=frames)
+    # A few distinct object lists are enough; the store copies into its own records
+    templates = [make_objects(args.objects) for _ in range(8)]
+    start_time = time.time() - 2 * args.seconds
+
+    # Twice the retention, so the second half measures insert with eviction
+    insert_start = time.perf_counter()
+    for n in range(2 * frames):
+        store.add(n, templates[n % len(templates)], timestamp=start_time + n / args.fps)
+    insert_s = time.perf_counter() - insert_start
+
+    newest = 2 * frames - 1
+    middle = store.between()[frames // 2]
+    queries = {
+        "latest_frame": lambda: query_polygons(store, {}),
+        "at_frame": lambda: query_polygons(store, {'frame': str(newest - frames // 2)}),
+        "latest_100": lambda: query_polygons(store, {'limit': '100'}),
+        "category_latest_100": lambda: query_category(store, 'face', {'limit': '100'}),
+        "time_range_1s": lambda: query_polygons(store, {'since': str(middle.timestamp),
+                                                         'until': str(middle.timestamp + 1)}),
+        "by_id": lambda: store.get(f"{newest}-1"),
+    }
+    results = {
+        "fps": args.fps, "objects_per_frame": args.objects, "retention_s": args.seconds,
+        "stored_detections": store.get_stats()["detections"],
+        "insert_frames_per_s": 2 * frames / insert_s,
+        "queries": {name: timed(fn, args.repeats) for name, fn in queries.items()},
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results['stored_detections']} detections stored, "
+          f"{results['insert_frames_per_s']:.0f} frames/s inserted with eviction")
+    print(f"{'query':<22} {'p50 us':>10} {'p99 us':>10} {'max us':>10}")
+    for name, r in results["queries"].items():
+        print(f"{name:<22} {r['p50_us']:>10.1f} {r['p99_us']:>10.1f} {r['max_us']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: MB/s parsed by MultipartJpegFramer versus the original
+generate_frames() bytes-concatenation parser.
+
+    python bench_framer.py --frames 300 --frame-size 40000 --frame-size 250000
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+
+from mjpeg_framer import MultipartJpegFramer
+
+BOUNDARY = b'spionisto'
+
+
+def build_stream(frame_size, frames):
+    """Synthesize multipartmux-style output with JPEG-like payloads"""
+    payload = b'\xff\xd8' + os.urandom(frame_size - 4) + b'\xff\xd9'
+    header = (b'\r\n--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+              b'Content-Length: ' + str(len(payload)).encode('ascii') + b'\r\n\r\n')
+    return (header + payload) * frames
+
+
+def parse_legacy(stream, recv_size):
+    """The parser generate_frames() used before MultipartJpegFramer"""
+    boundary = b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+    source = io.BytesIO(stream)
+    frame = b''
+    count = 0
+    while True:
+        data = source.read(recv_size)
+        if not data:
+            break
+        frame += data
+        boundary_pos = frame.find(boundary)
+        while boundary_pos != -1:
+            jpeg_data = frame[:boundary_pos]
+            frame = frame[boundary_pos + len(boundary):]
+            if jpeg_data:
+                count += 1
+            boundary_pos = frame.find(boundary)
+    return count
+
+
+def parse_framer(stream, recv_size):
+    framer = MultipartJpegFramer(BOUNDARY, recv_size=recv_size)
+    source = io.BytesIO(stream)
+    count = 0
+    while framer.read_from(source):
+        for _ in framer.frames():
+            count += 1
+    return count
+
+
+def run(parser, stream, recv_size, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parser(stream, recv_size)
+        best = min(best, time.perf_counter() - start)
+    return len(stream) / best / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multipart JPEG parser benchmark")
+    parser.add_argument("--frames", type=int, default=200, help="Frames per stream")
+    parser.add_argument("--frame-size", type=int, action='append',
+                        help="JPEG payload size in bytes (repeatable)")
+    parser.add_argument("--recv-size", type=int, action='append',
+                        help="Framer receive size in bytes (repeatable)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per case, best is reported")
+    parser.add_argument("--json", action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    # ~640x480 and ~1080p JPEG sizes at quality 70
+    frame_sizes = args.frame_size or [40_000, 250_000]
+    recv_sizes = args.recv_size or [64 * 1024, 256 * 1024, 1024 * 1024]
+
+    results = []
+    for frame_size in frame_sizes:
+        stream = build_stream(frame_size, args.frames)
+        results.append({"parser": "legacy", "frame_size": frame_size, "recv_size": 4096,
+                        "mb_per_s": run(parse_legacy, stream, 4096, args.repeats)})
+        for recv_size in recv_sizes:
+            results.append({"parser": "framer", "frame_size": frame_size, "recv_size": recv_size,
+                            "mb_per_s": run(parse_framer, stream, recv_size, args.repeats)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'parser':<8} {'frame size':>11} {'recv size':>10} {'MB/s':>10}")
+    for r in results:
+        print(f"{r['parser']:<8} {r['frame_size']:>11} {r['recv_size']:>10} {r['mb_per_s']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Demand-driven encoding: drop buffers ahead of the JPEG encoder while no
+client is subscribed, and account process CPU to the idle/active states.
+"""
+
+import logging
+import threading
+import time
+
+from gi.repository import Gst
+
+logger = logging.getLogger('DemandGate')
+
+
+def find_gate_pad(element):
+    """The earliest pad feeding `element` that only feeds the encode branch:
+    the pad after the nearest upstream tee, or the source's src pad when the
+    whole pipeline is the encode branch"""
+    pad = element.get_static_pad('sink')
+    while pad is not None:
+        peer = pad.get_peer()
+        if peer is None:
+            return pad
+        upstream = peer.get_parent_element()
+        factory = upstream.get_factory()
+        if factory is not None and factory.get_name() == 'tee':
+            return pad
+        sink = upstream.get_static_pad('sink')
+        if sink is None:
+            return peer
+        pad = sink
+    return None
+
+
+def find_element(pipeline, factory_name):
+    for element in pipeline.iterate_recurse():
+        factory = element.get_factory()
+        if factory is not None and factory.get_name() == factory_name:
+            return element
+    return None
+
+
+class CpuAccounting:
+    """Process CPU% sampled once a second and attributed to the state the
+    gate was in, so the status page can show what idling actually saves"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.totals = {'idle': [0.0, 0.0], 'active': [0.0, 0.0]}  # [cpu seconds, wall seconds]
+        self.state = 'idle'
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        last_cpu, last_wall = time.process_time(), time.monotonic()
+        while self.running:
+            time.sleep(self.interval)
+            cpu, wall = time.process_time(), time.monotonic()
+            totals = self.totals[self.state]
+            totals[0] += cpu - last_cpu
+            totals[1] += wall - last_wall
+            last_cpu, last_wall = cpu, wall
+
+    def get_stats(self):
+        return {
+            f"{state}_cpu_percent": (cpu / wall * 100) if wall else None
+            for state, (cpu, wall) in self.totals.items()
+        }
+
+
+class DemandGate:
+    """Drops buffers at `pad` while none of `hubs` has a subscriber. The probe
+    is only installed while idle, so an active branch pays nothing, and the
+    next captured frame goes through as soon as a client subscribes."""
+
+    def __init__(self, pad, hubs, cpu=None):
+        self.pad = pad
+        self.hubs = hubs
+        self.cpu = cpu
+        self._lock = threading.Lock()
+        self._probe_id = None
+        self.changed_at = time.monotonic()
+        self.frames_skipped = 0
+        for hub in hubs:
+            hub.add_listener(self._update)
+        self._update()
+
+    @property
+    def active(self):
+        return self._probe_id is None
+
+    def _drop(self, pad, info):
+        self.frames_skipped += 1
+        return Gst.PadProbeReturn.DROP
+
+    def _update(self, count=None):
+        # Listeners run on the subscribing/unsubscribing threads, possibly at
+        # once; reading the live counts under the lock makes whichever runs
+        # last decide, so a stale "no subscribers" can't close the gate on a
+        # client that has just joined
+        with self._lock:
+            active = any(hub.subscriber_count for hub in self.hubs)
+            if active and self._probe_id is not None:
+                self.pad.remove_probe(self._probe_id)
+                self._probe_id = None
+            elif not active and self._probe_id is None:
+                self._probe_id = self.pad.add_probe(Gst.PadProbeType.BUFFER, self._drop)
+            else:
+                return
+            self.changed_at = time.monotonic()
+        if self.cpu is not None:
+            self.cpu.state = 'active' if active else 'idle'
+        logger.info(f"Encoding {'resumed' if active else 'paused, no subscribers'} "
+                    f"(gate at {self.pad.get_parent_element().get_name()}:{self.pad.get_name()})")
+
+    def get_stats(self):
+        stats = {
+            "state": 'active' if self.active else 'idle',
+            "since_s": time.monotonic() - self.changed_at,
+            "frames_skipped": self.frames_skipped,
+        }
+        if self.cpu is not None:
+            stats.update(self.cpu.get_stats())
+        return stats
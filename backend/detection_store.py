@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""Recent detection results for the /api/polygons endpoints.
+
+DetectionStore keeps the last `max_frames` frames of results in a fixed
+ring, with indexes so that every query the frontend makes avoids a scan:
+
+    at_frame(F)                 dict lookup
+    latest(N) / latest_frame()  walk back from the ring's newest end
+    category(C, N)              per-category deque, newest N
+    between(t0, t1)             binary search on the time-ordered ring
+    get(id)                     dict lookup
+
+Evicting a frame removes its detections from every index, so memory stays
+bounded. DetectionFeed fills the store from the detection WebSocket server
+(PyBridge/detection_server.py).
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('DetectionStore')
+
+
+_dumps = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def json_array(detections):
+    """JSON array text of stored detections"""
+    return '[' + ','.join(d.json for d in detections) + ']'
+
+
+class StoredDetection:
+    """One stored object. Its aiPolygonService.js representation is encoded
+    to JSON once on insert, so queries only join strings and a full store
+    holds two small objects per detection for the GC to walk."""
+    __slots__ = ('id', 'frame_number', 'timestamp', 'label', 'category', 'json')
+
+    def __init__(self, frame_number, timestamp, obj):
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.id = f"{frame_number}-{obj.get('object_id')}"
+        self.label = obj.get('label') or 'object'
+        self.category = self.label.lower()
+        # Points stay normalized to 0-1, as the detection server sends them
+        self.json = _dumps({
+            "id": self.id,
+            "label": self.label,
+            "confidence": obj.get('confidence'),
+            "points": obj.get('polygon') or [],
+            "metadata": {
+                "frame": frame_number,
+                "timestamp": timestamp,
+                "object_id": obj.get('object_id'),
+                "class_id": obj.get('class_id'),
+                "category": self.category,
+                "feedback": None,
+            },
+        })
+
+    def set_feedback(self, feedback):
+        polygon = json.loads(self.json)
+        polygon["metadata"]["feedback"] = feedback
+        self.json = _dumps(polygon)
+
+
+class FrameRecord:
+    __slots__ = ('frame_number', 'timestamp', 'detections')
+
+    def __init__(self, frame_number, timestamp, detections):
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.detections = detections
+
+
+class DetectionStore:
+    def __init__(self, max_frames=1800, max_feedback=10000):
+        self.max_frames = max_frames
+        self._ring = [None] * max_frames
+        self._head = 0  # oldest record
+        self._count = 0
+        self._by_frame = {}
+        self._by_id = {}
+        self._by_category = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        # Feedback outlives the detections it is about, up to a bound
+        self.feedback = collections.OrderedDict()
+        self.max_feedback = max_feedback
+        self.frames_added = 0
+        self.frames_evicted = 0
+
+    def __len__(self):
+        return self._count
+
+    def _at(self, index):
+        """Record by age, 0 = oldest"""
+        return self._ring[(self._head + index) % self.max_frames]
+
+    def add(self, frame_number, objects, timestamp=None):
+        """Store one frame's objects (dicts as sent by the detection server)"""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            if self._count:
+                # Keep the ring ordered by time even if a source's clock jumps
+                timestamp = max(timestamp, self._at(self._count - 1).timestamp)
+            record = FrameRecord(frame_number, timestamp,
+                                 [StoredDetection(frame_number, timestamp, obj) for obj in objects])
+            if self._count == self.max_frames:
+                self._evict()
+            self._ring[(self._head + self._count) % self.max_frames] = record
+            self._count += 1
+            # A restarted source reuses frame numbers: the newest one wins
+            self._by_frame[frame_number] = record
+            for detection in record.detections:
+                self._by_id[detection.id] = detection
+                self._by_category[detection.category].append(detection)
+            self.frames_added += 1
+        return record
+
+    def _evict(self):
+        record = self._ring[self._head]
+        self._ring[self._head] = None
+        self._head = (self._head + 1) % self.max_frames
+        self._count -= 1
+        self.frames_evicted += 1
+        if self._by_frame.get(record.frame_number) is record:
+            del self._by_frame[record.frame_number]
+        for detection in record.detections:
+            if self._by_id.get(detection.id) is detection:
+                del self._by_id[detection.id]
+            # Category deques are in insertion order, so the oldest frame's
+            # detections are at their left ends
+            category = self._by_category[detection.category]
+            category.popleft()
+            if not category:
+                del self._by_category[detection.category]
+
+    def latest_frame(self):
+        with self._lock:
+            return self._at(self._count - 1) if self._count else None
+
+    def latest(self, limit):
+        """The newest `limit` detections, newest first"""
+        with self._lock:
+            records = (self._at(i) for i in range(self._count - 1, -1, -1))
+            detections = itertools.chain.from_iterable(reversed(r.detections) for r in records)
+            return list(itertools.islice(detections, limit))
+
+    def at_frame(self, frame_number):
+        with self._lock:
+            return self._by_frame.get(frame_number)
+
+    def category(self, category, limit):
+        """The newest `limit` detections of a category, newest first"""
+        with self._lock:
+            detections = self._by_category.get(category.lower())
+            return list(itertools.islice(reversed(detections), limit)) if detections else []
+
+    def _bisect(self, timestamp):
+        """Index of the first record at or after `timestamp`"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._at(mid).timestamp < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def between(self, since=None, until=None, limit=None):
+        """Frame records with since <= timestamp < until, oldest first"""
+        with self._lock:
+            start = self._bisect(since) if since is not None else 0
+            end = self._bisect(until) if until is not None else self._count
+            if limit is not None:
+                start = max(start, end - limit)
+            return [self._at(i) for i in range(start, end)]
+
+    def get(self, detection_id):
+        with self._lock:
+            return self._by_id.get(detection_id)
+
+    def add_feedback(self, detection_id, feedback):
+        """Attach client feedback to a stored detection. False if it was
+        never stored or has been evicted."""
+        with self._lock:
+            detection = self._by_id.get(detection_id)
+            if detection is None:
+                return False
+            detection.set_feedback(feedback)
+            self.feedback[detection_id] = dict(feedback, label=detection.label,
+                                               frame=detection.frame_number, received=time.time())
+            while len(self.feedback) > self.max_feedback:
+                self.feedback.popitem(last=False)
+            return True
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "frames": self._count,
+                "max_frames": self.max_frames,
+                "detections": len(self._by_id),
+                "categories": {c: len(d) for c, d in self._by_category.items()},
+                "frames_added": self.frames_added,
+                "frames_evicted": self.frames_evicted,
+                "feedback": len(self.feedback),
+            }
+
+
+def _number(args, key, cast, default=None):
+    try:
+        return cast(args[key]) if args.get(key) else default
+    except ValueError:
+        return default
+
+
+def _count(args, key, default=None):
+    """A non-negative count parameter; negative values clamp to 0"""
+    value = _number(args, key, int, default)
+    return max(0, value) if value is not None else None
+
+
+def query_polygons(store, args):
+    """GET /api/polygons as JSON text: ?frame=F, ?since=&until= (unix
+    seconds, optionally ?frames=N newest) or ?limit=N; without parameters
+    the newest frame's detections"""
+    frame = _number(args, 'frame', int)
+    if frame is not None:
+        record = store.at_frame(frame)
+        return json_array(record.detections if record else ())
+    since, until = _number(args, 'since', float), _number(args, 'until', float)
+    if since is not None or until is not None:
+        records = store.between(since, until, limit=_count(args, 'frames'))
+        return json_array(d for r in records for d in r.detections)
+    limit = _count(args, 'limit')
+    if limit is not None:
+        return json_array(store.latest(limit))
+    record = store.latest_frame()
+    return json_array(record.detections if record else ())
+
+
+def query_category(store, category, args):
+    """GET /api/polygons/category/<category>?limit=N as JSON text"""
+    return json_array(store.category(category, _count(args, 'limit', 100)))
+
+
+def submit_feedback(store, detection_id, feedback):
+    """POST /api/polygons/<id>/feedback -> (HTTP status, JSON body)"""
+    if not isinstance(feedback, dict):
+        return 400, {"error": "Feedback must be a JSON object"}
+    if not store.add_feedback(detection_id, feedback):
+        return 404, {"error": f"Unknown or expired polygon {detection_id}"}
+    return 200, {"status": "ok", "id": detection_id}
+
+
+class DetectionFeed:
+    """Subscribes to the detection WebSocket server and stores every result.
+    Runs its own event loop thread so it works under Flask too."""
+
+    def __init__(self, store, url='ws://127.0.0.1:9001/', reconnect_delay=2.0):
+        self.store = store
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.running = False
+        self.connected = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._run()), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    async def _run(self):
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            while self.running:
+                try:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        logger.info(f"Connected to detection server at {self.url}")
+                        self.connected = True
+                        async for msg in ws:
+                            if not self.running:
+                                break
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                self._store(msg.data)
+                except aiohttp.ClientError as e:
+                    logger.warning(f"Could not read detections from {self.url}: {e}")
+                self.connected = False
+                if self.running:
+                    await asyncio.sleep(self.reconnect_delay)
+
+    def _store(self, text):
+        try:
+            message = json.loads(text)
+            # The frame's wall-clock time, so ?since=/&until= line up with X-Timestamp
+            self.store.add(message['frame_number'], message.get('objects') or [], message.get('timestamp'))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring malformed detection message: {e}")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Minimal fragmented MP4 (ISO BMFF) packaging for a single H.264 track.
+
+init_segment() builds ftyp+moov from the avcC codec_data that h264parse puts
+in its caps (stream-format=avc). fragment_header() builds the moof+mdat
+header for one access unit, so a fragment is header + the unmodified sample
+bytes and the sample data can be shared by every client.
+"""
+
+import struct
+
+TIMESCALE = 90000
+
+# trun: data-offset, sample-duration, sample-size and sample-flags present
+TRUN_FLAGS = 0x000001 | 0x000100 | 0x000200 | 0x000400
+TFHD_DEFAULT_BASE_IS_MOOF = 0x020000
+SYNC_SAMPLE_FLAGS = 0x02000000       # depends on no other sample
+NON_SYNC_SAMPLE_FLAGS = 0x01010000   # depends on others, not a sync sample
+
+UNITY_MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+def box(kind, *payloads):
+    body = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+def init_segment(width, height, codec_data, timescale=TIMESCALE):
+    """ftyp + moov for one avc1 video track (track id 1)"""
+    ftyp = box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isom', b'iso6', b'avc1', b'mp41')
+
+    mvhd = full_box(b'mvhd', 0, 0,
+                    struct.pack('>IIII', 0, 0, 1000, 0),
+                    struct.pack('>IH', 0x00010000, 0x0100), bytes(10),
+                    UNITY_MATRIX, bytes(24), struct.pack('>I', 2))
+    tkhd = full_box(b'tkhd', 0, 0x3,
+                    struct.pack('>IIIII', 0, 0, 1, 0, 0), bytes(8),
+                    struct.pack('>hhhH', 0, 0, 0, 0), UNITY_MATRIX,
+                    struct.pack('>II', width << 16, height << 16))
+    mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, 0, 0x55c4, 0))
+    hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s', 0, b'vide'), bytes(12), b'VideoHandler\0')
+
+    avc1 = box(b'avc1',
+               bytes(6), struct.pack('>H', 1),          # reserved, data_reference_index
+               bytes(16),                              # pre_defined / reserved
+               struct.pack('>HHIIIH', width, height, 0x00480000, 0x00480000, 0, 1),
+               bytes(32),                              # compressorname
+               struct.pack('>Hh', 0x0018, -1),
+               box(b'avcC', codec_data))
+    stbl = box(b'stbl',
+               full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+               full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+               full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+    minf = box(b'minf',
+               full_box(b'vmhd', 0, 1, bytes(8)),
+               box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1))),
+               stbl)
+    trak = box(b'trak', tkhd, box(b'mdia', mdhd, hdlr, minf))
+    mvex = box(b'mvex', full_box(b'trex', 0, 0, struct.pack('>IIIII', 1, 1, 0, 0, 0)))
+    return ftyp + box(b'moov', mvhd, trak, mvex)
+
+
+def _moof(sequence, base_decode_time, duration, size, keyframe, data_offset):
+    flags = SYNC_SAMPLE_FLAGS if keyframe else NON_SYNC_SAMPLE_FLAGS
+    return box(b'moof',
+               full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)),
+               box(b'traf',
+                   full_box(b'tfhd', 0, TFHD_DEFAULT_BASE_IS_MOOF, struct.pack('>I', 1)),
+                   full_box(b'tfdt', 1, 0, struct.pack('>Q', base_decode_time)),
+                   full_box(b'trun', 0, TRUN_FLAGS,
+                            struct.pack('>IiIII', 1, data_offset, duration, size, flags))))
+
+
+# The moof above has a fixed layout, so its length is a constant
+MOOF_SIZE = len(_moof(0, 0, 0, 0, True, 0))
+
+
+def fragment_header(sequence, base_decode_time, duration, size, keyframe):
+    """moof + mdat header for one sample of `size` bytes; the sample bytes
+    follow directly"""
+    moof = _moof(sequence, base_decode_time, duration, size, keyframe, MOOF_SIZE + 8)
+    return moof + struct.pack('>I4s', 8 + size, b'mdat')
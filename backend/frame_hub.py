@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import asyncio
+import collections
+import logging
+import socket
+import threading
+import time
+
+from mjpeg_framer import DEFAULT_RECV_SIZE, MultipartJpegFramer
+
+logger = logging.getLogger('FrameHub')
+
+
+class Frame:
+    """A single encoded frame shared by every subscriber. `pts` is the
+    pipeline timestamp in ns when known; `info` carries codec-specific
+    metadata for non-JPEG hubs."""
+    __slots__ = ('seq', 'timestamp', 'data', 'part', 'info', 'pts')
+
+    def __init__(self, seq, timestamp, data, multipart=True, info=None, pts=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.data = data
+        self.info = info
+        self.pts = pts
+        # Build the multipart chunk once so N clients don't make N copies.
+        # X-PTS is this server's pipeline time, a different clock from the
+        # sender RTP time in detection messages' "pts": it orders frames but
+        # can't be compared with detections. X-Timestamp (wall clock) and
+        # the detections' "timestamp" share a clock and are what a client
+        # joins on, to within the detection receiver's transport latency.
+        self.part = (b'--frame\r\n'
+                     b'Content-Type: image/jpeg\r\n'
+                     b'Content-Length: ' + str(len(data)).encode('ascii') + b'\r\n'
+                     b'X-Frame-Seq: ' + str(seq).encode('ascii') + b'\r\n' +
+                     (b'X-PTS: ' + str(pts).encode('ascii') + b'\r\n' if pts is not None else b'') +
+                     b'X-Timestamp: ' + f"{timestamp:.6f}".encode('ascii') + b'\r\n\r\n' +
+                     data + b'\r\n') if multipart else None
+
+
+class FrameSubscription:
+    """Bounded per-client frame queue. When full the oldest frame is dropped."""
+
+    def __init__(self, hub, queue_size):
+        self._hub = hub
+        self._frames = collections.deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+
+    def _push(self, frame):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+            self._frames.append(frame)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Block until a frame is available. Returns None on timeout or close."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frames or self.closed, timeout):
+                return None
+            if not self._frames:
+                return None
+            self.delivered += 1
+            return self._frames.popleft()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self._hub.unsubscribe(self)
+
+
+class LatestFrameSubscription(FrameSubscription):
+    """Holds only the newest frame and never counts drops. Keeps a lazily
+    encoding producer running for pollers that don't consume every frame."""
+
+    def _push(self, frame):
+        with self._cond:
+            self._frames.clear()
+            self._frames.append(frame)
+            self._cond.notify()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AsyncFrameSubscription(FrameSubscription):
+    """FrameSubscription consumed from an asyncio event loop. The producer
+    thread only schedules a wakeup when the consumer is actually waiting."""
+
+    def __init__(self, hub, queue_size, loop):
+        super().__init__(hub, queue_size)
+        self._loop = loop
+        self._waiter = None
+
+    def _push(self, frame):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+            self._frames.append(frame)
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_wake, waiter)
+
+    async def get_async(self, timeout=None):
+        """Wait for the next frame. Returns None on timeout or close."""
+        with self._cond:
+            if not self._frames and not self.closed:
+                self._waiter = self._loop.create_future()
+            waiter = self._waiter
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+        with self._cond:
+            self._waiter = None
+            if not self._frames:
+                return None
+            self.delivered += 1
+            return self._frames.popleft()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._loop.call_soon_threadsafe(_wake, waiter)
+        self._hub.unsubscribe(self)
+
+
+class FrameHub:
+    """Single-producer / multi-consumer fan-out of encoded frames"""
+
+    def __init__(self, queue_size=2, multipart=True):
+        self.queue_size = queue_size
+        self.multipart = multipart
+        self._lock = threading.Lock()
+        # Copy-on-write tuple so publish() can iterate without holding the lock
+        self._subscribers = ()
+        self.latest = None
+        self.frames_published = 0
+        self.bytes_published = 0
+        self._listeners = ()
+
+    def add_listener(self, callback):
+        """callback(subscriber_count) after every subscribe/unsubscribe, e.g.
+        to stop encoding when nobody is watching"""
+        self._listeners = self._listeners + (callback,)
+
+    def _notify(self, count):
+        for callback in self._listeners:
+            try:
+                callback(count)
+            except Exception as e:
+                logger.error(f"Subscriber listener {callback} failed: {e}")
+
+    def subscribe(self, queue_size=None):
+        return self._add(FrameSubscription(self, queue_size or self.queue_size))
+
+    def subscribe_latest(self):
+        return self._add(LatestFrameSubscription(self, 1))
+
+    def subscribe_async(self, loop, queue_size=None):
+        return self._add(AsyncFrameSubscription(self, queue_size or self.queue_size, loop))
+
+    def _add(self, sub):
+        with self._lock:
+            self._subscribers = self._subscribers + (sub,)
+            count = len(self._subscribers)
+        logger.info(f"Subscriber added ({count} active)")
+        self._notify(count)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub not in self._subscribers:
+                return
+            self._subscribers = tuple(s for s in self._subscribers if s is not sub)
+            count = len(self._subscribers)
+        logger.info(f"Subscriber removed ({count} active, "
+                    f"delivered={sub.delivered}, dropped={sub.dropped})")
+        self._notify(count)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, data, timestamp=None, info=None, pts=None):
+        frame = Frame(self.frames_published + 1, timestamp or time.time(), data,
+                      multipart=self.multipart, info=info, pts=pts)
+        self.latest = frame
+        self.frames_published += 1
+        self.bytes_published += len(frame.data)
+        for sub in self._subscribers:
+            sub._push(frame)
+        return frame
+
+    def close(self):
+        for sub in self._subscribers:
+            sub.close()
+
+    def get_stats(self):
+        subscribers = self._subscribers
+        return {
+            "subscribers": len(subscribers),
+            "frames_published": self.frames_published,
+            "bytes_published": self.bytes_published,
+            "frames_dropped": sum(s.dropped for s in subscribers),
+        }
+
+
+class TcpMultipartSource:
+    """Reads the multipart JPEG stream from a tcpserversink once and publishes
+    each frame to a FrameHub. Reconnects if the server goes away."""
+
+    def __init__(self, hub, host='127.0.0.1', port=5000, boundary=b'spionisto',
+                 recv_size=DEFAULT_RECV_SIZE, reconnect_delay=1.0):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.framer = MultipartJpegFramer(boundary, recv_size=recv_size)
+        self.reconnect_delay = reconnect_delay
+        self.running = False
+        self.thread = None
+        self.current_fps = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+
+    def _run(self):
+        while self.running:
+            try:
+                self._read_stream()
+            except (ConnectionRefusedError, socket.timeout) as e:
+                logger.warning(f"Could not read from {self.host}:{self.port}: {e}")
+            except Exception as e:
+                logger.error(f"Error reading frames: {e}", exc_info=True)
+            if self.running:
+                time.sleep(self.reconnect_delay)
+
+    def _read_stream(self):
+        with socket.create_connection((self.host, self.port), timeout=10) as sock:
+            logger.info(f"Connected to TCP server at {self.host}:{self.port}")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.framer.recv_size)
+            self.framer.reset()
+            frame_count = 0
+            last_log_time = time.time()
+
+            while self.running:
+                if not self.framer.read_from(sock):
+                    logger.warning("Received empty data, connection may be closed")
+                    return
+
+                for jpeg_data in self.framer.frames():
+                    if not (jpeg_data.startswith(b'\xff\xd8') and jpeg_data.endswith(b'\xff\xd9')):
+                        logger.warning(f"Frame may not be a valid JPEG - first 10 bytes: {jpeg_data[:10]}")
+                    self.hub.publish(jpeg_data)
+                    frame_count += 1
+
+                # Log frame rate every 5 seconds
+                current_time = time.time()
+                if current_time - last_log_time > 5:
+                    self.current_fps = frame_count / (current_time - last_log_time)
+                    logger.info(f"Frame rate: {self.current_fps:.2f} fps, "
+                                f"{self.hub.subscriber_count} subscribers")
+                    frame_count = 0
+                    last_log_time = current_time
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import errno
+import itertools
+import logging
+import mmap
+import os
+import select
+import socket
+import struct
+import time
+
+MAGIC = b'MAYARNG1'
+# magic, slot count, slot size, sequence number of the newest complete frame
+HEADER = struct.Struct('<8sIIQ')
+# frame sequence number, capture timestamp, payload length
+SLOT_HEADER = struct.Struct('<QdI')
+SEQ_OFFSET = struct.calcsize('<8sII')
+
+DEFAULT_RING_PATH = '/dev/shm/maya-frames' if os.path.isdir('/dev/shm') else '/tmp/maya-frames'
+
+logger = logging.getLogger('FrameRing')
+
+_reader_ids = itertools.count()
+
+
+def readers_dir(path):
+    """Where waiting readers bind their wakeup sockets"""
+    return path + '.readers'
+
+
+class FrameRing:
+    """Fixed-size ring of encoded frames in a memory-mapped file.
+
+    One writer process, any number of readers. A slot is invalidated before
+    its payload is rewritten and stamped with the frame's sequence number
+    afterwards; readers check the stamp before and after copying, so a torn
+    or half-written frame is never returned.
+
+    Readers that wait bind a Unix datagram socket in readers_dir(path); the
+    writer sends each one a byte after every frame, so waiting readers sleep
+    in select() and only wake for new frames.
+    """
+
+    def __init__(self, path=DEFAULT_RING_PATH, slot_count=8, slot_size=1024 * 1024, create=False):
+        self.path = path
+        self.writable = create
+        if create:
+            self.slot_count = slot_count
+            self.slot_size = slot_size
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, HEADER.size + slot_count * slot_size)
+                self._mm = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            HEADER.pack_into(self._mm, 0, MAGIC, slot_count, slot_size, 0)
+            os.makedirs(readers_dir(path), exist_ok=True)
+            self._notifier = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._notifier.setblocking(False)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self._mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+            finally:
+                os.close(fd)
+            magic, self.slot_count, self.slot_size, _ = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a frame ring")
+        self.max_frame_size = self.slot_size - SLOT_HEADER.size
+        self._wakeup = None
+        self._wakeup_path = None
+
+    def _slot_offset(self, seq):
+        return HEADER.size + ((seq - 1) % self.slot_count) * self.slot_size
+
+    @property
+    def latest_seq(self):
+        return struct.unpack_from('<Q', self._mm, SEQ_OFFSET)[0]
+
+    def write(self, data, timestamp=None):
+        """Append a frame and return its sequence number"""
+        if len(data) > self.max_frame_size:
+            raise ValueError(f"Frame of {len(data)} bytes exceeds slot size {self.max_frame_size}")
+        seq = self.latest_seq + 1
+        offset = self._slot_offset(seq)
+        # Invalidate, fill, then stamp the slot before publishing the sequence
+        SLOT_HEADER.pack_into(self._mm, offset, 0, 0.0, 0)
+        start = offset + SLOT_HEADER.size
+        self._mm[start:start + len(data)] = data
+        SLOT_HEADER.pack_into(self._mm, offset, seq, timestamp or time.time(), len(data))
+        struct.pack_into('<Q', self._mm, SEQ_OFFSET, seq)
+        self._notify()
+        return seq
+
+    def _notify(self):
+        # Rescanned on every frame: a directory mtime check can miss a reader
+        # that binds within the same timestamp tick, and a listdir of a few
+        # entries costs microseconds
+        directory = readers_dir(self.path)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        for path in (os.path.join(directory, name) for name in names):
+            try:
+                self._notifier.sendto(b'\0', path)
+            except BlockingIOError:
+                pass  # the reader has wakeups pending already
+            except OSError as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # Reader exited without removing its socket
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    logger.warning(f"Could not wake ring reader {path}: {e}")
+
+    def read(self, seq):
+        """Return (seq, timestamp, data) for a frame still in the ring, or None
+        if it has been overwritten (or is being overwritten) meanwhile."""
+        offset = self._slot_offset(seq)
+        slot_seq, timestamp, length = SLOT_HEADER.unpack_from(self._mm, offset)
+        if slot_seq != seq or length > self.max_frame_size:
+            return None
+        start = offset + SLOT_HEADER.size
+        data = self._mm[start:start + length]
+        if SLOT_HEADER.unpack_from(self._mm, offset)[0] != seq:
+            return None
+        return seq, timestamp, data
+
+    def read_latest(self):
+        seq = self.latest_seq
+        return self.read(seq) if seq else None
+
+    def _wakeup_socket(self):
+        if self._wakeup is None:
+            os.makedirs(readers_dir(self.path), exist_ok=True)
+            path = os.path.join(readers_dir(self.path), f"{os.getpid()}-{next(_reader_ids)}")
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind(path)
+            self._wakeup, self._wakeup_path = sock, path
+        return self._wakeup
+
+    def wait_for_frame(self, after_seq=0, timeout=None, max_sleep=1.0):
+        """Block until a frame newer than after_seq is available and return
+        the newest one. For readers in other processes, which can only see
+        the shared sequence counter; in-process readers should subscribe to
+        the writer's FrameHub instead. Returns None on timeout.
+
+        The wakeup socket is bound before the sequence check, so a frame
+        written in between leaves a datagram and select() returns at once.
+        `max_sleep` bounds each sleep in case the writer has gone away."""
+        wakeup = self._wakeup_socket()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self.latest_seq
+            if seq > after_seq:
+                frame = self.read(seq)
+                if frame is not None:
+                    return frame
+            sleep = max_sleep
+            if deadline is not None:
+                sleep = min(sleep, deadline - time.monotonic())
+                if sleep <= 0:
+                    return None
+            select.select([wakeup], [], [], sleep)
+            try:
+                while wakeup.recv(64):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        self._mm.close()
+        if self._wakeup is not None:
+            self._wakeup.close()
+            try:
+                os.unlink(self._wakeup_path)
+            except FileNotFoundError:
+                pass
+        if self.writable:
+            self._notifier.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self._remove_readers_dir()
+
+    def _remove_readers_dir(self):
+        """Remove the wakeup sockets, including those of readers that exited
+        without cleaning up, and the directory. Readers still waiting are
+        no longer woken, which is moot once the ring file is gone."""
+        directory = readers_dir(self.path)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            try:
+                os.unlink(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(directory)
+        except OSError as e:
+            # A reader bound a new socket meanwhile
+            logger.debug(f"Could not remove {directory}: {e}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Follow a frame ring from another process: report "
+                                                 "frame rate, age and skips, optionally keeping the "
+                                                 "newest frame in a file")
+    parser.add_argument("--ring-path", default=DEFAULT_RING_PATH)
+    parser.add_argument("--output", help="Atomically replace this file with each new frame")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between reports")
+    args = parser.parse_args()
+
+    ring = FrameRing(args.ring_path)
+    last_seq = ring.latest_seq
+    frames = skipped = 0
+    ages = []
+    report_at = time.monotonic() + args.interval
+    try:
+        while True:
+            frame = ring.wait_for_frame(last_seq, timeout=args.interval)
+            now = time.monotonic()
+            if frame is not None:
+                seq, timestamp, data = frame
+                if last_seq:
+                    skipped += seq - last_seq - 1
+                last_seq = seq
+                frames += 1
+                ages.append((time.time() - timestamp) * 1000)
+                if args.output:
+                    with open(args.output + '.tmp', 'wb') as f:
+                        f.write(data)
+                    os.replace(args.output + '.tmp', args.output)
+            if now >= report_at:
+                ages.sort()
+                logger.info(f"{frames / args.interval:.1f} fps, {skipped} skipped, age p50 "
+                            f"{ages[len(ages) // 2] if ages else 0:.1f} ms, newest seq {last_seq}")
+                frames = skipped = 0
+                ages = []
+                report_at = now + args.interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Low-bandwidth H.264 streaming as chunked fragmented MP4 over HTTP.
+
+One x264enc (tune=zerolatency) branch hangs off the capture tee and
+publishes access units into a FrameHub. Every client gets the init segment
+and then one fragment per frame, starting at a keyframe, with its own
+timeline starting at zero. The sample bytes are shared; only the ~100 byte
+fragment header is built per client.
+
+    ffplay http://127.0.0.1:8080/video.mp4
+"""
+
+import logging
+import re
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+from fmp4 import TIMESCALE, fragment_header, init_segment
+from frame_hub import FrameHub
+
+logger = logging.getLogger('H264Stream')
+
+H264_BRANCH = (
+    "t. ! queue leaky=downstream max-size-buffers=2 ! valve name=h264valve drop=true ! "
+    "videoconvert ! video/x-raw,format=I420 ! "
+    "x264enc name=h264enc tune=zerolatency speed-preset={preset} bitrate={bitrate} key-int-max={gop} ! "
+    "video/x-h264,profile=constrained-baseline ! h264parse ! "
+    "video/x-h264,stream-format=avc,alignment=au ! "
+    "appsink name=h264sink emit-signals=true sync=false async=false max-buffers=30 drop=false"
+)
+# async=false: behind the closed valve the sink never gets a buffer to
+# preroll on, which would hold the whole pipeline in PAUSED
+CAPTURE_TEE = re.compile(r'\btee name=t\b')
+# Where the JPEG encode starts in options that have no tee of their own
+JPEG_BRANCH_START = re.compile(r'jpegenc quality=\d+|tee name=rtee')
+
+
+def _ticks(ns):
+    return ns * TIMESCALE // Gst.SECOND
+
+
+class H264Sample:
+    """Frame.info of the H.264 hub"""
+    __slots__ = ('dts', 'duration', 'keyframe', 'init')
+
+    def __init__(self, dts, duration, keyframe, init):
+        self.dts = dts
+        self.duration = duration
+        self.keyframe = keyframe
+        self.init = init
+
+
+class H264Stream:
+    def __init__(self, bitrate=1000, gop=30, preset='ultrafast', queue_size=90):
+        self.bitrate = bitrate
+        self.gop = gop
+        self.preset = preset
+        # Every access unit matters: a client that overflows this resyncs at
+        # the next keyframe instead of decoding a broken GOP
+        self.hub = FrameHub(queue_size=queue_size, multipart=False)
+        self.init_segment = None
+        self.keyframe_requests = 0
+        self._caps = None
+        self._frame_duration = Gst.SECOND // 30
+        self._last_keyframe_request = 0.0
+        self.valve = None
+        self.encoder = None
+        self._valve_lock = threading.Lock()
+
+    def rewrite_pipeline(self, pipeline_string):
+        """Add the encoder branch to a pipeline option, inserting a capture
+        tee ahead of the JPEG branch if the option has none"""
+        branch = H264_BRANCH.format(preset=self.preset, bitrate=self.bitrate, gop=self.gop)
+        if CAPTURE_TEE.search(pipeline_string):
+            return f"{pipeline_string} {branch}"
+        match = JPEG_BRANCH_START.search(pipeline_string)
+        if not match:
+            return None
+        start = match.start()
+        return f"{pipeline_string[:start]}tee name=t ! queue ! {pipeline_string[start:]} {branch}"
+
+    def attach(self, pipeline):
+        self.valve = pipeline.get_by_name('h264valve')
+        self.encoder = pipeline.get_by_name('h264enc')
+        pipeline.get_by_name('h264sink').connect('new-sample', self._on_sample)
+        self.hub.add_listener(self._on_subscribers)
+
+    def _on_subscribers(self, count=None):
+        # Same idea as the JPEG demand gate: no viewers, no encoding. The
+        # live count is read under the lock, since `count` can be stale by
+        # the time a concurrent listener call gets here.
+        with self._valve_lock:
+            count = self.hub.subscriber_count
+            self.valve.set_property('drop', count == 0)
+        if count:
+            # New viewers start at a keyframe; don't make them wait a whole GOP
+            self.request_keyframe()
+
+    def request_keyframe(self):
+        now = time.monotonic()
+        if self.encoder is None or now - self._last_keyframe_request < 0.5:
+            return
+        self._last_keyframe_request = now
+        self.keyframe_requests += 1
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        self.encoder.get_static_pad('src').send_event(event)
+
+    def _update_caps(self, caps):
+        structure = caps.get_structure(0)
+        codec_data = structure.get_value('codec_data')
+        ok, num, den = structure.get_fraction('framerate')
+        if ok and num:
+            self._frame_duration = Gst.SECOND * den // num
+        self.init_segment = init_segment(structure.get_value('width'), structure.get_value('height'),
+                                         codec_data.extract_dup(0, codec_data.get_size()))
+        self._caps = caps
+        logger.info(f"H.264 stream caps: {caps.to_string()}")
+
+    def _on_sample(self, sink):
+        sample = sink.emit('pull-sample')
+        if sample is None:
+            return Gst.FlowReturn.OK
+        caps = sample.get_caps()
+        if self._caps is None or not caps.is_equal(self._caps):
+            self._update_caps(caps)
+
+        buf = sample.get_buffer()
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            logger.warning("Failed to map H.264 buffer")
+            return Gst.FlowReturn.OK
+        try:
+            data = bytes(map_info.data)
+        finally:
+            buf.unmap(map_info)
+
+        dts = buf.dts if buf.dts != Gst.CLOCK_TIME_NONE else buf.pts
+        duration = buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else self._frame_duration
+        keyframe = not buf.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        self.hub.publish(data, info=H264Sample(dts, duration, keyframe, self.init_segment))
+        return Gst.FlowReturn.OK
+
+    def get_stats(self):
+        return dict(self.hub.get_stats(),
+                    encoding=self.valve is not None and not self.valve.get_property('drop'),
+                    keyframe_requests=self.keyframe_requests)
+
+
+class Fmp4Session:
+    """One client's view of the stream: waits for a keyframe, then turns
+    every access unit into (fragment header, shared sample bytes)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sequence = 0
+        self.resyncs = 0
+        self._base_dts = None
+        self._last_seq = None
+        self._waiting = True
+
+    def packetize(self, frame):
+        info = frame.info
+        if self._last_seq is not None and frame.seq != self._last_seq + 1:
+            # Frames were dropped for this client: the GOP is broken
+            self.resyncs += 1
+            self._waiting = True
+            self.stream.request_keyframe()
+        self._last_seq = frame.seq
+
+        chunks = []
+        if self._waiting:
+            if not info.keyframe or info.init is None:
+                return chunks
+            self._waiting = False
+            if self._base_dts is None:
+                self._base_dts = info.dts
+                chunks.append(info.init)
+
+        self.sequence += 1
+        chunks.append(fragment_header(self.sequence, _ticks(info.dts - self._base_dts),
+                                      _ticks(info.duration), len(frame.data), info.keyframe))
+        chunks.append(frame.data)
+        return chunks
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Open many concurrent /video_feed viewers and report per-client fps and
+server CPU. By default it spawns video-server.py against videotestsrc:
+
+    python load_test.py --clients 200 --duration 30 --server async
+    python load_test.py --clients 50 --no-spawn --url http://edge-box:8080/video_feed
+
+A single viewer is measured first, so the report separates what capture and
+encoding cost (the baseline) from what fanning out to N clients adds. The
+test source is live at 15 fps, so that is the most any viewer should see.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from mjpeg_framer import MultipartJpegFramer
+
+
+def read_cpu_seconds(pid):
+    """utime + stime of a process, from /proc (Linux only)"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def read_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def viewer(url, duration, results, index):
+    parts = urlsplit(url)
+    frames = 0
+    first_frame_time = None
+    error = None
+    framer = MultipartJpegFramer(b'frame')
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        writer.write(f"GET {parts.path or '/'} HTTP/1.0\r\nHost: {parts.netloc}\r\n\r\n".encode('ascii'))
+        await writer.drain()
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            data = await asyncio.wait_for(reader.read(256 * 1024), deadline - time.monotonic())
+            if not data:
+                error = "connection closed"
+                break
+            framer.feed(data)
+            for part in framer.frames():
+                if part.startswith(b'\xff\xd8'):
+                    frames += 1
+                    if first_frame_time is None:
+                        first_frame_time = time.monotonic()
+    except asyncio.TimeoutError:
+        pass
+    except OSError as e:
+        error = str(e)
+    finally:
+        if writer:
+            writer.close()
+
+    elapsed = time.monotonic() - first_frame_time if first_frame_time else 0
+    results[index] = {
+        "frames": frames,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "error": error,
+    }
+
+
+async def run_clients(url, clients, duration, ramp):
+    results = [None] * clients
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.create_task(viewer(url, duration, results, i)))
+        if ramp:
+            await asyncio.sleep(ramp / clients)
+    await asyncio.gather(*tasks)
+    return results
+
+
+def measure(pid, url, clients, duration, ramp):
+    """Per-client results and the server's CPU% over the run"""
+    cpu_start = read_cpu_seconds(pid) if pid else None
+    wall_start = time.monotonic()
+    results = asyncio.run(run_clients(url, clients, duration, ramp))
+    wall = time.monotonic() - wall_start
+    cpu = (read_cpu_seconds(pid) - cpu_start) / wall * 100 if pid else None
+    return results, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/video_feed load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/video_feed", help="Stream URL")
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent viewers")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds each viewer stays connected")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Seconds over which viewers connect")
+    parser.add_argument("--server", choices=["flask", "async"], default="async",
+                        help="Server mode for the spawned video-server.py")
+    parser.add_argument("--no-spawn", action="store_true", help="Test an already running server")
+    parser.add_argument("--server-pid", type=int, help="PID to sample CPU from when using --no-spawn")
+    parser.add_argument("--startup-delay", type=float, default=3.0, help="Seconds to wait for the server")
+    parser.add_argument("--baseline-duration", type=float, default=5.0,
+                        help="Seconds to measure a single viewer first, 0 to skip")
+    args = parser.parse_args()
+
+    server = None
+    pid = args.server_pid
+    if not args.no_spawn:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'video-server.py')
+        server = subprocess.Popen([sys.executable, script, '--test-source', '--server', args.server],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        pid = server.pid
+        time.sleep(args.startup_delay)
+
+    try:
+        baseline = None
+        if args.baseline_duration:
+            results, cpu = measure(pid, args.url, 1, args.baseline_duration, 0)
+            baseline = {"fps": results[0]["fps"], "server_cpu_percent": cpu}
+        results, cpu = measure(pid, args.url, args.clients, args.duration, args.ramp)
+        rss = read_rss_mb(pid) if pid else None
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    fps = [r["fps"] for r in results]
+    report = {
+        "clients": args.clients,
+        "server": args.server if server else "external",
+        "connected": sum(1 for r in results if r["frames"] > 0),
+        "errors": sum(1 for r in results if r["error"]),
+        "fps_min": min(fps),
+        "fps_mean": statistics.mean(fps),
+        "fps_median": statistics.median(fps),
+        "fps_max": max(fps),
+        "server_cpu_percent": cpu,
+        "server_rss_mb": rss,
+        "baseline": baseline,
+        # What the extra clients cost on top of capturing and encoding for one
+        "fanout_cpu_percent": cpu - baseline["server_cpu_percent"]
+        if cpu is not None and baseline and baseline["server_cpu_percent"] is not None else None,
+        "per_client_fps": [round(f, 2) for f in fps],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
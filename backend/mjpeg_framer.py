@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import logging
+
+logger = logging.getLogger('MjpegFramer')
+
+DEFAULT_RECV_SIZE = 256 * 1024
+DEFAULT_MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class FramingError(Exception):
+    pass
+
+
+class MultipartJpegFramer:
+    """Streaming parser for multipartmux output (multipart/x-mixed-replace).
+
+    Data is received straight into a reusable bytearray with recv_into/readinto
+    and boundary searches resume where the previous scan stopped, so each byte
+    is copied and scanned a constant number of times no matter how the stream
+    is chunked. Parts that carry a Content-Length header are sliced out without
+    scanning the body at all.
+    """
+
+    def __init__(self, boundary=b'spionisto', recv_size=DEFAULT_RECV_SIZE,
+                 max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        if isinstance(boundary, str):
+            boundary = boundary.encode('ascii')
+        self.delimiter = b'--' + boundary
+        self.recv_size = recv_size
+        self.max_frame_size = max_frame_size
+
+        self._buf = bytearray(max(recv_size * 2, 64 * 1024))
+        self._start = 0    # first unconsumed byte
+        self._end = 0      # one past the last valid byte
+        self._scan = 0     # where the next delimiter search resumes
+        # Current part: offset of its body and expected length (None = unknown)
+        self._body_start = None
+        self._body_length = None
+
+        self.frames_parsed = 0
+        self.bytes_received = 0
+
+    def reset(self):
+        """Discard any buffered data, e.g. after a reconnect"""
+        self._start = self._end = self._scan = 0
+        self._body_start = None
+        self._body_length = None
+
+    def _reserve(self, size):
+        """Make sure at least `size` bytes are free after _end"""
+        if len(self._buf) - self._end >= size:
+            return
+        # Compact: move the unconsumed tail to the front of the buffer
+        pending = self._end - self._start
+        if self._start:
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._scan -= self._start
+            if self._body_start is not None:
+                self._body_start -= self._start
+            self._start = 0
+            self._end = pending
+        if len(self._buf) - self._end < size:
+            if pending + size > self.max_frame_size + self.recv_size:
+                raise FramingError(f"Frame exceeds {self.max_frame_size} bytes without a boundary")
+            self._buf.extend(bytes(max(size, len(self._buf))))
+
+    def read_from(self, source):
+        """Receive up to recv_size bytes from a socket (recv_into) or a binary
+        file object (readinto). Returns the number of bytes read, 0 on EOF."""
+        self._reserve(self.recv_size)
+        with memoryview(self._buf) as view:
+            target = view[self._end:self._end + self.recv_size]
+            if hasattr(source, 'recv_into'):
+                n = source.recv_into(target)
+            else:
+                n = source.readinto(target) or 0
+            target.release()
+        self._end += n
+        self.bytes_received += n
+        return n
+
+    def feed(self, data):
+        """Append already-received bytes to the parse buffer"""
+        self._reserve(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        self.bytes_received += len(data)
+
+    def frames(self):
+        """Yield every complete part (as bytes) currently in the buffer"""
+        buf = self._buf
+        delimiter = self.delimiter
+        while True:
+            if self._body_start is None:
+                # Looking for the next part header
+                pos = buf.find(delimiter, self._scan, self._end)
+                if pos == -1:
+                    # Nothing before the last partial delimiter can matter any more
+                    self._start = self._scan = max(self._start, self._end - len(delimiter) + 1)
+                    return
+                header_end = buf.find(b'\r\n\r\n', pos, self._end)
+                if header_end == -1:
+                    self._start = self._scan = pos
+                    return
+                self._body_length = self._parse_content_length(buf[pos:header_end])
+                self._body_start = header_end + 4
+                self._start = self._body_start
+                self._scan = self._body_start
+
+            if self._body_length is not None:
+                body_end = self._body_start + self._body_length
+                if body_end > self._end:
+                    return
+                next_pos = body_end
+            else:
+                # No Content-Length: the body runs until the next delimiter
+                next_pos = buf.find(delimiter, self._scan, self._end)
+                if next_pos == -1:
+                    self._scan = max(self._body_start, self._end - len(delimiter) + 1)
+                    if self._end - self._body_start > self.max_frame_size:
+                        raise FramingError(f"Frame exceeds {self.max_frame_size} bytes without a boundary")
+                    return
+                body_end = next_pos
+                # Strip the CRLF that precedes the next delimiter
+                if buf[body_end - 2:body_end] == b'\r\n':
+                    body_end -= 2
+
+            with memoryview(buf) as view:
+                frame = bytes(view[self._body_start:body_end])
+            self._start = self._scan = next_pos
+            self._body_start = None
+            self._body_length = None
+            if frame:
+                self.frames_parsed += 1
+                yield frame
+
+    @staticmethod
+    def _parse_content_length(header):
+        lower = bytes(header).lower()
+        idx = lower.find(b'content-length:')
+        if idx == -1:
+            return None
+        line_end = lower.find(b'\r\n', idx)
+        value = lower[idx + len(b'content-length:'):line_end if line_end != -1 else None]
+        try:
+            return int(value.strip())
+        except ValueError:
+            logger.warning(f"Ignoring malformed Content-Length header: {value!r}")
+            return None
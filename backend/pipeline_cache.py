@@ -0,0 +1,100 @@
+"""On-disk cache of which pipeline option worked on this host, so restarts
+skip the trial-and-error probe.
+
+The key covers everything that can change the answer: the GStreamer version
+and plugin registry, the capture devices and X display, and the candidate
+pipelines themselves. Any difference means a fresh probe.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from gi.repository import Gst
+
+logger = logging.getLogger('PipelineCache')
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'maya-video-server', 'pipeline-probe.json'
+)
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # ctime, not mtime: it also moves whenever mtime does
+    return [path, st.st_size, st.st_ctime_ns, st.st_rdev]
+
+
+def _registry_state():
+    paths = [os.environ.get(var) for var in ('GST_REGISTRY_1_0', 'GST_REGISTRY')]
+    paths = [p for p in paths if p] or sorted(glob.glob(
+        os.path.join(os.path.expanduser('~/.cache'), 'gstreamer-1.0', 'registry.*.bin')))
+    return {
+        "version": Gst.version_string(),
+        "plugin_path": os.environ.get('GST_PLUGIN_PATH', ''),
+        "files": [_file_state(p) for p in paths],
+    }
+
+
+def _device_state():
+    display = os.environ.get('DISPLAY', '')
+    x_socket = None
+    if display.startswith(':'):
+        x_socket = _file_state(f"/tmp/.X11-unix/X{display[1:].split('.')[0]}")
+    return {
+        # ctime changes when a camera is unplugged and plugged back in
+        "video": [_file_state(p) for p in sorted(glob.glob('/dev/video*'))],
+        "display": display,
+        "x_socket": x_socket,
+    }
+
+
+def probe_key(candidates, extra=None):
+    """Hash of the registry, device state and candidate pipeline strings"""
+    state = {
+        "registry": _registry_state(),
+        "devices": _device_state(),
+        "candidates": list(candidates),
+        "extra": extra,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+class PipelineProbeCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+
+    def load(self, key):
+        """The cached pipeline string for this key, or None"""
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            logger.info("Pipeline probe cache is stale (registry, devices or candidates changed)")
+            return None
+        return entry.get('pipeline')
+
+    def store(self, key, pipeline_string):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Write-then-rename so a crash never leaves a half-written cache
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"key": key, "pipeline": pipeline_string}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write pipeline probe cache {self.path}: {e}")
+
+    def invalidate(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Multi-rendition MJPEG: several JPEG encodes of one capture, each with its
+own FrameHub, and a per-client selector that moves a viewer between them
+based on how fast its connection actually drains.
+
+Every rendition branch sits behind a valve that is only open while the
+rendition has subscribers, so unwatched renditions cost no scaling or
+encoding.
+"""
+
+import re
+import threading
+import time
+import logging
+
+from frame_hub import FrameHub
+
+logger = logging.getLogger('Renditions')
+
+# (name, scale of the capture size, JPEG quality), largest first
+DEFAULT_RENDITIONS = (
+    ('full', 1.0, 80),
+    ('half', 0.5, 70),
+    ('thumb', 0.25, 60),
+)
+
+# async=false: a sink behind a closed valve never prerolls, and an async one
+# would hold the whole pipeline in PAUSED
+RENDITION_SINK = ("appsink name=jpegsink_{name} emit-signals=true sync=false async=false "
+                  "max-buffers=2 drop=true")
+# The single-rendition JPEG tail of a pipeline option, replaced in rendition mode
+JPEG_TAIL = re.compile(r'jpegenc quality=\d+ ! (?:jpegparse ! )?(appsink name=jpegsink[^!]*)$')
+CAPTURE_SIZE = re.compile(r'width=(\d+), ?height=(\d+)')
+
+
+class Rendition:
+    def __init__(self, name, scale, quality, hub=None):
+        self.name = name
+        self.scale = scale
+        self.quality = quality
+        self.hub = hub or FrameHub(queue_size=2)
+        self.width = None
+        self.height = None
+        self.valve = None
+        self._lock = threading.Lock()
+
+    def configure(self, capture_width, capture_height):
+        # Even sizes keep the chroma planes whole
+        self.width = max(2, int(capture_width * self.scale) // 2 * 2)
+        self.height = max(2, int(capture_height * self.scale) // 2 * 2)
+
+    def branch(self):
+        """Launch-syntax branch hanging off the rendition tee"""
+        scale = "" if self.scale == 1.0 else (
+            f"videoscale ! video/x-raw,width={self.width},height={self.height} ! ")
+        return (f"rtee. ! queue leaky=downstream max-size-buffers=1 ! "
+                f"valve name=valve_{self.name} drop=true ! {scale}"
+                f"jpegenc name=jpegenc_{self.name} quality={self.quality} ! "
+                f"{RENDITION_SINK.format(name=self.name)}")
+
+    def set_active(self, count=None):
+        # `count` may already be stale when a concurrent listener call runs;
+        # re-read it under the lock so the last call applies the live count
+        with self._lock:
+            count = self.hub.subscriber_count
+            if self.valve is None:
+                return
+            self.valve.set_property('drop', count == 0)
+        logger.info(f"Rendition {self.name} {'encoding' if count else 'idle'} ({count} subscribers)")
+
+    @property
+    def frame_size(self):
+        """Size of the last encoded frame, as an estimate of the next one"""
+        latest = self.hub.latest
+        return len(latest.data) if latest is not None else None
+
+
+class RenditionSet:
+    """The renditions of one capture, largest first. The first one publishes
+    into `primary_hub` so single-hub consumers keep working unchanged."""
+
+    def __init__(self, specs=DEFAULT_RENDITIONS, primary_hub=None):
+        self.renditions = [Rendition(name, scale, quality, hub=primary_hub if i == 0 else None)
+                           for i, (name, scale, quality) in enumerate(specs)]
+        self.by_name = {r.name: r for r in self.renditions}
+
+    def configure(self, pipeline_string):
+        """Rendition sizes from the first (capture) caps in a pipeline string"""
+        match = CAPTURE_SIZE.search(pipeline_string)
+        width, height = (int(match.group(1)), int(match.group(2))) if match else (640, 480)
+        for rendition in self.renditions:
+            rendition.configure(width, height)
+
+    def rewrite_pipeline(self, pipeline_string):
+        """Replace the single JPEG encode of a pipeline option with a tee
+        feeding one valve-gated encode per rendition"""
+        if not JPEG_TAIL.search(pipeline_string):
+            return None
+        self.configure(pipeline_string)
+        branches = ' '.join(r.branch() for r in self.renditions)
+        return JPEG_TAIL.sub(lambda m: f"tee name=rtee {branches}", pipeline_string)
+
+    def attach(self, pipeline, on_new_jpeg):
+        """Connect each rendition's appsink and valve in a parsed pipeline"""
+        for rendition in self.renditions:
+            rendition.valve = pipeline.get_by_name(f'valve_{rendition.name}')
+            pipeline.get_by_name(f'jpegsink_{rendition.name}').connect(
+                "new-sample", on_new_jpeg, rendition.hub)
+            rendition.hub.add_listener(rendition.set_active)
+            rendition.set_active(rendition.hub.subscriber_count)
+
+    def allowed(self, width=None, quality=None):
+        """Renditions a client asked for: at most `width` pixels wide and at
+        most `quality`. Falls back to the smallest one."""
+        allowed = [r for r in self.renditions
+                   if (width is None or r.width <= width) and (quality is None or r.quality <= quality)]
+        return allowed or self.renditions[-1:]
+
+    def close(self):
+        for rendition in self.renditions:
+            rendition.hub.close()
+
+    def get_stats(self):
+        return {
+            r.name: dict(r.hub.get_stats(), width=r.width, height=r.height, quality=r.quality,
+                         encoding=r.valve is not None and not r.valve.get_property('drop'))
+            for r in self.renditions
+        }
+
+
+class AdaptiveClient:
+    """One viewer's subscription that follows its connection's throughput.
+
+    After each frame the server reports how long the write took. Every
+    `window` seconds the client compares the time spent blocked in writes
+    with the window length: mostly blocked (or dropping frames) steps down a
+    rendition, mostly idle with room for the bigger frames steps up.
+    """
+
+    def __init__(self, rendition_set, allowed, pinned=None, fps=None, loop=None, window=2.0):
+        self.rendition_set = rendition_set
+        self.allowed = allowed
+        self.adaptive = pinned is None
+        self.index = allowed.index(pinned) if pinned is not None else 0
+        self.min_interval = 1.0 / fps if fps else 0.0
+        self.loop = loop
+        self.window = window
+        self.switches = 0
+        self.bytes_sent = 0
+        self._calm_windows = 0
+        self._last_sent = 0.0
+        self._subscription = None
+        self._subscribe()
+        self._reset_window()
+
+    @property
+    def rendition(self):
+        return self.allowed[self.index]
+
+    def _subscribe(self):
+        hub = self.rendition.hub
+        self._subscription = hub.subscribe_async(self.loop) if self.loop else hub.subscribe()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._send_seconds = 0.0
+        self._frames = 0
+        self._dropped_at_start = self._subscription.dropped
+
+    def _switch(self, index):
+        old = self.rendition
+        self._subscription.close()
+        self.index = index
+        self._subscribe()
+        self.switches += 1
+        logger.info(f"Client moved from {old.name} to {self.rendition.name}")
+
+    def _skip(self, frame):
+        # Per-client fps cap: drop frames that come too soon after the last one
+        if frame is None or not self.min_interval:
+            return False
+        if frame.timestamp - self._last_sent < self.min_interval:
+            return True
+        self._last_sent = frame.timestamp
+        return False
+
+    def get(self, timeout=None):
+        while True:
+            frame = self._subscription.get(timeout)
+            if not self._skip(frame):
+                return frame
+
+    async def get_async(self, timeout=None):
+        while True:
+            frame = await self._subscription.get_async(timeout)
+            if not self._skip(frame):
+                return frame
+
+    @property
+    def closed(self):
+        return self._subscription.closed
+
+    def record_send(self, nbytes, seconds):
+        self.bytes_sent += nbytes
+        self._send_seconds += seconds
+        self._frames += 1
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.window:
+            return
+        if self.adaptive:
+            self._adapt(elapsed)
+        self._reset_window()
+
+    def _adapt(self, elapsed):
+        busy = self._send_seconds / elapsed
+        dropped = self._subscription.dropped - self._dropped_at_start
+        if (busy > 0.8 or dropped > 0.1 * max(self._frames, 1)) and self.index < len(self.allowed) - 1:
+            self._calm_windows = 0
+            self._switch(self.index + 1)
+            return
+        self._calm_windows = self._calm_windows + 1 if busy < 0.25 and not dropped else 0
+        if self._calm_windows >= 2 and self.index > 0:
+            current, bigger = self.rendition.frame_size, self.allowed[self.index - 1].frame_size
+            # No recent frame from an idle rendition: assume area scaling
+            ratio = bigger / current if bigger and current else (
+                (self.allowed[self.index - 1].scale / self.rendition.scale) ** 2)
+            if busy * ratio < 0.6:
+                self._calm_windows = 0
+                self._switch(self.index - 1)
+
+    def close(self):
+        self._subscription.close()
+
+
+def client_options(rendition_set, args):
+    """AdaptiveClient settings from /video_feed query parameters:
+    rendition=<name> pins one, width=<px> and quality=<1-100> cap the
+    choice, fps=<n> caps the frame rate."""
+    def number(key, cast):
+        try:
+            return cast(args[key]) if args.get(key) else None
+        except ValueError:
+            return None
+
+    allowed = rendition_set.allowed(width=number('width', int), quality=number('quality', int))
+    pinned = rendition_set.by_name.get(args.get('rendition'))
+    if pinned is not None and pinned not in allowed:
+        allowed = [pinned]
+    return {"allowed": allowed, "pinned": pinned, "fps": number('fps', float)}
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""/snapshot.jpg: the latest encoded frame for pollers, without a stream.
+
+The full-size image is the hub's latest JPEG as encoded, never re-encoded.
+`?thumb=1` returns a downscaled copy made at most once per frame. ETags
+name the frame (`"<boot>-<seq>-<capture ms>"`), so If-None-Match works as
+usual, and `?max_age_ms=N` also answers 304 while the client's copy is
+less than N ms older than the newest frame.
+
+Polling keeps a lease subscription on the hub for `linger` seconds after
+the last request, so the demand gate keeps the encoder running for
+pollers but not forever.
+"""
+
+import logging
+import re
+import threading
+import time
+
+from gi.repository import Gst
+
+logger = logging.getLogger('Snapshot')
+
+THUMB_PIPELINE = (
+    # Hub frames are whole JPEGs, so no jpegparse (which would hold one back)
+    "appsrc name=src caps=image/jpeg,parsed=true,framerate=0/1 format=time ! jpegdec ! "
+    "videoconvert ! videoscale ! video/x-raw,width={width},pixel-aspect-ratio=1/1 ! "
+    "jpegenc quality={quality} ! appsink name=sink sync=false"
+)
+ETAG = re.compile(r'"([0-9a-f]+)-(\d+)-(\d+)(-thumb)?"')
+# Distinguishes sequence numbers of different server runs
+BOOT_ID = f"{int(time.time()):x}"
+
+
+class JpegScaler:
+    """JPEG -> smaller JPEG through a persistent decode/scale/encode pipeline"""
+
+    def __init__(self, width=320, quality=70, timeout=2.0):
+        self.width = width
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.pipeline = Gst.parse_launch(THUMB_PIPELINE.format(width=width, quality=quality))
+        self.src = self.pipeline.get_by_name('src')
+        self.sink = self.pipeline.get_by_name('sink')
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError("Thumbnail pipeline failed to start")
+
+    def scale(self, jpeg):
+        with self._lock:
+            self.src.emit('push-buffer', Gst.Buffer.new_wrapped(jpeg))
+            sample = self.sink.emit('try-pull-sample', int(self.timeout * Gst.SECOND))
+            if sample is None:
+                # The frame is still somewhere in the pipeline and would come
+                # out as the next call's thumbnail: drop it
+                self._reset()
+                raise RuntimeError("Thumbnail pipeline produced no output")
+            buf = sample.get_buffer()
+            return buf.extract_dup(0, buf.get_size())
+
+    def _reset(self):
+        """Flush every queued buffer by cycling the pipeline through READY"""
+        self.pipeline.set_state(Gst.State.READY)
+        self.pipeline.get_state(Gst.CLOCK_TIME_NONE)
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            logger.error("Thumbnail pipeline failed to restart")
+
+    def close(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+
+class Snapshot:
+    def __init__(self, hub, thumb_width=320, linger=5.0, wait=1.0):
+        self.hub = hub
+        self.thumb_width = thumb_width
+        self.linger = linger
+        self.wait = wait
+        self.requests = 0
+        self.not_modified = 0
+        self.thumbnails_made = 0
+        self._lock = threading.Lock()
+        self._thumb_lock = threading.Lock()
+        self._lease = None
+        self._last_request = 0.0
+        self._scaler = None
+        self._thumb = (None, None)  # (frame seq, JPEG bytes)
+
+    def _touch(self):
+        """Hold a lease subscription and return it if it was just taken,
+        i.e. the hub's latest frame may be stale"""
+        with self._lock:
+            self._last_request = time.monotonic()
+            if self._lease is not None:
+                return None
+            self._lease = lease = self.hub.subscribe_latest()
+        self._arm(self.linger)
+        return lease
+
+    def _arm(self, delay):
+        timer = threading.Timer(delay, self._expire)
+        timer.daemon = True
+        timer.start()
+
+    def _expire(self):
+        with self._lock:
+            idle = time.monotonic() - self._last_request
+            if idle < self.linger:
+                self._arm(self.linger - idle)
+                return
+            lease, self._lease = self._lease, None
+        if lease is not None:
+            lease.close()
+
+    def latest(self):
+        new_lease = self._touch()
+        if new_lease is not None and self.wait:
+            # The encoder may just have woken up: wait for a current frame
+            return new_lease.get(timeout=self.wait) or self.hub.latest
+        return self.hub.latest
+
+    def thumbnail(self, frame):
+        with self._thumb_lock:
+            seq, data = self._thumb
+            if seq == frame.seq:
+                return data
+            if self._scaler is None:
+                self._scaler = JpegScaler(self.thumb_width)
+            data = self._scaler.scale(frame.data)
+            self._thumb = (frame.seq, data)
+            self.thumbnails_made += 1
+            return data
+
+    def respond(self, args, if_none_match=None):
+        """(status, headers, body) for a /snapshot.jpg request"""
+        self.requests += 1
+        frame = self.latest()
+        if frame is None:
+            return 503, {'Retry-After': '1', 'Content-Type': 'text/plain'}, b"No frame yet\n"
+        thumb = args.get('thumb') not in (None, '', '0')
+        timestamp_ms = int(frame.timestamp * 1000)
+        etag = f'"{BOOT_ID}-{frame.seq}-{timestamp_ms}{"-thumb" if thumb else ""}"'
+        headers = {
+            'ETag': etag,
+            'X-Frame-Seq': str(frame.seq),
+            'X-Frame-Timestamp': f"{frame.timestamp:.3f}",
+            'Cache-Control': 'no-cache',
+        }
+
+        cached = self._client_copy(if_none_match, thumb)
+        if cached is not None:
+            client_etag, client_seq, client_ms = cached
+            try:
+                max_age_ms = int(args.get('max_age_ms') or 0)
+            except ValueError:
+                max_age_ms = 0
+            if client_seq == frame.seq or timestamp_ms - client_ms < max_age_ms:
+                self.not_modified += 1
+                headers.update({'ETag': client_etag, 'X-Frame-Seq': str(client_seq)})
+                del headers['X-Frame-Timestamp']
+                return 304, headers, b''
+
+        try:
+            body = self.thumbnail(frame) if thumb else frame.data
+        except Exception as e:
+            logger.error(f"Thumbnail failed: {e}")
+            return 500, {'Content-Type': 'text/plain'}, f"Thumbnail failed: {e}\n".encode()
+        headers['Content-Type'] = 'image/jpeg'
+        return 200, headers, body
+
+    @staticmethod
+    def _client_copy(if_none_match, thumb):
+        """(etag, seq, capture ms) of the client's copy from this server run"""
+        for match in ETAG.finditer(if_none_match or ''):
+            if match.group(1) == BOOT_ID and bool(match.group(4)) == thumb:
+                return match.group(0), int(match.group(2)), int(match.group(3))
+        return None
+
+    def close(self):
+        with self._lock:
+            lease, self._lease = self._lease, None
+        if lease is not None:
+            lease.close()
+        if self._scaler is not None:
+            self._scaler.close()
+
+    def get_stats(self):
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "thumbnails_made": self.thumbnails_made,
+            "polling": self._lease is not None,
+        }
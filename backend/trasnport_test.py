@@ -1,12 +1,103 @@
-import os
 import time
-from flask import Flask, Response, send_file
+import logging
+import threading
+from flask import Flask, Response
 from flask_cors import CORS
 import subprocess
 
+from frame_hub import FrameHub
+from frame_ring import DEFAULT_RING_PATH, FrameRing
+from mjpeg_framer import MultipartJpegFramer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('TransportTest')
+
 app = Flask(__name__)
 CORS(app)
 
+
+class SharedCapture:
+    """One gst-launch capture process shared by every client.
+
+    The process writes multipart JPEG to its stdout, so frames arrive whole
+    instead of being re-read from a file that may be mid-write. Each frame is
+    written to a memory-mapped FrameRing (for readers in other processes) and
+    published to a FrameHub, which wakes in-process clients only when a new
+    frame exists.
+    """
+
+    def __init__(self, hub, ring_path=DEFAULT_RING_PATH, device='/dev/video0'):
+        self.hub = hub
+        self.ring_path = ring_path
+        self.device = device
+        self.ring = None
+        self.process = None
+        self.thread = None
+        self.running = False
+        self.oversized = 0
+
+    def command(self):
+        return [
+            'gst-launch-1.0', '-q',
+            'v4l2src', f'device={self.device}', '!',
+            'video/x-raw,framerate=15/1,width=640,height=480', '!',
+            'videoconvert', '!',
+            'jpegenc', 'quality=70', '!',
+            'multipartmux', 'boundary=spionisto', '!',
+            'fdsink', 'fd=1'
+        ]
+
+    def start(self):
+        self.ring = FrameRing(self.ring_path, create=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            self.process = subprocess.Popen(self.command(), stdout=subprocess.PIPE, bufsize=0)
+            logger.info(f"Capture process started (pid {self.process.pid}), ring at {self.ring_path}")
+            framer = MultipartJpegFramer(b'spionisto')
+            try:
+                while self.running and framer.read_from(self.process.stdout):
+                    for frame_data in framer.frames():
+                        timestamp = time.time()
+                        if len(frame_data) <= self.ring.max_frame_size:
+                            self.ring.write(frame_data, timestamp)
+                        else:
+                            # In-process clients still get it; only the ring can't hold it
+                            self.oversized += 1
+                            if self.oversized == 1 or self.oversized % 100 == 0:
+                                logger.warning(f"Frame of {len(frame_data)} bytes exceeds the ring slot "
+                                               f"({self.ring.max_frame_size}), not shared "
+                                               f"({self.oversized} so far)")
+                        self.hub.publish(frame_data, timestamp)
+            except Exception as e:
+                logger.error(f"Error reading capture output: {e}")
+            finally:
+                self.process.terminate()
+                self.process.wait()
+            if self.running:
+                logger.warning("Capture process exited, restarting in 1s")
+                time.sleep(1.0)
+
+    def stop(self):
+        self.running = False
+        if self.process:
+            self.process.terminate()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+        if self.ring:
+            self.ring.close()
+
+
+frame_hub = FrameHub(queue_size=2)
+capture = None
+
+
 @app.route('/')
 def index():
     return "Video server is running. Access the stream at /video_feed"
@@ -14,36 +105,17 @@ def index():
 @app.route('/video_feed')
 def video_feed():
     def generate():
-        # Start the GStreamer process that saves frames to disk
-        process = subprocess.Popen([
-            'gst-launch-1.0',
-            'v4l2src', 'device=/dev/video0', '!',
-            'video/x-raw,framerate=15/1,width=640,height=480', '!',
-            'videoconvert', '!', 
-            'jpegenc', 'quality=70', '!',
-            'multifilesink', 'location=/tmp/frame.jpg', 'max-files=1'
-        ])
-        
+        subscription = frame_hub.subscribe()
         try:
-            # Stream the frames as they're created
             while True:
-                try:
-                    # Small delay to not overload the system
-                    time.sleep(0.03)
-                    
-                    if os.path.exists('/tmp/frame.jpg'):
-                        with open('/tmp/frame.jpg', 'rb') as f:
-                            frame_data = f.read()
-                            
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-                except Exception as e:
-                    print(f"Error reading frame: {e}")
-                    time.sleep(0.1)
+                # Sleeps until the capture thread publishes a new frame
+                frame = subscription.get(timeout=10)
+                if frame is None:
+                    break
+                yield frame.part
         finally:
-            process.terminate()
-            process.wait()
-    
+            subscription.close()
+
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/test')
@@ -51,4 +123,22 @@ def test():
     return "API is working"
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Transport test video server")
+    parser.add_argument("--device", default="/dev/video0", help="V4L2 capture device")
+    parser.add_argument("--ring-path", default=DEFAULT_RING_PATH, help="Shared memory frame ring file")
+    parser.add_argument("--server", choices=["flask", "async"], default="flask",
+                        help="flask: thread per client; async: single asyncio event loop")
+    args = parser.parse_args()
+
+    capture = SharedCapture(frame_hub, ring_path=args.ring_path, device=args.device)
+    capture.start()
+    try:
+        if args.server == 'async':
+            from async_server import AsyncVideoServer
+            AsyncVideoServer(frame_hub, index, drive_glib=False).run(host='0.0.0.0', port=8080)
+        else:
+            app.run(host='0.0.0.0', port=8080, threaded=True)
+    finally:
+        capture.stop()
@@ -5,14 +5,22 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 
 import os
+import re
 import sys
 import logging
 import threading
 import time
-import socket
-from flask import Flask, Response, render_template
+from flask import Flask, Response, jsonify, render_template, request
 from flask_cors import CORS
 
+from demand_gate import CpuAccounting, DemandGate, find_element, find_gate_pad
+from detection_store import DetectionFeed, DetectionStore, query_category, query_polygons, submit_feedback
+from frame_hub import FrameHub, TcpMultipartSource
+from h264_stream import Fmp4Session, H264Stream
+from pipeline_cache import DEFAULT_CACHE_PATH, PipelineProbeCache, probe_key
+from renditions import AdaptiveClient, RenditionSet, client_options
+from snapshot import Snapshot
+
 # Set up logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -27,110 +35,156 @@ Gst.init(None)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# How the JPEG branch ends. 'appsink' hands encoded buffers straight to the
+# frame hub in-process; 'tcp' keeps the multipart tcpserversink on port 5000
+# for out-of-process consumers. The appsink is async=false because the
+# demand gate drops everything ahead of it while idle, and a sink that
+# never prerolls would hold the pipeline in PAUSED.
+JPEG_SINKS = {
+    'appsink': "appsink name=jpegsink emit-signals=true sync=false async=false max-buffers=2 drop=true",
+    'tcp': "multipartmux boundary=spionisto ! tcpserversink host=127.0.0.1 port=5000",
+}
+
+# Tried in order until one reaches READY; the winner is remembered across
+# restarts by pipeline_cache
+PIPELINE_OPTIONS = [
+    """
+    v4l2src device=/dev/video0 !
+    video/x-raw,framerate=30/1,width=640,height=480 !
+    videoconvert !
+    tee name=t !
+    queue !
+    xvimagesink sync=false t. !
+    queue !
+    jpegenc quality=70 !
+    jpegparse !
+    {jpeg_sink}
+    """,
+
+    """
+    v4l2src device=/dev/video0 !
+    video/x-raw,framerate=30/1,width=640,height=480 !
+    videoconvert !
+    tee name=t !
+    queue !
+    xvimagesink sync=false t. !
+    queue !
+    jpegenc quality=85 !
+    {jpeg_sink}
+    """,
+
+
+    # Option 1: Auto Video Source
+    """
+    testsrc ! 
+    videoconvert ! 
+    video/x-raw, width=640, height=480, framerate=15/1 ! 
+    jpegenc quality=70 ! 
+    {jpeg_sink}
+    """,
+
+    # Option 2: Video Test Source. Live, so it runs at the caps framerate:
+    # the appsink doesn't sync to the clock, so nothing else would throttle it
+    """
+    videotestsrc pattern=ball is-live=true ! 
+    videoconvert ! 
+    video/x-raw, width=640, height=480, framerate=15/1 ! 
+    jpegenc quality=70 ! 
+    {jpeg_sink}
+    """,
+
+    # Option 3: X11 Screen Capture
+    """
+    ximagesrc use-damage=false ! 
+    videoconvert ! 
+    videoscale ! 
+    video/x-raw, width=1280, height=720, framerate=15/1 ! 
+    jpegenc quality=70 ! 
+    {jpeg_sink}
+    """,
+
+    # Option 4: Frei0r Plasma Source (if available). It has no is-live, so
+    # identity holds it to the clock instead
+    """
+    frei0r-src-plasma ! 
+    videoconvert ! 
+    video/x-raw, width=640, height=480, framerate=15/1 ! 
+    identity sync=true ! 
+    jpegenc quality=70 ! 
+    {jpeg_sink}
+    """
+]
+
 class GStreamerPipeline:
-    def __init__(self):
-        logger.info("Creating GStreamer pipeline")
+    def __init__(self, mode='appsink', frame_hub=None, test_source=False, probe_cache=None,
+                 renditions=None, lazy=True, h264=None):
+        logger.info(f"Creating GStreamer pipeline (mode={mode}, "
+                    f"renditions={[r.name for r in renditions.renditions] if renditions else 'off'}, "
+                    f"h264={'on' if h264 else 'off'})")
+        self.mode = mode
+        self.frame_hub = frame_hub
+        self.probe_cache = probe_cache
+        self.renditions = renditions
+        self.h264 = h264
         
-        # Log available elements (helpful for debugging)
-        self._log_available_elements()
+        pipeline_options = PIPELINE_OPTIONS
+        if test_source:
+            pipeline_options = [p for p in pipeline_options if 'videotestsrc' in p]
+        # Remove newlines and extra spaces for cleaner parsing
+        candidates = [' '.join(p.format(jpeg_sink=JPEG_SINKS[mode]).split()) for p in pipeline_options]
+        if renditions:
+            # One capture, a tee and one valve-gated encode per rendition
+            candidates = [c for c in map(renditions.rewrite_pipeline, candidates) if c]
+        if h264:
+            # A shared x264enc branch off the capture tee for /video.mp4
+            candidates = [c for c in map(h264.rewrite_pipeline, candidates) if c]
         
-        # Try different pipeline options - we'll start with autovideosrc
-        pipeline_options = [
-            """
-            v4l2src device=/dev/video0 !
-            video/x-raw,framerate=30/1,width=640,height=480 !
-            videoconvert !
-            tee name=t !
-            queue !
-            xvimagesink sync=false t. !
-            queue !
-            jpegenc quality=70 !
-            jpegparse !
-            multipartmux boundary=--frame !
-            tcpserversink host=127.0.0.1 port=5000
-            """,
-
-            """
-            v4l2src device=/dev/video0 !
-            video/x-raw,framerate=30/1,width=640,height=480 !
-            videoconvert !
-            tee name=t !
-            queue !
-            xvimagesink sync=false t. !
-            queue !
-            jpegenc quality=85 !
-            multipartmux boundary=spionisto !
-            tcpserversink host=127.0.0.1 port=5000
-            """,
-
-
-            # Option 1: Auto Video Source
-            """
-            testsrc ! 
-            videoconvert ! 
-            video/x-raw, width=640, height=480, framerate=15/1 ! 
-            jpegenc quality=70 ! 
-            multipartmux boundary=spionisto ! 
-            tcpserversink host=127.0.0.1 port=5000
-            """,
-            
-            # Option 2: Video Test Source
-            """
-            videotestsrc pattern=ball ! 
-            videoconvert ! 
-            video/x-raw, width=640, height=480, framerate=15/1 ! 
-            jpegenc quality=70 ! 
-            multipartmux boundary=spionisto ! 
-            tcpserversink host=127.0.0.1 port=5000
-            """,
-            
-            # Option 3: X11 Screen Capture
-            """
-            ximagesrc use-damage=false ! 
-            videoconvert ! 
-            videoscale ! 
-            video/x-raw, width=1280, height=720, framerate=15/1 ! 
-            jpegenc quality=70 ! 
-            multipartmux boundary=spionisto ! 
-            tcpserversink host=127.0.0.1 port=5000
-            """,
-            
-            # Option 4: Frei0r Plasma Source (if available)
-            """
-            frei0r-src-plasma ! 
-            videoconvert ! 
-            video/x-raw, width=640, height=480, framerate=15/1 ! 
-            jpegenc quality=70 ! 
-            multipartmux boundary=spionisto ! 
-            tcpserversink host=127.0.0.1 port=5000
-            """
-        ]
-        
-        # Try each pipeline option until one works
+        # A previous start already found what works on this host
         self.pipeline = None
-        for i, pipeline_str in enumerate(pipeline_options):
-            logger.info(f"Trying pipeline option {i+1}:\n{pipeline_str.strip()}")
-            try:
-                # Remove newlines and extra spaces for cleaner parsing
-                clean_pipeline = ' '.join(pipeline_str.split())
-                self.pipeline_string = clean_pipeline
-                self.pipeline = Gst.parse_launch(self.pipeline_string)
-                
-                # Test if the pipeline can enter the READY state
-                ret = self.pipeline.set_state(Gst.State.READY)
-                if ret == Gst.StateChangeReturn.SUCCESS or ret == Gst.StateChangeReturn.ASYNC:
-                    logger.info(f"Successfully created pipeline with option {i+1}")
-                    break
+        self.from_cache = False
+        key = probe_key(candidates) if probe_cache else None
+        if probe_cache:
+            cached = probe_cache.load(key)
+            if cached in candidates:
+                logger.info("Using cached pipeline from an earlier probe")
+                self.pipeline = self._try_pipeline(cached)
+                if self.pipeline is not None:
+                    self.pipeline_string = cached
+                    self.from_cache = True
                 else:
-                    logger.warning(f"Pipeline option {i+1} created but couldn't enter READY state")
-                    self.pipeline = None
-            except gi.repository.GLib.Error as e:
-                logger.error(f"Failed to create pipeline option {i+1}: {e}")
-                self.pipeline = None
+                    logger.warning("Cached pipeline no longer works, probing again")
+                    probe_cache.invalidate()
         
         if self.pipeline is None:
-            logger.error("All pipeline options failed. Exiting.")
-            sys.exit(1)
+            self._probe(candidates)
+            if probe_cache:
+                probe_cache.store(key, self.pipeline_string)
+        
+        # The reader must split the stream on whatever boundary this option uses
+        match = re.search(r'multipartmux boundary=(\S+)', self.pipeline_string)
+        self.boundary = match.group(1) if match else 'ThisRandomString'
+        
+        if renditions:
+            renditions.configure(self.pipeline_string)
+            renditions.attach(self.pipeline, self._on_new_jpeg)
+        elif mode == 'appsink':
+            self.appsink = self.pipeline.get_by_name('jpegsink')
+            self.appsink.connect("new-sample", self._on_new_jpeg)
+        if h264:
+            h264.attach(self.pipeline)
+        
+        # Only encode while someone is watching. In tcp mode the consumers
+        # are out of process, so the branch always runs.
+        self.gate = None
+        self.cpu = CpuAccounting()
+        if lazy and mode == 'appsink':
+            encoder = self.pipeline.get_by_name('rtee') if renditions else find_element(self.pipeline, 'jpegenc')
+            pad = find_gate_pad(encoder) if encoder else None
+            if pad is not None:
+                hubs = [r.hub for r in renditions.renditions] if renditions else [frame_hub]
+                self.gate = DemandGate(pad, hubs, cpu=self.cpu)
+        if self.gate is None:
+            self.cpu.state = 'active'
             
         self.loop = GLib.MainLoop()
         
@@ -141,11 +195,42 @@ class GStreamerPipeline:
         bus.connect("message::eos", self._on_eos)
         bus.connect("message::state-changed", self._on_state_changed)
         
+    def _probe(self, candidates):
+        # Log available elements (helpful for debugging)
+        self._log_available_elements()
+        
+        # Try each pipeline option until one works
+        for i, pipeline_str in enumerate(candidates):
+            logger.info(f"Trying pipeline option {i+1}:\n{pipeline_str}")
+            self.pipeline = self._try_pipeline(pipeline_str)
+            if self.pipeline is not None:
+                logger.info(f"Successfully created pipeline with option {i+1}")
+                self.pipeline_string = pipeline_str
+                return
+        
+        logger.error("All pipeline options failed. Exiting.")
+        sys.exit(1)
+    
+    @staticmethod
+    def _try_pipeline(pipeline_str):
+        """The parsed pipeline if it can enter the READY state, else None"""
+        try:
+            pipeline = Gst.parse_launch(pipeline_str)
+        except gi.repository.GLib.Error as e:
+            logger.error(f"Failed to create pipeline: {e}")
+            return None
+        ret = pipeline.set_state(Gst.State.READY)
+        if ret == Gst.StateChangeReturn.SUCCESS or ret == Gst.StateChangeReturn.ASYNC:
+            return pipeline
+        logger.warning("Pipeline created but couldn't enter READY state")
+        pipeline.set_state(Gst.State.NULL)
+        return None
+    
     def _log_available_elements(self):
         """Log a few key GStreamer elements to help with debugging"""
         elements_to_check = [
             "autovideosrc", "videotestsrc", "ximagesrc", "v4l2src", 
-            "jpegenc", "pngenc", "videoconvert", "tcpserversink"
+            "jpegenc", "pngenc", "videoconvert", "tcpserversink", "appsink", "x264enc"
         ]
         
         logger.info("Checking for key GStreamer elements:")
@@ -156,6 +241,39 @@ class GStreamerPipeline:
             else:
                 logger.warning(f"  ✗ {element} - Not available")
     
+    def _on_new_jpeg(self, sink, hub=None):
+        # jpegenc emits one complete JPEG per buffer, so no re-framing is needed
+        sample = sink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.OK
+        
+        buf = sample.get_buffer()
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            logger.warning("Failed to map JPEG buffer")
+            return Gst.FlowReturn.OK
+        try:
+            pts = buf.pts if buf.pts != Gst.CLOCK_TIME_NONE else None
+            (hub or self.frame_hub).publish(bytes(map_info.data), timestamp=self._capture_time(sample, pts),
+                                            pts=pts)
+        finally:
+            buf.unmap(map_info)
+        return Gst.FlowReturn.OK
+    
+    def _capture_time(self, sample, pts):
+        """Wall-clock capture time of a buffer, mapped through the pipeline
+        clock, so X-Timestamp excludes encode time and lines up with the
+        wall-clock "timestamp" of detection messages. None (publish time)
+        if the buffer has no PTS."""
+        clock = self.pipeline.get_clock()
+        if pts is None or clock is None:
+            return None
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return None
+        age = clock.get_time() - self.pipeline.get_base_time() - running_time
+        return time.time() - max(0, age) / Gst.SECOND
+
     def _on_error(self, bus, message):
         err, debug = message.parse_error()
         logger.error(f"GStreamer error: {err}")
@@ -171,24 +289,31 @@ class GStreamerPipeline:
             old_state, new_state, pending_state = message.parse_state_changed()
             logger.debug(f"Pipeline state changed from {Gst.Element.state_get_name(old_state)} to {Gst.Element.state_get_name(new_state)}")
         
-    def start(self):
+    def start(self, run_loop=True):
         # Start the pipeline
         logger.info("Starting GStreamer pipeline")
         ret = self.pipeline.set_state(Gst.State.PLAYING)
         if ret == Gst.StateChangeReturn.FAILURE:
             logger.error("Failed to set pipeline to playing state")
+            if self.probe_cache:
+                # Don't trust the cached choice on the next start
+                self.probe_cache.invalidate()
             return False
             
         logger.info("GStreamer pipeline started")
+        self.cpu.start()
         
-        # Start the GLib main loop in a separate thread
-        threading.Thread(target=self._run_loop, daemon=True).start()
+        # Start the GLib main loop in a separate thread, unless the caller
+        # drives the default GLib context itself (asyncio server mode)
+        if run_loop:
+            threading.Thread(target=self._run_loop, daemon=True).start()
         return True
     
     def stop(self):
         # Stop the pipeline
         logger.info("Stopping GStreamer pipeline")
         self.pipeline.set_state(Gst.State.NULL)
+        self.cpu.stop()
         if self.loop.is_running():
             self.loop.quit()
         logger.info("GStreamer pipeline stopped")
@@ -202,117 +327,118 @@ class GStreamerPipeline:
 # Create the GStreamer pipeline
 pipeline = None
 
-def generate_frames():
-    logger.info("Client connected, starting to generate frames")
-    client_socket = None
+# Single reader of the GStreamer output, shared by every /video_feed client
+frame_hub = FrameHub(queue_size=2)
+frame_source = None
+# Latest-frame stills for pollers that don't need a stream
+snapshot = Snapshot(frame_hub)
+# Recent detection results for /api/polygons, filled by --detections
+detection_store = DetectionStore()
+detection_feed = None
+# Set in --renditions mode; the full rendition publishes into frame_hub
+rendition_set = None
+# Set with --h264; serves /video.mp4
+h264_stream = None
+
+def generate_frames(options=None):
+    logger.info("Client connected, subscribing to frame hub")
+    if rendition_set:
+        subscription = AdaptiveClient(rendition_set, **options)
+    else:
+        subscription = frame_hub.subscribe()
     try:
-        # Connect to the TCP server started by GStreamer
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.settimeout(10)  # Set timeout for connection
-        logger.debug("Connecting to TCP server at 127.0.0.1:5000")
-        client_socket.connect(('127.0.0.1', 5000))
-        logger.info("Connected to TCP server successfully")
-        
-        # Read and yield the JPEG frames
-        boundary = b'--spionisto\r\nContent-Type: image/jpeg\r\n\r\n'
-        logger.debug(f"Using boundary: {boundary}")
-        frame = b''
-        frame_count = 0
-        last_log_time = time.time()
-        bytes_received = 0
-        
         # Yield a test frame to confirm the route works at all
         logger.debug("Yielding initial test frame")
         yield (b'--frame\r\nContent-Type: text/plain\r\n\r\nConnection established, waiting for first frame...\r\n')
         
         while True:
-            try:
-                logger.debug("Waiting to receive data...")
-                data = client_socket.recv(4096)
-                if not data:
-                    logger.warning("Received empty data, connection may be closed")
+            frame = subscription.get(timeout=10)
+            if frame is None:
+                if subscription.closed:
                     break
-                
-                bytes_received += len(data)
-                logger.debug(f"Received {len(data)} bytes (total: {bytes_received})")
-                frame += data
-                
-                # Log raw data periodically for debugging
-                if frame_count == 0:
-                    logger.debug(f"First 100 bytes of data: {data[:100]}")
-                
-                boundary_pos = frame.find(boundary)
-                logger.debug(f"Searching for boundary - found at position: {boundary_pos}")
-                
-                while boundary_pos != -1:
-                    jpeg_data = frame[:boundary_pos]
-                    frame = frame[boundary_pos + len(boundary):]
-                    
-                    if jpeg_data:
-                        frame_count += 1
-                        logger.debug(f"Found frame #{frame_count} with size {len(jpeg_data)} bytes")
-                        
-                        # Log frame rate every 5 seconds
-                        current_time = time.time()
-                        if current_time - last_log_time > 5:
-                            logger.info(f"Frame rate: {frame_count / (current_time - last_log_time):.2f} fps")
-                            frame_count = 0
-                            last_log_time = current_time
-                        
-                        # Try to detect if this is actually a JPEG
-                        if jpeg_data.startswith(b'\xff\xd8') and jpeg_data.endswith(b'\xff\xd9'):
-                            logger.debug("Frame has valid JPEG markers")
-                        else:
-                            logger.warning(f"Frame may not be a valid JPEG - first 10 bytes: {jpeg_data[:10]}")
-                            
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + jpeg_data + b'\r\n')
-                    else:
-                        logger.warning("Empty JPEG data segment found")
-                    
-                    boundary_pos = frame.find(boundary)
-                
-            except socket.timeout:
-                logger.warning("Socket timeout during frame reading")
+                logger.warning("Timeout waiting for video frames")
                 yield (b'--frame\r\nContent-Type: text/plain\r\n\r\nTimeout waiting for video frames\r\n')
                 break
-            except Exception as e:
-                logger.error(f"Error reading frames: {e}")
-                yield (b'--frame\r\nContent-Type: text/plain\r\n\r\nError reading frames: ' + str(e).encode('utf-8') + b'\r\n')
-                break
+            sent_at = time.monotonic()
+            yield frame.part
+            if rendition_set:
+                # The generator resumes once the server has written the part
+                subscription.record_send(len(frame.part), time.monotonic() - sent_at)
                 
-    except ConnectionRefusedError:
-        logger.error("Connection refused - GStreamer TCP server not running")
-        yield (b'--frame\r\n'
-               b'Content-Type: text/plain\r\n\r\n'
-               b'Error: Could not connect to video stream server (connection refused)\r\n')
-    except socket.timeout:
-        logger.error("Connection timeout - GStreamer TCP server not responding")
-        yield (b'--frame\r\n'
-               b'Content-Type: text/plain\r\n\r\n'
-               b'Error: Connection timeout while connecting to video server\r\n')
     except Exception as e:
         logger.error(f"Error in generate_frames: {e}", exc_info=True)
         yield (b'--frame\r\n'
                b'Content-Type: text/plain\r\n\r\n'
                b'Error: ' + str(e).encode('utf-8') + b'\r\n')
     finally:
-        if client_socket:
-            logger.info("Closing client socket")
-            client_socket.close()
+        logger.info("Client disconnected")
+        subscription.close()
 
 @app.route('/video_feed')
 def video_feed():
     # Return the video stream as a multipart response
     logger.info("Received request for /video_feed")
-    return Response(generate_frames(),
+    options = client_options(rendition_set, request.args) if rendition_set else None
+    return Response(generate_frames(options),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+def generate_fmp4():
+    logger.info("Client connected, subscribing to H.264 stream")
+    subscription = h264_stream.hub.subscribe()
+    session = Fmp4Session(h264_stream)
+    try:
+        while True:
+            frame = subscription.get(timeout=10)
+            if frame is None:
+                if not subscription.closed:
+                    logger.warning("Timeout waiting for H.264 frames")
+                break
+            for chunk in session.packetize(frame):
+                yield chunk
+    finally:
+        logger.info(f"H.264 client disconnected (resyncs={session.resyncs})")
+        subscription.close()
+
+@app.route('/video.mp4')
+def video_mp4():
+    # Fragmented MP4, one fragment per frame, for <video> and ffplay
+    logger.info("Received request for /video.mp4")
+    if h264_stream is None:
+        return Response("H.264 streaming is off, start the server with --h264\n",
+                        status=404, mimetype='text/plain')
+    return Response(generate_fmp4(), mimetype='video/mp4',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/snapshot.jpg')
+def snapshot_jpg():
+    # ?thumb=1 for a downscaled copy, ?max_age_ms= to accept a slightly older frame
+    status, headers, body = snapshot.respond(request.args, request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
+@app.route('/api/polygons')
+def api_polygons():
+    return Response(query_polygons(detection_store, request.args), mimetype='application/json')
+
+@app.route('/api/polygons/category/<category>')
+def api_polygons_category(category):
+    return Response(query_category(detection_store, category, request.args), mimetype='application/json')
+
+@app.route('/api/polygons/<polygon_id>/feedback', methods=['POST'])
+def api_polygon_feedback(polygon_id):
+    status, body = submit_feedback(detection_store, polygon_id, request.get_json(silent=True))
+    return jsonify(body), status
+
 @app.route('/')
 def index():
     # A simple status page
     logger.info("Received request for index page")
+    return render_status_page()
+
+def render_status_page():
     pipeline_str = pipeline.pipeline_string if pipeline else "No pipeline created"
+    hub_stats = frame_hub.get_stats()
+    snapshot_stats = snapshot.get_stats()
+    store_stats = detection_store.get_stats()
     
     return f"""
     <html>
@@ -329,28 +455,156 @@ def index():
         <body>
             <h1>Video Server Status</h1>
             <div class="status success">Server is running</div>
-            <div class="status info">Access the video stream at <a href="/video_feed">/video_feed</a></div>
+            <div class="status info">Access the video stream at <a href="/video_feed">/video_feed</a>,
+            the latest frame at <a href="/snapshot.jpg">/snapshot.jpg</a>
+            (<a href="/snapshot.jpg?thumb=1">thumbnail</a>)</div>
             <h2>Debug Information</h2>
-            <p>Current GStreamer pipeline:</p>
+            <p>Current GStreamer pipeline (mode: {pipeline.mode if pipeline else "n/a"}, 
+            {"from probe cache" if pipeline and pipeline.from_cache else "probed at startup"}):</p>
             <pre>{pipeline_str}</pre>
+            <p>Frame hub:</p>
+            <pre>Subscribers: {hub_stats['subscribers']}
+Frames published: {hub_stats['frames_published']}
+Frames dropped (slow clients): {hub_stats['frames_dropped']}</pre>
+            <p>Snapshots:</p>
+            <pre>Requests: {snapshot_stats['requests']} ({snapshot_stats['not_modified']} not modified)
+Thumbnails made: {snapshot_stats['thumbnails_made']}
+Pollers keeping the encoder awake: {'yes' if snapshot_stats['polling'] else 'no'}</pre>
+            <p>Detections (<a href="/api/polygons">/api/polygons</a>, 
+            {"fed from " + detection_feed.url if detection_feed else "no --detections feed"}):</p>
+            <pre>Frames stored: {store_stats['frames']} of {store_stats['max_frames']}
+Detections stored: {store_stats['detections']}
+Feedback received: {store_stats['feedback']}</pre>
+            {render_encoding()}
+            {render_renditions()}
+            {render_h264()}
         </body>
     </html>
     """
 
+def render_encoding():
+    if not pipeline:
+        return ""
+    if pipeline.gate is None:
+        cpu = pipeline.cpu.get_stats()
+        return f"<p>Encoding: always on, CPU {_percent(cpu['active_cpu_percent'])}</p>"
+    stats = pipeline.gate.get_stats()
+    return f"""<p>Encoding (paused while no client is connected):</p>
+            <pre>State: {stats['state']} for {stats['since_s']:.0f}s
+Frames skipped while idle: {stats['frames_skipped']}
+CPU while idle: {_percent(stats['idle_cpu_percent'])}
+CPU while active: {_percent(stats['active_cpu_percent'])}</pre>"""
+
+def _percent(value):
+    return "n/a" if value is None else f"{value:.1f}%"
+
+def render_renditions():
+    if not rendition_set:
+        return ""
+    rows = ''.join(
+        f"<tr><td><a href=\"/video_feed?rendition={name}\">{name}</a></td><td>{s['width']}x{s['height']}</td>"
+        f"<td>{s['quality']}</td><td>{s['subscribers']}</td><td>{'yes' if s['encoding'] else 'no'}</td>"
+        f"<td>{s['frames_published']}</td></tr>"
+        for name, s in rendition_set.get_stats().items()
+    )
+    return f"""<p>Renditions (<code>/video_feed?width=&amp;quality=&amp;fps=&amp;rendition=</code>):</p>
+            <table border="1" cellpadding="4">
+            <tr><th>Name</th><th>Size</th><th>Quality</th><th>Clients</th><th>Encoding</th><th>Frames</th></tr>
+            {rows}
+            </table>"""
+
+def render_h264():
+    if not h264_stream:
+        return ""
+    stats = h264_stream.get_stats()
+    return f"""<p>H.264 at <a href="/video.mp4">/video.mp4</a> ({h264_stream.bitrate} kbit/s, GOP {h264_stream.gop}):</p>
+            <pre>Clients: {stats['subscribers']}
+Encoding: {'yes' if stats['encoding'] else 'no'}
+Frames published: {stats['frames_published']}
+Keyframe requests: {stats['keyframe_requests']}</pre>
+            <video src="/video.mp4" controls muted playsinline preload="none" width="320"></video>"""
+
 def start_flask():
     # Start the Flask server
     logger.info("Starting Flask server")
     app.run(host='0.0.0.0', port=8080, debug=False)
 
+def start_async():
+    # Start the asyncio server; it also drives the GLib context for the bus
+    from async_server import AsyncVideoServer
+    AsyncVideoServer(frame_hub, render_status_page, renditions=rendition_set,
+                     h264=h264_stream, snapshot=snapshot, detections=detection_store).run(host='0.0.0.0', port=8080)
+
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="GStreamer MJPEG video server")
+    parser.add_argument("--mode", choices=sorted(JPEG_SINKS), default="appsink",
+                        help="appsink: capture JPEGs in-process; tcp: serve multipart on "
+                             "127.0.0.1:5000 for out-of-process consumers too")
+    parser.add_argument("--server", choices=["flask", "async"], default="flask",
+                        help="flask: thread per client; async: single asyncio event loop")
+    parser.add_argument("--test-source", action="store_true",
+                        help="Use videotestsrc instead of probing cameras/screens")
+    parser.add_argument("--renditions", action="store_true",
+                        help="Encode full/half/thumbnail JPEG renditions (appsink mode) and give each "
+                             "client the one its connection keeps up with")
+    parser.add_argument("--always-encode", action="store_true",
+                        help="Keep encoding JPEGs while no client is connected")
+    parser.add_argument("--h264", action="store_true",
+                        help="Also serve a low-bandwidth H.264 stream as fragmented MP4 at /video.mp4")
+    parser.add_argument("--h264-bitrate", type=int, default=1000,
+                        help="x264enc bitrate in kbit/s for --h264")
+    parser.add_argument("--h264-gop", type=int, default=30,
+                        help="Maximum frames between keyframes for --h264")
+    parser.add_argument("--snapshot-thumb-width", type=int, default=320,
+                        help="Width of /snapshot.jpg?thumb=1 images")
+    parser.add_argument("--detections", nargs='?', const='ws://127.0.0.1:9001/',
+                        help="Store results from the detection WebSocket server (default "
+                             "ws://127.0.0.1:9001/) for /api/polygons")
+    parser.add_argument("--detection-frames", type=int, default=1800,
+                        help="Frames of detection results kept for /api/polygons")
+    parser.add_argument("--probe-cache", default=DEFAULT_CACHE_PATH,
+                        help="File remembering which pipeline option works on this host")
+    parser.add_argument("--no-probe-cache", action="store_true",
+                        help="Probe every pipeline option on each start")
+    args = parser.parse_args()
+    if args.renditions and args.mode != 'appsink':
+        parser.error("--renditions requires --mode appsink")
+    
     try:
         # Create and start the GStreamer pipeline
         logger.info("Starting video server")
-        pipeline = GStreamerPipeline()
+        probe_cache = None if args.no_probe_cache else PipelineProbeCache(args.probe_cache)
+        snapshot.thumb_width = args.snapshot_thumb_width
+        detection_store = DetectionStore(max_frames=args.detection_frames)
+        if args.detections:
+            detection_feed = DetectionFeed(detection_store, args.detections)
+            detection_feed.start()
+        if args.renditions:
+            rendition_set = RenditionSet(primary_hub=frame_hub)
+        if args.h264:
+            if Gst.ElementFactory.find('x264enc'):
+                h264_stream = H264Stream(bitrate=args.h264_bitrate, gop=args.h264_gop)
+            else:
+                logger.warning("x264enc not available (gst-plugins-ugly), /video.mp4 disabled")
+        pipeline = GStreamerPipeline(mode=args.mode, frame_hub=frame_hub,
+                                     test_source=args.test_source, probe_cache=probe_cache,
+                                     renditions=rendition_set, lazy=not args.always_encode,
+                                     h264=h264_stream)
         
-        if pipeline.start():
-            # Start the Flask server (this will block until the server is stopped)
-            start_flask()
+        if pipeline.start(run_loop=args.server == 'flask'):
+            if args.mode == 'tcp':
+                # Read the TCP output once and fan it out to all clients
+                frame_source = TcpMultipartSource(frame_hub, host='127.0.0.1', port=5000,
+                                                  boundary=pipeline.boundary)
+                frame_source.start()
+            
+            # Start the HTTP server (this will block until the server is stopped)
+            if args.server == 'async':
+                start_async()
+            else:
+                start_flask()
         else:
             logger.error("Failed to start GStreamer pipeline")
             sys.exit(1)
@@ -362,6 +616,16 @@ if __name__ == '__main__':
         logger.error(f"Unexpected error: {e}", exc_info=True)
     finally:
         # Clean up
+        if frame_source:
+            frame_source.stop()
+        if detection_feed:
+            detection_feed.stop()
+        snapshot.close()
+        frame_hub.close()
+        if rendition_set:
+            rendition_set.close()
+        if h264_stream:
+            h264_stream.hub.close()
         if pipeline:
             pipeline.stop()
         logger.info("Video server shut down")
\ No newline at end of file
@@ -1,83 +1,65 @@
 #!/usr/bin/env python3
 
+import argparse
+import logging
+import os
 import sys
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import GObject, Gst, GLib
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PyBridge'))
+from pipeline_builder import FpsReport, PipelineBuilder
+
 # Initialize GStreamer
 Gst.init(None)
 
-def main():
+def main(args):
     # Create the main loop
     loop = GLib.MainLoop()
     
-    # Create gstreamer pipeline
+    # Create gstreamer pipeline; NV elements that don't work here get CPU
+    # equivalents and the renderer a headless sink when there is no display
     print("Creating Pipeline \n")
-    pipeline = Gst.Pipeline()
-    if not pipeline:
-        sys.stderr.write("Unable to create Pipeline \n")
-        return
-    
-    # Create v4l2 camera source element
-    print("Creating Camera Source \n")
-    source = Gst.ElementFactory.make("v4l2src", "camera-source")
-    if not source:
-        sys.stderr.write("Unable to create v4l2src \n")
-        return
-    
-    # Set the camera device path
-    source.set_property('device', '/dev/video0')
-    
-    # Create capsfilter for camera output format
-    print("Creating Caps Filter \n")
-    caps_filter = Gst.ElementFactory.make("capsfilter", "caps-filter")
-    if not caps_filter:
-        sys.stderr.write("Unable to create capsfilter \n")
-        return
-    
-    # Configure camera output format
-    # Modify this based on what your camera supports
-    caps = Gst.Caps.from_string(
-        "video/x-raw, width=640, height=480, framerate=30/1"
-    )
-    caps_filter.set_property("caps", caps)
+    builder = PipelineBuilder(cpu_only=args.cpu, headless=True if args.headless else None)
+    pipeline = builder.pipeline
     
-    # Create converter for format conversion
-    print("Creating Converter \n")
-    videoconvert = Gst.ElementFactory.make("videoconvert", "video-converter")
-    if not videoconvert:
-        sys.stderr.write("Unable to create videoconvert \n")
-        return
-    
-    # Create nvvideoconvert for NVIDIA-optimized conversion
-    print("Creating NVIDIA Video Converter \n")
-    nvvidconv = Gst.ElementFactory.make("nvvideoconvert", "nvidia-converter")
-    if not nvvidconv:
-        sys.stderr.write("Unable to create nvvideoconvert \n")
-        return
-    
-    # Create video sink
-    print("Creating Video Sink \n")
-    sink = Gst.ElementFactory.make("autovideosink", "video-renderer")
-    if not sink:
-        sys.stderr.write("Unable to create autovideosink \n")
+    try:
+        # Create v4l2 camera source element, or a live test pattern where
+        # there is no camera (CI, build hosts)
+        if os.path.exists(args.device):
+            print("Creating Camera Source \n")
+            builder.make("v4l2src", "camera-source", {"device": args.device})
+        else:
+            print("No camera at %s, creating test source \n" % args.device)
+            builder.make("videotestsrc", "camera-source", {"is-live": True})
+        
+        # Create capsfilter for camera output format
+        # Modify this based on what your camera supports
+        print("Creating Caps Filter \n")
+        builder.make("capsfilter", "caps-filter", {
+            "caps": Gst.Caps.from_string("video/x-raw, width=640, height=480, framerate=30/1")})
+        
+        # Create converter for format conversion
+        print("Creating Converter \n")
+        builder.make("videoconvert", "video-converter")
+        
+        # Create nvvideoconvert for NVIDIA-optimized conversion
+        print("Creating NVIDIA Video Converter \n")
+        builder.make("nvvideoconvert", "nvidia-converter")
+        
+        # Create video sink
+        print("Creating Video Sink \n")
+        sink = builder.make("autovideosink", "video-renderer")
+        
+        # Link the elements
+        print("Linking elements in the Pipeline \n")
+        builder.link()
+    except RuntimeError as e:
+        sys.stderr.write("%s \n" % e)
         return
-    
-    # Add elements to pipeline
-    print("Adding elements to Pipeline \n")
-    pipeline.add(source)
-    pipeline.add(caps_filter)
-    pipeline.add(videoconvert)
-    pipeline.add(nvvidconv)
-    pipeline.add(sink)
-    
-    # Link the elements
-    print("Linking elements in the Pipeline \n")
-    source.link(caps_filter)
-    caps_filter.link(videoconvert)
-    videoconvert.link(nvvidconv)
-    nvvidconv.link(sink)
+    print(f"Pipeline: {builder.describe()}\n")
+    fps = FpsReport(sink, interval=args.fps_interval)
     
     # Create bus to listen for messages
     bus = pipeline.get_bus()
@@ -95,6 +77,10 @@ def main():
     
     # Cleanup
     pipeline.set_state(Gst.State.NULL)
+    fps.stop()
+    summary = fps.summary()
+    rate = f"{summary['fps']:.1f}" if summary['fps'] else "n/a"
+    print(f"Rendered {summary['frames']} frames in {summary['seconds']:.1f}s ({rate} fps)\n")
 
 def bus_call(bus, message, loop):
     t = message.type
@@ -112,4 +98,14 @@ def bus_call(bus, message, loop):
     return True
 
 if __name__ == '__main__':
-    main()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Show a V4L2 camera through nvvideoconvert")
+    parser.add_argument("--device", default="/dev/video0")
+    parser.add_argument("--cpu", action="store_true",
+                        help="Use the CPU equivalents of the NVIDIA elements even if they work")
+    parser.add_argument("--headless", action="store_true",
+                        help="Render to a fakesink (the default when there is no display)")
+    parser.add_argument("--fps-interval", type=float, default=5.0,
+                        help="Seconds between fps reports, 0 to only report at the end")
+
+    main(parser.parse_args())
@@ -1,93 +1,176 @@
 #!/usr/bin/env python3
 
+import argparse
+import json
+import logging
+import os
+import resource
 import sys
+import tempfile
+import time
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import GObject, Gst, GLib
 
-# Initialize GStreamer
-Gst.init(None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PyBridge'))
+from decoder_selection import select_decoder
+from pipeline_builder import FpsReport, PipelineBuilder, TracerLog, enable_tracers
+from proc_stats import read_memory_mb
+
+def build_pipeline(args, location, benchmark=False, say=print):
+    """(PipelineBuilder, sink). Benchmarks end in a fakesink sync=false
+    instead of the renderer, so the chain runs as fast as it can."""
+    # Create gstreamer pipeline; NV elements that don't work here get CPU
+    # equivalents and the renderer a headless sink when there is no display
+    say("Creating Pipeline \n")
+    builder = PipelineBuilder(cpu_only=args.cpu, headless=True if args.headless else None)
+
+    # Create source element and set the input file location
+    say("Creating Source \n")
+    builder.make("filesrc", "file-source", {"location": location})
 
-def main(args):
-    # Create the main loop
-    loop = GLib.MainLoop()
-    
-    # Create gstreamer pipeline
-    print("Creating Pipeline \n")
-    pipeline = Gst.Pipeline()
-    if not pipeline:
-        sys.stderr.write("Unable to create Pipeline \n")
-        return
-    
-    # Create source element
-    print("Creating Source \n")
-    source = Gst.ElementFactory.make("filesrc", "file-source")
-    if not source:
-        sys.stderr.write("Unable to create Source \n")
-        return
-    
-    # Set the input file location
-    source.set_property('location', args[1])
-    
     # Create parser element
-    print("Creating H264Parser \n")
-    h264parser = Gst.ElementFactory.make("h264parse", "h264-parser")
-    if not h264parser:
-        sys.stderr.write("Unable to create h264 parser \n")
-        return
-    
-    # Create decoder element
-    print("Creating Decoder \n")
-    decoder = Gst.ElementFactory.make("nvv4l2decoder", "nvv4l2-decoder")
-    if not decoder:
-        sys.stderr.write("Unable to create Nvv4l2 Decoder \n")
-        return
-    
+    say("Creating H264Parser \n")
+    builder.make("h264parse", "h264-parser")
+
+    # Create decoder element: the fastest one that works here, NVIDIA first
+    if args.cpu:
+        say("Creating Decoder (CPU) \n")
+        # The NVIDIA topology with every element mapped to the CPU
+        builder.make("nvv4l2decoder", "decoder")
+        nvidia = True
+    else:
+        candidate = select_decoder()
+        say("Creating Decoder (%s) \n" % candidate.decoder)
+        builder.make(candidate.decoder, "decoder", candidate.decoder_props)
+        nvidia = candidate.family == 'nvidia'
+
     # Create converter for video format
-    print("Creating Converter \n")
-    nvvidconv = Gst.ElementFactory.make("nvvideoconvert", "convertor")
-    if not nvvidconv:
-        sys.stderr.write("Unable to create nvvidconv \n")
-        return
-    
+    say("Creating Converter \n")
+    builder.make("nvvideoconvert" if nvidia else "videoconvert", "convertor")
+
     # Create video sink
-    print("Creating EGLSink \n")
-    sink = Gst.ElementFactory.make("nveglglessink", "nvvideo-renderer")
-    if not sink:
-        sys.stderr.write("Unable to create egl sink \n")
-        return
-    
-    # Add elements to pipeline
-    print("Adding elements to Pipeline \n")
-    pipeline.add(source)
-    pipeline.add(h264parser)
-    pipeline.add(decoder)
-    pipeline.add(nvvidconv)
-    pipeline.add(sink)
-    
+    if benchmark:
+        sink = builder.make("fakesink", "benchmark-sink", {"sync": False})
+    else:
+        say("Creating EGLSink \n" if nvidia else "Creating video sink \n")
+        sink = builder.make("nveglglessink" if nvidia else "autovideosink", "nvvideo-renderer")
+
     # Link the elements
-    print("Linking elements in the Pipeline \n")
-    source.link(h264parser)
-    h264parser.link(decoder)
-    decoder.link(nvvidconv)
-    nvvidconv.link(sink)
-    
+    say("Linking elements in the Pipeline \n")
+    builder.link()
+    return builder, sink
+
+def main(args):
+    # Create the main loop
+    loop = GLib.MainLoop()
+
+    try:
+        builder, sink = build_pipeline(args, args.files[0])
+    except RuntimeError as e:
+        sys.stderr.write("%s \n" % e)
+        return
+    pipeline = builder.pipeline
+    print("Pipeline: %s \n" % builder.describe())
+    fps = FpsReport(sink, interval=args.fps_interval)
+
     # Create bus to listen for messages
     bus = pipeline.get_bus()
     bus.add_signal_watch()
     bus.connect("message", bus_call, loop)
-    
+
     # Start playing
     print("Starting pipeline \n")
     pipeline.set_state(Gst.State.PLAYING)
-    
+
     try:
         loop.run()
     except:
         pass
-    
+
     # Cleanup
     pipeline.set_state(Gst.State.NULL)
+    fps.stop()
+    summary = fps.summary()
+    print("Rendered %d frames in %.1fs (%s fps) \n" % (
+        summary["frames"], summary["seconds"], "%.1f" % summary["fps"] if summary["fps"] else "n/a"))
+
+def run_to_eos(pipeline, timeout):
+    """Play until EOS without a main loop; (seconds, error message or None)"""
+    bus = pipeline.get_bus()
+    start = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        msg = bus.timed_pop_filtered(int(timeout * Gst.SECOND), Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        elapsed = time.perf_counter() - start
+        if msg is None:
+            return elapsed, "timed out after %ss" % timeout
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            return elapsed, err.message
+        return elapsed, None
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+def reset_peak_rss():
+    """Restart VmHWM so each file gets its own peak (Linux 4.0+)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def benchmark(args):
+    """Decode every file args.iterations times, as fast as possible, and
+    return the JSON report. Initializes GStreamer itself, since the tracers
+    have to be set up first."""
+    tracer_log = None
+    if not args.no_trace:
+        fd, trace_path = tempfile.mkstemp(prefix='gst-tracer-', suffix='.log')
+        os.close(fd)
+        enable_tracers(trace_path)
+        tracer_log = TracerLog(trace_path)
+    Gst.init(None)
+    try:
+        return _benchmark_files(args, tracer_log)
+    finally:
+        if tracer_log:
+            os.unlink(tracer_log.path)
+
+def _benchmark_files(args, tracer_log):
+    report = {"iterations": args.iterations, "cpus": os.cpu_count(), "files": []}
+    for path in args.files:
+        peak_is_per_file = reset_peak_rss()
+        runs = []
+        for iteration in range(args.iterations):
+            builder, sink = build_pipeline(args, path, benchmark=True, say=lambda *a: None)
+            report.setdefault("pipeline", builder.describe())
+            report.setdefault("substitutions", {name: used for name, (_, used) in builder.substitutions.items()})
+            counter = FpsReport(sink, interval=0)
+            elapsed, error = run_to_eos(builder.pipeline, args.timeout)
+            run = {"frames": counter.frames, "seconds": round(elapsed, 3),
+                   "fps": counter.frames / elapsed if elapsed and not error else None}
+            if error:
+                run["error"] = error
+            runs.append(run)
+            logging.info(f"{path} #{iteration + 1}: {counter.frames} frames in {elapsed:.2f}s"
+                         + (f" ({error})" if error else f" = {run['fps']:.1f} fps"))
+        rates = [r["fps"] for r in runs if r["fps"]]
+        result = {
+            "file": path,
+            "frames": runs[-1]["frames"],
+            "fps": {"mean": sum(rates) / len(rates), "min": min(rates), "max": max(rates)} if rates else None,
+            "runs": runs,
+            # VmHWM: this file's peak, or the process's so far if it couldn't be reset
+            "peak_rss_mb": read_memory_mb(os.getpid())[1],
+            "peak_rss_per_file": peak_is_per_file,
+        }
+        if tracer_log:
+            result.update(tracer_log.read())
+        report["files"].append(result)
+    report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return report
 
 def bus_call(bus, message, loop):
     t = message.type
@@ -101,8 +184,36 @@ def bus_call(bus, message, loop):
     return True
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        sys.stderr.write("usage: %s <H264 filename>\n" % sys.argv[0])
-        sys.exit(1)
-    
-    main(sys.argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Play an H.264 elementary stream file, or benchmark "
+                                                 "decoding several as fast as possible")
+    parser.add_argument("files", nargs="+", metavar="file", help="H.264 file(s); playback uses the first")
+    parser.add_argument("--cpu", action="store_true",
+                        help="Use the CPU equivalents of the NVIDIA elements even if they work")
+    parser.add_argument("--headless", action="store_true",
+                        help="Render to a fakesink (the default when there is no display)")
+    parser.add_argument("--fps-interval", type=float, default=5.0,
+                        help="Seconds between fps reports, 0 to only report at the end")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Decode into a fakesink sync=false and print a JSON report")
+    parser.add_argument("--iterations", type=int, default=3, help="Benchmark runs per file")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed per benchmark run")
+    parser.add_argument("--no-trace", action="store_true",
+                        help="Skip the proctime/latency tracers, which cost some throughput")
+    parser.add_argument("--output", help="Also write the benchmark report to this file")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        try:
+            report = benchmark(args)
+        except RuntimeError as e:
+            sys.stderr.write("%s \n" % e)
+            sys.exit(1)
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    else:
+        # Initialize GStreamer
+        Gst.init(None)
+        main(args)